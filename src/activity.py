@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+"""Compound x strain activity aggregates of the result values."""
+
+import logging
+import zipfile
+from collections import Counter
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+from constants import (
+    ACTIVITY_MATRIX_FILE,
+    ACTIVITY_SUMMARY_FILE,
+    MIC_RESULT_TYPES,
+    RESULT_BOUND_COLS,
+)
+
+logger = logging.getLogger("__name__")
+
+ACTIVITY_KEYS = ["CPD_ID", "BACTERIAL_STRAIN_NAME", "RESULT_TYPE", "RESULT_UNIT"]
+# Statistics stored in the matrix file, in addition to the number of results
+MATRIX_STATS = ["min", "median", "geometric_mean", "mic50", "mic90", "max"]
+
+
+def _get_values(df: pd.DataFrame) -> pd.DataFrame:
+    """Keep the activity keys and the numeric value of every result."""
+    lower, upper = RESULT_BOUND_COLS
+    if df.empty or lower not in df.columns:
+        return pd.DataFrame(columns=ACTIVITY_KEYS + ["value"])
+
+    # Censored results like "> 64" are counted at their bound
+    values = df[lower].combine_first(df[upper])
+
+    keys = {}
+    for column in ACTIVITY_KEYS:
+        if column in df.columns:
+            keys[column] = df[column].astype(object)
+        else:
+            keys[column] = pd.Series(np.nan, index=df.index, dtype=object)
+
+    data = pd.DataFrame({**keys, "value": values})
+    data["RESULT_UNIT"] = data["RESULT_UNIT"].fillna("")
+    return data.dropna(subset=["CPD_ID", "BACTERIAL_STRAIN_NAME", "RESULT_TYPE", "value"])
+
+
+def _ranked_value(data: pd.DataFrame, groups: pd.Index, target: pd.Series) -> pd.Series:
+    """Value of the result at the `target` rank of every group, from 1 in value order."""
+    selected = data[(data["rank"] >= target) & (data["rank"] - data["count"] < target)]
+    return selected.set_index(ACTIVITY_KEYS)["value"].reindex(groups)
+
+
+def get_activity_values(dfs: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Method to get the activity keys and numeric value of the results of several data sets.
+    :param dfs: Harmonized data with typed result bounds
+    :return: One row per result with a value
+    """
+    data = pd.concat([_get_values(df) for df in dfs], ignore_index=True)
+    data["value"] = data["value"].astype(float)
+    return data
+
+
+def count_activity_values(data: pd.DataFrame) -> pd.DataFrame:
+    """Method to collapse result values into the number of results per group and value.
+    :param data: Values returned by get_activity_values
+    :return: One row per compound, strain, result type, unit and value, with its count
+    """
+    return (
+        data.groupby(ACTIVITY_KEYS + ["value"], sort=False)
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+
+
+def update_activity_counts(counts: Counter, dfs: Iterable[pd.DataFrame]) -> None:
+    """Method to add the result values of data sets to a histogram of values per group.
+
+    The histogram only grows with the distinct values of every group, not with
+    the number of results, and gives the same summary as the values themselves.
+    :param counts: Number of results per (compound, strain, result type, unit, value)
+    :param dfs: Harmonized data with typed result bounds
+    """
+    data = count_activity_values(get_activity_values(dfs))
+    keys = data[ACTIVITY_KEYS + ["value"]].itertuples(index=False, name=None)
+    counts.update(dict(zip(keys, data["count"])))
+
+
+def get_activity_counts(counts: Counter) -> pd.DataFrame:
+    """Method to turn a histogram of update_activity_counts into values for summarize_activity."""
+    data = pd.DataFrame(list(counts), columns=ACTIVITY_KEYS + ["value"])
+    data["value"] = data["value"].astype(float)
+    data["count"] = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+    return data
+
+
+def get_activity_summary(dfs: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """Main function to summarize the results per compound, strain, result type and unit.
+
+    The MIC50 and MIC90 are the lowest values inhibiting at least 50% and 90%
+    of the results, they are only computed for the MIC_RESULT_TYPES. The
+    geometric mean is only computed for positive values.
+    :param dfs: Harmonized data with typed result bounds
+    :return: One row per compound, strain, result type and unit
+    """
+    return summarize_activity(get_activity_values(dfs))
+
+
+def summarize_activity(data: pd.DataFrame) -> pd.DataFrame:
+    """Method to summarize result values, e.g. the values of several shards.
+    :param data: Values returned by get_activity_values, or by count_activity_values
+        and get_activity_counts, whose `count` column weighs every value
+    :return: One row per compound, strain, result type and unit
+    """
+    if data.empty:
+        return pd.DataFrame(columns=ACTIVITY_KEYS + ["n"] + MATRIX_STATS)
+
+    if "count" not in data.columns:
+        data = data.assign(count=1)
+
+    data = data.sort_values(ACTIVITY_KEYS + ["value"], kind="stable")
+    grouped = data.groupby(ACTIVITY_KEYS, sort=False)
+
+    # Rank of the last result of every value, counting the results of lower values
+    data["rank"] = grouped["count"].cumsum()
+    data["n"] = grouped["count"].transform("sum")
+    data["log"] = np.log(data["value"].where(data["value"] > 0)) * data["count"]
+    data["positive"] = data["count"].where(data["value"] > 0, 0)
+
+    summary = grouped.agg(n=("count", "sum"), min=("value", "min"), max=("value", "max"))
+    summary["median"] = (
+        _ranked_value(data, summary.index, (data["n"] + 1) // 2)
+        + _ranked_value(data, summary.index, data["n"] // 2 + 1)
+    ) / 2
+
+    positive = data.groupby(ACTIVITY_KEYS, sort=False)[["log", "positive"]].sum()
+    summary["geometric_mean"] = np.exp(positive["log"] / positive["positive"]).where(
+        positive["positive"] == summary["n"]
+    )
+    is_mic = summary.index.get_level_values("RESULT_TYPE").isin(MIC_RESULT_TYPES)
+    for stat, fraction in (("mic50", 0.5), ("mic90", 0.9)):
+        target = np.ceil(fraction * data["n"]).astype(int)
+        summary[stat] = _ranked_value(data, summary.index, target).where(is_mic)
+
+    return summary[["n"] + MATRIX_STATS].reset_index()
+
+
+def get_activity_matrix(summary: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Method to arrange the summary as dense (measure, compound, strain) arrays.
+
+    A measure is a result type and unit pair. Missing combinations are NaN,
+    and zero results for the `n` array.
+    :param summary: Summary returned by get_activity_summary
+    :return: Arrays keyed by name, as written to the matrix file
+    """
+    compounds = pd.Index(sorted(summary["CPD_ID"].astype(str).unique()))
+    strains = pd.Index(sorted(summary["BACTERIAL_STRAIN_NAME"].astype(str).unique()))
+    measures = (
+        summary[["RESULT_TYPE", "RESULT_UNIT"]]
+        .astype(str)
+        .drop_duplicates()
+        .sort_values(["RESULT_TYPE", "RESULT_UNIT"])
+    )
+    measure_index = pd.MultiIndex.from_frame(measures)
+
+    i = measure_index.get_indexer(
+        pd.MultiIndex.from_frame(summary[["RESULT_TYPE", "RESULT_UNIT"]].astype(str))
+    )
+    j = compounds.get_indexer(summary["CPD_ID"].astype(str))
+    k = strains.get_indexer(summary["BACTERIAL_STRAIN_NAME"].astype(str))
+    shape = (len(measures), len(compounds), len(strains))
+
+    arrays = {
+        "compounds": compounds.to_numpy(dtype=str),
+        "strains": strains.to_numpy(dtype=str),
+        "result_types": measures["RESULT_TYPE"].to_numpy(dtype=str),
+        "units": measures["RESULT_UNIT"].to_numpy(dtype=str),
+        "n": np.zeros(shape, dtype=np.int64),
+    }
+    arrays["n"][i, j, k] = summary["n"].to_numpy()
+
+    for stat in MATRIX_STATS:
+        arrays[stat] = np.full(shape, np.nan)
+        arrays[stat][i, j, k] = summary[stat].to_numpy(dtype=float)
+
+    return arrays
+
+
+def write_activity_matrix(summary: pd.DataFrame, path: str) -> None:
+    """Write the activity matrix as an uncompressed .npz file, which open_activity_matrix maps.
+    :param summary: Summary returned by get_activity_summary
+    :param path: Path of the .npz file
+    """
+    arrays = get_activity_matrix(summary)
+    np.savez(path, **arrays)
+
+    logger.warning(f"Wrote activity matrix of shape {arrays['n'].shape} to {path}")
+
+
+def open_activity_matrix(path: str) -> Dict[str, np.ndarray]:
+    """Open the arrays of an activity matrix file as read-only memory maps.
+
+    np.load reads .npz members into memory, but the members written by
+    np.savez are stored uncompressed and can be mapped in place.
+    :param path: Path of a file written by write_activity_matrix
+    :return: Arrays keyed by name
+    """
+    arrays = {}
+
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} in {path} is compressed")
+
+            # The member data follows its local file header
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+
+            arrays[info.filename[: -len(".npy")]] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+
+    return arrays
+
+
+def export_activity(
+    invivo_df: pd.DataFrame, invitro_df: pd.DataFrame, exp_dir: str
+) -> pd.DataFrame:
+    """Write the activity summary and matrix of the processed data of an experiment.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param exp_dir: Experiment directory
+    :return: Activity summary
+    """
+    summary = get_activity_summary([invivo_df, invitro_df])
+    export_activity_summary(summary, exp_dir)
+    return summary
+
+
+def export_activity_summary(summary: pd.DataFrame, exp_dir: str) -> None:
+    """Write an activity summary and its matrix to an experiment directory."""
+    summary.to_csv(f"{exp_dir}/{ACTIVITY_SUMMARY_FILE}", sep="\t", index=False)
+
+    if not summary.empty:
+        write_activity_matrix(summary, f"{exp_dir}/{ACTIVITY_MATRIX_FILE}")
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""Export of the node and edge tables of the graph as Parquet or Arrow files."""
+
+import logging
+import os
+import re
+from numbers import Number
+from typing import Dict, List
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from collector import build_graph
+
+logger = logging.getLogger("__name__")
+
+# Edge properties holding measurements, exported with an additional float column
+NUMERIC_PROPERTIES = ["result value"]
+
+
+def _file_name(text: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]+", "_", text).strip("_")
+
+
+def _to_array(values: list) -> pa.Array:
+    """Turn a list of property values into a typed Arrow array.
+
+    Columns holding only numbers keep their numeric type, all others become
+    dictionary encoded strings.
+    """
+    present = [v for v in values if v is not None]
+    if present and all(
+        isinstance(v, Number) and not isinstance(v, bool) for v in present
+    ):
+        return pa.array(values, type=pa.float64())
+
+    strings = pa.array(
+        [None if v is None else str(v) for v in values], type=pa.string()
+    )
+    return strings.dictionary_encode()
+
+
+def _to_table(columns: Dict[str, pa.Array], rows: List[dict]) -> pa.Table:
+    """Combine fixed columns with one column per property found in the rows."""
+    columns = dict(columns)
+
+    for key in sorted({key for row in rows for key in row}):
+        values = [row.get(key) for row in rows]
+        columns[key] = _to_array(values)
+
+        if key in NUMERIC_PROPERTIES:
+            numeric = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce")
+            columns[f"{key} (numeric)"] = pa.array(numeric, type=pa.float64())
+
+    return pa.table(columns)
+
+
+def _write_table(table: pa.Table, path: str, file_format: str) -> str:
+    if file_format == "parquet":
+        path = f"{path}.parquet"
+        pq.write_table(table, path)
+    else:
+        # Uncompressed Arrow IPC files can be memory mapped without decoding
+        path = f"{path}.arrow"
+        with pa.OSFile(path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    return path
+
+
+def read_table(path: str) -> pa.Table:
+    """Method to open an exported table through a memory map.
+
+    Columns are backed by Arrow buffers and are not copied into Python objects.
+    :param path: Path of a .parquet or .arrow file
+    """
+    if path.endswith(".arrow"):
+        return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+    return pq.read_table(path, memory_map=True)
+
+
+def export_tables(
+    node_dict: dict,
+    relationships: list,
+    out_dir: str,
+    file_format: str = "parquet",
+) -> List[str]:
+    """Write one table per node label and one per relation type.
+    :param node_dict: Node dictionary produced by add_nodes
+    :param relationships: Relations produced by add_relations
+    :param out_dir: Output directory
+    :param file_format: "parquet" or "arrow"
+    :return: List of written files
+    """
+    if file_format not in ("parquet", "arrow"):
+        raise ValueError(f"Unknown file format: {file_format}")
+
+    os.makedirs(f"{out_dir}/nodes", exist_ok=True)
+    os.makedirs(f"{out_dir}/edges", exist_ok=True)
+
+    files = []
+    node_ids = {}
+    label_names = {}
+    next_id = 0
+
+    for label, nodes in node_dict.items():
+        if not nodes:
+            continue
+
+        ids = list(range(next_id, next_id + len(nodes)))
+        for idx, node in zip(ids, nodes.values()):
+            node_ids[id(node)] = idx
+            label_names[id(node)] = label
+        next_id += len(nodes)
+
+        table = _to_table(
+            {
+                "id": pa.array(ids, type=pa.int64()),
+                "key": _to_array(list(nodes)),
+            },
+            [dict(node) for node in nodes.values()],
+        )
+        files.append(
+            _write_table(table, f"{out_dir}/nodes/{_file_name(label)}", file_format)
+        )
+
+    edges: Dict[str, list] = {}
+    for rel in relationships:
+        edges.setdefault(type(rel).__name__, []).append(rel)
+
+    for rel_type, rels in edges.items():
+        table = _to_table(
+            {
+                "start_id": pa.array(
+                    [node_ids[id(rel.start_node)] for rel in rels], type=pa.int64()
+                ),
+                "end_id": pa.array(
+                    [node_ids[id(rel.end_node)] for rel in rels], type=pa.int64()
+                ),
+                "start_label": _to_array(
+                    [label_names[id(rel.start_node)] for rel in rels]
+                ),
+                "end_label": _to_array(
+                    [label_names[id(rel.end_node)] for rel in rels]
+                ),
+            },
+            [dict(rel) for rel in rels],
+        )
+        files.append(
+            _write_table(table, f"{out_dir}/edges/{_file_name(rel_type)}", file_format)
+        )
+
+    return files
+
+
+def export_arrow(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    out_dir: str,
+    file_format: str = "parquet",
+) -> List[str]:
+    """Main function to export the graph as analytics tables.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param out_dir: Output directory
+    :param file_format: "parquet" or "arrow"
+    :return: List of written files
+    """
+    node_dict, collector = build_graph(invivo_df=invivo_df, invitro_df=invitro_df)
+
+    files = export_tables(
+        node_dict=node_dict,
+        relationships=collector.relationships,
+        out_dir=out_dir,
+        file_format=file_format,
+    )
+
+    logger.warning(f"Wrote {len(files)} tables to {out_dir}")
+
+    return files
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the pipeline stages at increasing data sizes."""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+import openpyxl
+import pandas as pd
+
+from collector import get_node_dict
+from constants import DATA_DIR
+from data_preprocessing import get_ontology_mapper, harmonize_data, optimize_dtypes
+from main import get_invitro_data, get_invivo_data, load_data, read_processed_data
+from nodes import add_nodes
+from relations import add_relations
+from synthetic_data import generate_experiment
+from write_plan import RecordingTransaction
+
+logger = logging.getLogger("__name__")
+
+DEFAULT_TEMPLATE_DIR = f"{DATA_DIR}/exps/dummy"
+DEFAULT_ROWS = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_WORKBOOKS = [1, 4]
+DEFAULT_RESULT_SHEETS = [3, 10]
+
+# Columns made unique per copy when scaling the data, so that the number of
+# studies and experiments grows with the number of rows
+SCALED_KEY_COLS = ["STUDYID", "EXPID"]
+
+
+def _timeit(func: Callable, repeat: int, setup: Optional[Callable] = None) -> List[float]:
+    """Time a function, calling setup (untimed) before every run."""
+    timings = []
+
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def _result(stage: str, timings: List[float], rows: int, **params) -> dict:
+    best = min(timings)
+    return {
+        "stage": stage,
+        "rows": rows,
+        **params,
+        "seconds": timings,
+        "best": best,
+        "median": statistics.median(timings),
+        "rows_per_second": rows / best if best else None,
+    }
+
+
+def scale_data(df: pd.DataFrame, rows: int) -> pd.DataFrame:
+    """Method to repeat the rows of a data frame up to the given number of rows.
+
+    Every copy of the data gets its own study and experiment ids.
+    :param df: Harmonized data
+    :param rows: Number of rows of the scaled data
+    """
+    if df.empty:
+        return df
+
+    copies = -(-rows // len(df))
+    frames = []
+
+    for copy in range(copies):
+        frame = df.astype(object)
+        if copy:
+            for column in SCALED_KEY_COLS:
+                if column in frame.columns:
+                    frame[column] = frame[column].map(
+                        lambda x: f"{x}-{copy}" if pd.notna(x) else x
+                    )
+        frames.append(frame)
+
+    scaled = pd.concat(frames, ignore_index=True).iloc[:rows]
+    return optimize_dtypes(scaled.reset_index(drop=True))
+
+
+def get_raw_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop the ontology annotations of harmonized data to get harmonize_data input."""
+    columns = [column for column in df.columns if not column.endswith("_annotation")]
+    return df[columns].astype(object).where(df[columns].notna(), None)
+
+
+def make_workbooks(
+    template_dir: str,
+    out_dir: str,
+    workbooks: int,
+    result_sheets: int,
+) -> List[str]:
+    """Method to copy the workbooks of an experiment with a given number of result sheets.
+    :param template_dir: Experiment directory with one in-vivo and one in-vitro workbook
+    :param out_dir: Directory of the copies
+    :param workbooks: Number of in-vivo and of in-vitro workbooks
+    :param result_sheets: Number of ExperimentResults sheets per in-vivo workbook
+    :return: Paths of the written workbooks
+    """
+    paths = []
+    templates = sorted(f for f in os.listdir(template_dir) if f.endswith(".xlsx"))
+
+    for name in templates:
+        path = os.path.join(template_dir, name)
+        # Cached formula values, which pandas reads and a re-saved workbook would lose
+        wb = openpyxl.load_workbook(path, data_only=True)
+        results = [ws for ws in wb.worksheets if ws.title.startswith("ExperimentResults")]
+
+        if results:
+            for ws in results[result_sheets:]:
+                wb.remove(ws)
+            for idx in range(len(results), result_sheets):
+                copy = wb.copy_worksheet(results[idx % len(results)])
+                copy.title = f"ExperimentResults_{idx + 1:02d}"
+
+        base = os.path.join(out_dir, "0_" + name)
+        wb.save(base)
+        paths.append(base)
+
+        for idx in range(1, workbooks):
+            copy_path = os.path.join(out_dir, f"{idx}_{name}")
+            shutil.copyfile(base, copy_path)
+            paths.append(copy_path)
+
+    return paths
+
+
+def bench_parse(
+    template_dir: str, workbooks: int, result_sheets: int, repeat: int
+) -> dict:
+    """Benchmark get_invivo_data/get_invitro_data on copies of the template workbooks."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = make_workbooks(template_dir, tmp_dir, workbooks, result_sheets)
+        parsed_rows = []
+
+        def parse():
+            parsed_rows.clear()
+            for path in paths:
+                xl = pd.ExcelFile(path)
+                if len(xl.sheet_names) > 3:
+                    parsed_rows.append(len(get_invivo_data(xl)))
+                else:
+                    parsed_rows.append(len(get_invitro_data(xl)))
+
+        timings = _timeit(parse, repeat)
+
+    return _result(
+        "parse",
+        timings,
+        rows=sum(parsed_rows),
+        workbooks=workbooks,
+        result_sheets=result_sheets,
+    )
+
+
+def bench_mappers(repeat: int) -> dict:
+    """Benchmark the loading of the ontology mapping files."""
+    mapper = {}
+    timings = _timeit(lambda: mapper.update(get_ontology_mapper()), repeat)
+    return _result(
+        "mappers",
+        timings,
+        rows=sum(len(terms) for terms in mapper.values()),
+    )
+
+
+def bench_graph_stages(
+    invivo_df: pd.DataFrame, invitro_df: pd.DataFrame, rows: int, repeat: int
+) -> List[dict]:
+    """Benchmark harmonize_data, add_nodes and add_relations on scaled data.
+    :param invivo_df: Harmonized in-vivo data of the template
+    :param invitro_df: Harmonized in-vitro data of the template
+    :param rows: Number of rows of each of the scaled data frames
+    :param repeat: Number of runs per stage
+    """
+    invivo = scale_data(invivo_df, rows)
+    invitro = scale_data(invitro_df, rows)
+    total_rows = len(invivo) + len(invitro)
+    results = []
+
+    raw = [get_raw_data(invivo), get_raw_data(invitro)]
+    timings = _timeit(
+        lambda *dfs: [harmonize_data(df) for df in dfs],
+        repeat,
+        setup=lambda: [df.copy() for df in raw],
+    )
+    results.append(_result("harmonize", timings, rows=total_rows))
+    del raw
+
+    def run_nodes() -> Tuple[dict, RecordingTransaction]:
+        tx = RecordingTransaction()
+        node_dict = get_node_dict()
+        for df in (invivo, invitro):
+            if not df.empty:
+                node_dict = add_nodes(tx=tx, df=df, node_dict=node_dict)
+        return node_dict, tx
+
+    node_runs = []
+    timings = _timeit(lambda: node_runs.append(run_nodes()), repeat)
+    node_dict, tx = node_runs[-1]
+    del node_runs[:-1]
+    results.append(
+        _result("nodes", timings, rows=total_rows, nodes=tx.summary()["nodes"])
+    )
+
+    def run_relations(tx: RecordingTransaction) -> None:
+        add_relations(
+            invivo_df=invivo,
+            invitro_df=invitro,
+            node_mapping_dict=node_dict,
+            tx=tx,
+        )
+
+    transactions = []
+    timings = _timeit(
+        run_relations,
+        repeat,
+        setup=lambda: (transactions.append(RecordingTransaction()) or transactions[-1],),
+    )
+    results.append(
+        _result(
+            "relations",
+            timings,
+            rows=total_rows,
+            relations=transactions[-1].summary()["relationships"],
+        )
+    )
+
+    return results
+
+
+def get_revision() -> Optional[str]:
+    """Method to get the git revision of the benchmarked code, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    template_dir: str = DEFAULT_TEMPLATE_DIR,
+    rows: List[int] = DEFAULT_ROWS,
+    workbooks: List[int] = DEFAULT_WORKBOOKS,
+    result_sheets: List[int] = DEFAULT_RESULT_SHEETS,
+    repeat: int = 3,
+    stages: Optional[List[str]] = None,
+) -> dict:
+    """Main function to benchmark every stage of the pipeline.
+    :param template_dir: Experiment directory whose data is scaled up
+    :param rows: Row counts of the harmonize, nodes and relations benchmarks
+    :param workbooks: Workbook counts of the parse benchmark
+    :param result_sheets: Result sheet counts of the parse benchmark
+    :param repeat: Number of runs per benchmark
+    :param stages: Stages to run, all if None
+    :return: Benchmark report
+    """
+    stages = stages or ["parse", "mappers", "harmonize", "nodes", "relations"]
+    results = []
+
+    if "parse" in stages:
+        for n_workbooks in workbooks:
+            for n_sheets in result_sheets:
+                logger.warning(
+                    f"Benchmarking parse: {n_workbooks} workbooks, {n_sheets} result sheets"
+                )
+                results.append(bench_parse(template_dir, n_workbooks, n_sheets, repeat))
+
+    if "mappers" in stages:
+        results.append(bench_mappers(repeat))
+
+    if {"harmonize", "nodes", "relations"} & set(stages):
+        invivo_df, invitro_df = read_processed_data(exp_dir=template_dir)
+        for n_rows in rows:
+            logger.warning(f"Benchmarking graph stages: {n_rows} rows")
+            results.extend(
+                result
+                for result in bench_graph_stages(invivo_df, invitro_df, n_rows, repeat)
+                if result["stage"] in stages
+            )
+
+    return {
+        "revision": get_revision(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "template": template_dir,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def _result_key(result: dict) -> tuple:
+    return (
+        result["stage"],
+        result["rows"] if result["stage"] != "parse" else None,
+        result.get("workbooks"),
+        result.get("result_sheets"),
+    )
+
+
+def compare_reports(old: dict, new: dict, threshold: float = 0.1) -> List[dict]:
+    """Compare the best timings of two reports.
+    :param old: Report of the baseline revision
+    :param new: Report of the current revision
+    :param threshold: Relative slowdown reported as a regression
+    :return: One entry per benchmark present in both reports
+    """
+    old_results = {_result_key(result): result for result in old["results"]}
+    comparison = []
+
+    for result in new["results"]:
+        baseline = old_results.get(_result_key(result))
+        if baseline is None:
+            continue
+
+        change = result["best"] / baseline["best"] - 1
+        comparison.append(
+            {
+                "stage": result["stage"],
+                "rows": result["rows"],
+                "workbooks": result.get("workbooks"),
+                "result_sheets": result.get("result_sheets"),
+                "old": baseline["best"],
+                "new": result["best"],
+                "change": change,
+                "regression": change > threshold,
+            }
+        )
+
+    return comparison
+
+
+def print_comparison(comparison: List[dict]) -> None:
+    """Print one line per benchmark with its relative change."""
+    for entry in comparison:
+        params = f"rows={entry['rows']}"
+        if entry["workbooks"] is not None:
+            params += f" workbooks={entry['workbooks']} sheets={entry['result_sheets']}"
+
+        flag = "REGRESSION" if entry["regression"] else ""
+        print(
+            f"{entry['stage']:<10} {params:<40} {entry['old']:>9.3f}s "
+            f"{entry['new']:>9.3f}s {entry['change']:>+8.1%} {flag}"
+        )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages.")
+    parser.add_argument(
+        "--template",
+        default=DEFAULT_TEMPLATE_DIR,
+        help="Experiment directory whose data is scaled up",
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Use a generated experiment with one workbook of each type as template",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the synthetic experiment"
+    )
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--workbooks", type=int, nargs="+", default=DEFAULT_WORKBOOKS)
+    parser.add_argument(
+        "--result-sheets", type=int, nargs="+", default=DEFAULT_RESULT_SHEETS
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=["parse", "mappers", "harmonize", "nodes", "relations"],
+        help="Stages to benchmark, all by default",
+    )
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="JSON report to write"
+    )
+    parser.add_argument("--compare", help="JSON report of a baseline revision")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative slowdown reported as a regression",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        template_dir = args.template
+        if args.synthetic:
+            template_dir = tmp_dir
+            generate_experiment(template_dir, result_sheets=1, seed=args.seed)
+            load_data(exp_dir=template_dir)
+
+        report = run_benchmarks(
+            template_dir=template_dir,
+            rows=args.rows,
+            workbooks=args.workbooks,
+            result_sheets=args.result_sheets,
+            repeat=args.repeat,
+            stages=args.stages,
+        )
+        if args.synthetic:
+            report["template"] = f"synthetic (seed {args.seed})"
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.warning(f"Wrote benchmark results to {args.output}")
+
+    if not args.compare:
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+
+    comparison = compare_reports(baseline, report, threshold=args.threshold)
+    print_comparison(comparison)
+
+    return int(any(entry["regression"] for entry in comparison))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
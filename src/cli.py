@@ -0,0 +1,765 @@
+# -*- coding: utf-8 -*-
+
+"""Command line interface to build the graphs of several experiment directories.
+
+pandas, py2neo and the pipeline modules are only imported by the subcommands
+that need them, so that listing experiments or reporting mapping coverage
+starts instantly.
+"""
+
+import argparse
+import csv
+import glob
+import logging
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from instrumentation import enable, disable, stage, add_rows, write_report
+from constants import (
+    ANNOTATION_COLS,
+    DATA_DIR,
+    GRAPH_MANIFEST_FILE,
+    GRAPH_STATS_FILE,
+    METRICS_FILE,
+    PROJECTS_PROPERTY,
+    PROJECT_PROPERTY,
+    PROMETHEUS_METRICS_FILE,
+    STREAM_CHUNK_SIZE,
+    TEXT_INDEX_FILE,
+)
+
+logger = logging.getLogger("__name__")
+
+COMMANDS = ("build", "validate", "list", "coverage")
+SPREADSHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+DEFAULT_URI = "bolt://localhost:7687"
+DEFAULT_USER = "template2graph"
+
+
+def get_database_name(exp_dir: str) -> str:
+    """Method to derive a valid Neo4J database name from an experiment directory."""
+    name = os.path.basename(os.path.normpath(exp_dir)).lower()
+    name = re.sub(r"[^a-z0-9.-]+", "-", name).strip(".-")
+    if not name[:1].isalpha():
+        name = f"exp-{name}"
+    return name[:63]
+
+
+def get_experiment_dirs(patterns: List[str]) -> List[str]:
+    """Expand the experiment directory arguments, which may contain globs."""
+    exp_dirs = []
+
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for match in matches:
+            if not os.path.isdir(match):
+                logger.warning(f"Skipping {match}: not a directory")
+                continue
+            if match not in exp_dirs:
+                exp_dirs.append(match)
+
+    return exp_dirs
+
+
+def add_password_argument(parser: argparse.ArgumentParser, required: bool = True) -> None:
+    """Add the Neo4J password option, which defaults to the NEO4J_PASSWORD environment variable.
+    :param parser: Parser or subparser of a command connecting to Neo4J
+    :param required: Fail when neither the option nor the variable is set
+    """
+    parser.add_argument(
+        "--password",
+        default=os.environ.get("NEO4J_PASSWORD"),
+        required=required and "NEO4J_PASSWORD" not in os.environ,
+        help="Neo4J password, defaults to the NEO4J_PASSWORD environment variable",
+    )
+
+
+def ensure_database(credentials: Dict[str, str], database: str) -> Optional[str]:
+    """Create the database of a project if it does not exist yet.
+
+    Only Neo4J Enterprise hosts several databases. On other editions, or when
+    the database cannot be created, the project is loaded into the default
+    database instead.
+    :param credentials: Graph credentials
+    :param database: Name of the database of the project
+    :return: Name of the database to load, None for the default database
+    """
+    from py2neo import SystemGraph
+    from py2neo.cypher import cypher_escape
+    from py2neo.errors import ClientError
+
+    system = SystemGraph(
+        credentials["uri"], auth=(credentials["user"], credentials["password"])
+    )
+
+    edition = system.evaluate("CALL dbms.components() YIELD edition RETURN edition")
+    if edition != "enterprise":
+        logger.warning(
+            f"Neo4J {edition} edition has a single database, loading {database} "
+            "into the default database"
+        )
+        return None
+
+    try:
+        system.run(f"CREATE DATABASE {cypher_escape(database)} IF NOT EXISTS WAIT")
+    except ClientError as e:
+        logger.warning(
+            f"Could not create database {database}, loading it into the default "
+            f"database: {e}"
+        )
+        return None
+
+    return database
+
+
+def count_graph(graph, project: Optional[str] = None) -> Tuple[int, int]:
+    """Method to count the nodes and relations of a graph.
+    :param graph: Graph connection
+    :param project: Only count the entities of this project, see incremental.py
+    :return: Number of nodes and relations
+    """
+    from py2neo.cypher import cypher_escape
+
+    if project is None:
+        return (
+            graph.evaluate("MATCH (n) RETURN count(n)"),
+            graph.evaluate("MATCH ()-[r]->() RETURN count(r)"),
+        )
+
+    return (
+        graph.evaluate(
+            f"MATCH (n) WHERE $project IN n.{cypher_escape(PROJECTS_PROPERTY)} "
+            "RETURN count(n)",
+            project=project,
+        ),
+        graph.evaluate(
+            f"MATCH ()-[r]->() WHERE r.{cypher_escape(PROJECT_PROPERTY)} = $project "
+            "RETURN count(r)",
+            project=project,
+        ),
+    )
+
+
+def build_project(
+    exp_dir: str,
+    credentials: Dict[str, str],
+    database: Optional[str],
+    reload: bool = False,
+    incremental: bool = False,
+    workers: int = 1,
+    resume: bool = False,
+    metrics: bool = False,
+    prometheus: bool = False,
+    trace_memory: bool = False,
+    mapping_store: Optional[str] = None,
+    stats: bool = False,
+    stream: bool = False,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    measurements: bool = False,
+    text_index: bool = False,
+    pipeline: bool = False,
+    activity: bool = False,
+) -> dict:
+    """Main function to build the graph of one experiment directory.
+    :param exp_dir: Experiment directory
+    :param credentials: Graph credentials
+    :param database: Name of the Neo4J database of the project, as returned by
+        ensure_database, the default database if None
+    :param reload: Parse the workbooks even if processed data exists
+    :param incremental: Only send the changes since the last incremental run
+    :param workers: Number of concurrent writer transactions
+    :param resume: Continue an interrupted load from its ledger of committed batches
+    :param metrics: Write the statistics of every stage to the experiment directory
+    :param prometheus: Also write the statistics in the Prometheus text format
+    :param trace_memory: Record the peak Python memory of every stage
+    :param mapping_store: Mapping store used instead of the mapping files, see mapping_store.py
+    :param stats: Report the graph statistics and supernodes before loading
+    :param stream: Stream the workbooks into the graph in chunks, see streaming.py
+    :param chunk_size: Rows per chunk when streaming
+    :param measurements: Model every result row as a measurement node, see measurements.py
+    :param text_index: Write the keyword index of the free-text properties, see text_search.py
+    :param pipeline: Compute the batches while the previous ones are written, see pipeline.py
+    :param activity: Add the compound activity relations and write the activity summary,
+        see activity.py
+    :return: Summary of timings and counts
+    """
+    if mapping_store is not None:
+        from data_preprocessing import set_mapping_store
+
+        set_mapping_store(mapping_store)
+
+    if not (metrics or prometheus or trace_memory):
+        return _build_project(
+            exp_dir,
+            credentials,
+            database,
+            reload,
+            incremental,
+            workers,
+            resume,
+            stats,
+            stream,
+            chunk_size,
+            measurements,
+            text_index,
+            pipeline,
+            activity,
+        )
+
+    instrumentation = enable(trace_memory=trace_memory)
+    try:
+        return _build_project(
+            exp_dir,
+            credentials,
+            database,
+            reload,
+            incremental,
+            workers,
+            resume,
+            stats,
+            stream,
+            chunk_size,
+            measurements,
+            text_index,
+            pipeline,
+            activity,
+        )
+    finally:
+        disable()
+        write_report(
+            instrumentation,
+            f"{exp_dir}/{METRICS_FILE}",
+            f"{exp_dir}/{PROMETHEUS_METRICS_FILE}" if prometheus else None,
+            labels={"project": exp_dir, "database": database or "default"},
+        )
+
+
+def _build_project(
+    exp_dir: str,
+    credentials: Dict[str, str],
+    database: Optional[str],
+    reload: bool,
+    incremental: bool,
+    workers: int,
+    resume: bool,
+    stats: bool = False,
+    stream: bool = False,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    measurements: bool = False,
+    text_index: bool = False,
+    pipeline: bool = False,
+    activity: bool = False,
+) -> dict:
+    if stream:
+        return _stream_project(
+            exp_dir, credentials, database, workers, chunk_size, activity=activity
+        )
+
+    from py2neo import Graph
+    from incremental import get_project_name
+    from main import create_graph, load_data, read_processed_data
+
+    summary = {"project": exp_dir, "database": database}
+    start = time.perf_counter()
+
+    if reload or not os.path.exists(f"{exp_dir}/processed_invivo_data.tsv"):
+        load_data(exp_dir=exp_dir)
+
+    with stage("read_processed_data"):
+        invivo_df, invitro_df = read_processed_data(exp_dir=exp_dir)
+    add_rows("read_processed_data", len(invivo_df) + len(invitro_df))
+    summary["invivo_rows"] = len(invivo_df)
+    summary["invitro_rows"] = len(invitro_df)
+    summary["load_seconds"] = time.perf_counter() - start
+
+    if stats:
+        from graph_stats import write_graph_statistics
+
+        with stage("graph_statistics"):
+            report = write_graph_statistics(
+                invivo_df, invitro_df, exp_dir, measurements=measurements
+            )
+        summary["findings"] = len(report["findings"])
+
+    if text_index:
+        from text_search import write_text_index
+
+        with stage("text_index"):
+            write_text_index(invivo_df, invitro_df, exp_dir, measurements=measurements)
+
+    graph_start = time.perf_counter()
+    create_graph(
+        invivo_df=invivo_df,
+        invitro_df=invitro_df,
+        credentials=credentials,
+        exp_dir=exp_dir,
+        incremental=incremental,
+        workers=workers,
+        resume=resume,
+        database=database,
+        measurements=measurements,
+        pipeline=pipeline,
+        chunk_size=chunk_size,
+        activity=activity,
+    )
+    summary["graph_seconds"] = time.perf_counter() - graph_start
+
+    graph = Graph(
+        credentials["uri"],
+        auth=(credentials["user"], credentials["password"]),
+        name=database,
+    )
+    summary["nodes"], summary["relations"] = count_graph(
+        graph, get_project_name(exp_dir) if incremental else None
+    )
+    summary["total_seconds"] = time.perf_counter() - start
+
+    return summary
+
+
+def _stream_project(
+    exp_dir: str,
+    credentials: Dict[str, str],
+    database: Optional[str],
+    workers: int,
+    chunk_size: int,
+    activity: bool = False,
+) -> dict:
+    from py2neo import Graph
+    from streaming import stream_graph
+
+    summary = {"project": exp_dir, "database": database, "load_seconds": 0.0}
+    start = time.perf_counter()
+
+    graph = Graph(
+        credentials["uri"],
+        auth=(credentials["user"], credentials["password"]),
+        name=database,
+        max_size=max(workers, 1),
+    )
+
+    with stage("stream_graph"):
+        stats = stream_graph(
+            graph, exp_dir, chunk_size=chunk_size, workers=workers, activity=activity
+        )
+    add_rows("stream_graph", stats["invivo_rows"] + stats["invitro_rows"])
+
+    summary["invivo_rows"] = stats["invivo_rows"]
+    summary["invitro_rows"] = stats["invitro_rows"]
+    summary["graph_seconds"] = time.perf_counter() - start
+    summary["nodes"], summary["relations"] = count_graph(graph)
+    summary["total_seconds"] = time.perf_counter() - start
+
+    return summary
+
+
+def print_summary(summaries: List[dict]) -> None:
+    """Print one line of timings and counts per project."""
+    header = (
+        f"{'project':<30} {'database':<20} {'status':<8} {'load s':>8} {'graph s':>8} "
+        f"{'total s':>8} {'in-vivo':>8} {'in-vitro':>8} {'nodes':>8} {'relations':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for summary in summaries:
+        if "error" in summary:
+            print(
+                f"{summary['project']:<30} {summary['database'] or '(default)':<20} {'failed':<8} "
+                f"{summary['error']}"
+            )
+            continue
+
+        print(
+            f"{summary['project']:<30} {summary['database'] or '(default)':<20} {'ok':<8} "
+            f"{summary['load_seconds']:>8.1f} {summary['graph_seconds']:>8.1f} "
+            f"{summary['total_seconds']:>8.1f} {summary['invivo_rows']:>8} "
+            f"{summary['invitro_rows']:>8} {summary['nodes']:>8} "
+            f"{summary['relations']:>10}"
+        )
+
+
+def get_sheet_names(path: str) -> List[str]:
+    """Method to read the sheet names of a workbook without parsing its sheets."""
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in root.iter(f"{SPREADSHEET_NS}sheet")]
+
+
+def _count_rows(path: str) -> int:
+    with open(path, newline="") as f:
+        return max(sum(1 for _ in csv.reader(f, delimiter="\t")) - 1, 0)
+
+
+def list_experiment(exp_dir: str) -> dict:
+    """Method to describe the workbooks and processed data of an experiment directory.
+    :param exp_dir: Experiment directory
+    :return: Workbook counts and the row counts of the processed data, if any
+    """
+    info = {"project": exp_dir, "invivo_workbooks": 0, "invitro_workbooks": 0}
+
+    for path, dirs, files in os.walk(exp_dir, topdown=True):
+        for name in files:
+            if not name.endswith(".xlsx"):
+                continue
+            # Same rule as load_data
+            if len(get_sheet_names(os.path.join(path, name))) > 3:
+                info["invivo_workbooks"] += 1
+            else:
+                info["invitro_workbooks"] += 1
+
+    for kind in ("invivo", "invitro"):
+        path = f"{exp_dir}/processed_{kind}_data.tsv"
+        info[f"{kind}_rows"] = _count_rows(path) if os.path.exists(path) else None
+
+    info["manifest"] = os.path.exists(f"{exp_dir}/{GRAPH_MANIFEST_FILE}")
+    return info
+
+
+def get_mapping_coverage(exp_dir: str) -> List[dict]:
+    """Method to count the processed terms with an ontology mapping, per column.
+    :param exp_dir: Experiment directory with processed data
+    :return: One row per data kind and controlled-vocabulary column
+    """
+    coverage = []
+
+    for kind in ("invivo", "invitro"):
+        path = f"{exp_dir}/processed_{kind}_data.tsv"
+        if not os.path.exists(path):
+            logger.warning(f"No processed {kind} data in {exp_dir}")
+            continue
+
+        terms = {column: {} for column in ANNOTATION_COLS}
+        with open(path, newline="") as f:
+            reader = csv.DictReader(f, delimiter="\t")
+            columns = [
+                column
+                for column in ANNOTATION_COLS
+                if column in reader.fieldnames
+                and f"{column}_annotation" in reader.fieldnames
+            ]
+            for row in reader:
+                for column in columns:
+                    term = row[column].strip()
+                    if term:
+                        terms[column][term] = bool(row[f"{column}_annotation"])
+
+        for column in columns:
+            mapped = sum(terms[column].values())
+            coverage.append(
+                {
+                    "project": exp_dir,
+                    "data": kind,
+                    "column": column,
+                    "terms": len(terms[column]),
+                    "mapped": mapped,
+                    "unmapped": sorted(
+                        term for term, is_mapped in terms[column].items() if not is_mapped
+                    ),
+                }
+            )
+
+    return coverage
+
+
+def print_experiments(infos: List[dict]) -> None:
+    """Print one line of workbook and processed row counts per project."""
+    header = (
+        f"{'project':<30} {'in-vivo xlsx':>12} {'in-vitro xlsx':>13} "
+        f"{'in-vivo rows':>12} {'in-vitro rows':>13} {'manifest':>8}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for info in infos:
+        rows = [
+            "-" if info[key] is None else info[key]
+            for key in ("invivo_rows", "invitro_rows")
+        ]
+        print(
+            f"{info['project']:<30} {info['invivo_workbooks']:>12} "
+            f"{info['invitro_workbooks']:>13} {rows[0]:>12} {rows[1]:>13} "
+            f"{'yes' if info['manifest'] else 'no':>8}"
+        )
+
+
+def print_coverage(coverage: List[dict]) -> None:
+    """Print the mapped share of the terms of every controlled-vocabulary column."""
+    header = (
+        f"{'project':<30} {'data':<8} {'column':<36} {'terms':>6} {'mapped':>7} "
+        f"{'coverage':>8}  unmapped"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for row in coverage:
+        share = f"{row['mapped'] / row['terms']:.0%}" if row["terms"] else "-"
+        print(
+            f"{row['project']:<30} {row['data']:<8} {row['column']:<36} "
+            f"{row['terms']:>6} {row['mapped']:>7} {share:>8}  "
+            f"{', '.join(row['unmapped'][:5])}"
+        )
+
+
+def _add_build_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "experiments",
+        nargs="+",
+        help="Experiment directories or glob patterns, e.g. '../data/exps/*'",
+    )
+    parser.add_argument(
+        "--uri", default=os.environ.get("NEO4J_URI", DEFAULT_URI), help="Neo4J URI"
+    )
+    parser.add_argument(
+        "--user", default=os.environ.get("NEO4J_USER", DEFAULT_USER), help="Neo4J user"
+    )
+    add_password_argument(parser)
+    parser.add_argument(
+        "--jobs", type=int, default=4, help="Number of projects built concurrently"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of concurrent writer transactions per project",
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="Parse the workbooks even if processed data exists",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only send the changes since the last incremental run",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue interrupted loads from their ledger of committed batches",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help=f"Write timing, memory and Bolt statistics per stage to {METRICS_FILE}",
+    )
+    parser.add_argument(
+        "--prometheus",
+        action="store_true",
+        help=f"Also write the statistics to {PROMETHEUS_METRICS_FILE}",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Also record the peak Python memory per stage, which slows down the build",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help=f"Write the graph statistics and supernodes to {GRAPH_STATS_FILE} before loading",
+    )
+    parser.add_argument(
+        "--text-index",
+        action="store_true",
+        help=f"Write the keyword index of the comments and protocols to {TEXT_INDEX_FILE}",
+    )
+    parser.add_argument(
+        "--mapping-store",
+        help="SQLite mapping store built by mapping_store.py, used instead of the mapping files",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the workbooks into the graph in bounded chunks, without processed data",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=STREAM_CHUNK_SIZE,
+        help="Rows per chunk with --stream or --pipeline",
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Compute the next batches while the writers commit the previous ones",
+    )
+    parser.add_argument(
+        "--measurements",
+        action="store_true",
+        help="Model every result row as a measurement node instead of a Result relation",
+    )
+    parser.add_argument(
+        "--activity",
+        action="store_true",
+        help="Add the compound activity relations and write the activity summary and matrix",
+    )
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build and inspect one knowledge graph per experiment directory."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser(
+        "build", help="Build the graphs, the default when no command is given"
+    )
+    _add_build_arguments(build)
+
+    validate = subparsers.add_parser(
+        "validate", help="Check the lab data templates without loading them"
+    )
+    validate.add_argument("experiments", nargs="+", help="Experiment directories or globs")
+    validate.add_argument("--strict", action="store_true", help="Also fail on warnings")
+
+    listing = subparsers.add_parser(
+        "list", help="List the experiments, their workbooks and processed data"
+    )
+    listing.add_argument(
+        "experiments",
+        nargs="*",
+        default=[f"{DATA_DIR}/exps/*"],
+        help="Experiment directories or globs, all experiments by default",
+    )
+
+    coverage = subparsers.add_parser(
+        "coverage", help="Report the ontology mapping coverage of the processed data"
+    )
+    coverage.add_argument("experiments", nargs="+", help="Experiment directories or globs")
+
+    return parser
+
+
+def build(args: argparse.Namespace, exp_dirs: List[str]) -> int:
+    """Build the graphs of the experiment directories with a pool of processes."""
+    credentials = {"uri": args.uri, "user": args.user, "password": args.password}
+
+    databases = {
+        exp_dir: ensure_database(credentials, get_database_name(exp_dir))
+        for exp_dir in exp_dirs
+    }
+    shared = [exp_dir for exp_dir, database in databases.items() if database is None]
+    # Full builds clear the whole database, and concurrent ones race on the shared nodes
+    if len(shared) > 1 and not (args.jobs == 1 and args.incremental):
+        logger.error(
+            f"{len(shared)} projects would be loaded into the default database, which "
+            "is only possible one after the other with --jobs 1 --incremental"
+        )
+        return 1
+
+    summaries = []
+    jobs = max(1, min(args.jobs, len(exp_dirs)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(
+                build_project,
+                exp_dir=exp_dir,
+                credentials=credentials,
+                database=databases[exp_dir],
+                reload=args.reload,
+                incremental=args.incremental,
+                workers=args.workers,
+                resume=args.resume,
+                metrics=args.metrics,
+                prometheus=args.prometheus,
+                trace_memory=args.trace_memory,
+                mapping_store=args.mapping_store,
+                stats=args.stats,
+                stream=args.stream,
+                chunk_size=args.chunk_size,
+                measurements=args.measurements,
+                text_index=args.text_index,
+                pipeline=args.pipeline,
+                activity=args.activity,
+            ): exp_dir
+            for exp_dir in exp_dirs
+        }
+
+        for future in as_completed(futures):
+            exp_dir = futures[future]
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                logger.error(f"Building {exp_dir} failed: {e}")
+                summaries.append(
+                    {
+                        "project": exp_dir,
+                        "database": databases[exp_dir],
+                        "error": str(e),
+                    }
+                )
+
+    summaries.sort(key=lambda summary: exp_dirs.index(summary["project"]))
+    print_summary(summaries)
+
+    return int(any("error" in summary for summary in summaries))
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith("-"):
+        argv.insert(0, "build")  # former usage, without a command
+
+    args = get_parser().parse_args(argv)
+    exp_dirs = get_experiment_dirs(args.experiments)
+
+    if not exp_dirs:
+        logger.error("No experiment directories found")
+        return 1
+
+    if args.command == "build":
+        if args.stream and (
+            args.incremental
+            or args.resume
+            or args.stats
+            or args.measurements
+            or args.text_index
+        ):
+            logger.error(
+                "--stream cannot be combined with --incremental, --resume, --stats, "
+                "--measurements or --text-index"
+            )
+            return 1
+        if args.pipeline and (
+            args.stream or args.incremental or args.resume or args.measurements
+        ):
+            logger.error(
+                "--pipeline cannot be combined with --stream, --incremental, --resume "
+                "or --measurements"
+            )
+            return 1
+        return build(args, exp_dirs)
+
+    if args.command == "validate":
+        from validation import format_issues, validate_experiment
+
+        failed = False
+        for exp_dir in exp_dirs:
+            issues = validate_experiment(exp_dir)
+            print(f"{exp_dir}: {len(issues)} issues")
+            if issues:
+                print(format_issues(issues))
+            failed |= any(
+                args.strict or issue.severity == "error" for issue in issues
+            )
+        return int(failed)
+
+    if args.command == "list":
+        print_experiments([list_experiment(exp_dir) for exp_dir in exp_dirs])
+        return 0
+
+    print_coverage(
+        [row for exp_dir in exp_dirs for row in get_mapping_coverage(exp_dir)]
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
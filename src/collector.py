@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""Offline computation of the node and edge sets of the graph."""
+
+import hashlib
+import json
+import logging
+from typing import Dict, List, Tuple
+
+import pandas as pd
+from py2neo import Node, Relationship
+
+from nodes import add_nodes
+from relations import add_relations
+from constants import NODE_KEY_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+
+class GraphCollector:
+    """Stand-in for a py2neo transaction that keeps every created entity in memory."""
+
+    def __init__(self):
+        self.nodes: List[Node] = []
+        self.relationships: List[Relationship] = []
+
+    def create(self, subgraph):
+        """Record a node or relationship instead of sending it to the server.
+        :param subgraph: Node or relationship created by the pipeline
+        """
+        if isinstance(subgraph, Relationship):
+            self.relationships.append(subgraph)
+        else:
+            self.nodes.append(subgraph)
+
+
+def get_node_dict() -> Dict[str, dict]:
+    """Method to get an empty node dictionary with one entry per node label."""
+    return {label: {} for label in NODE_KEY_PROPERTIES}
+
+
+def get_node_keys(node_dict: dict) -> Dict[int, Tuple[str, str]]:
+    """Map every node object to its (label, natural key) pair.
+    :param node_dict: Node dictionary produced by add_nodes
+    :return: Dictionary from the node object id to its label and key
+    """
+    return {
+        id(node): (label, key)
+        for label, nodes in node_dict.items()
+        for key, node in nodes.items()
+    }
+
+
+def hash_content(*values) -> str:
+    """Stable content hash of JSON serializable values."""
+    payload = json.dumps(values, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def build_graph(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    measurements: bool = False,
+    activity: bool = False,
+) -> Tuple[dict, GraphCollector]:
+    """Compute the nodes and relations of the graph without a database.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param measurements: Model every result row as a measurement node, see measurements.py
+    :param activity: Add the Compound -> Bacteria activity relations, see activity.py
+    :return: Node dictionary and the collector holding all relations
+    """
+    collector = GraphCollector()
+    node_dict = get_node_dict()
+
+    if not invivo_df.empty:
+        node_dict = add_nodes(tx=collector, df=invivo_df, node_dict=node_dict)
+
+    if not invitro_df.empty:
+        node_dict = add_nodes(tx=collector, df=invitro_df, node_dict=node_dict)
+
+    if measurements:
+        from measurements import add_measurement_nodes, add_measurement_relations
+
+        for df in (invivo_df, invitro_df):
+            if not df.empty:
+                node_dict = add_measurement_nodes(tx=collector, df=df, node_dict=node_dict)
+
+    add_relations(
+        invivo_df=invivo_df,
+        invitro_df=invitro_df,
+        node_mapping_dict=node_dict,
+        tx=collector,
+        activity=activity,
+        results=not measurements,
+    )
+
+    if measurements:
+        add_measurement_relations(invivo_df, invitro_df, node_dict, collector)
+
+    logger.warning(
+        f"Computed {len(collector.nodes)} nodes and "
+        f"{len(collector.relationships)} relations"
+    )
+
+    return node_dict, collector
@@ -19,3 +19,184 @@ ANNOTATION_COLS = [
     "STATISTICAL_METHOD",
     "STUDY_TYPE",
 ]
+
+# Low cardinality columns loaded as categoricals, in addition to ANNOTATION_COLS
+# and their "_annotation" counterparts
+CATEGORICAL_COLS = [
+    "SITE",
+    "RESULT_TYPE",
+    "RESULT_OPERATOR",
+    "RESULT_STATUS",
+    "EXPERIMENT_TYPE",
+    "BATCH_ID",
+    "EXT_BATCH_ID",
+    "CPD_ID",
+    "EXT_CPD_ID",
+    "STUDYID",
+    "PROVENANCE",
+    "PROTOCOL_NAME",
+]
+
+# Result columns always kept as text, like in the processed data, whatever the
+# types read from the workbooks; numeric queries use the typed result bounds
+TEXT_COLS = [
+    "RESULT_VALUE",
+]
+
+# Text columns parsed into a float "<column>_numeric" or a date "<column>_date"
+# column, next to the result bounds parsed from the result operator and value
+TYPED_NUMERIC_COLS = ["DOSE", "TDD", "PRETREATMENT_DOSE", "ANIMAL_BODYWEIGHT_MEAN"]
+TYPED_DATE_COLS = ["STUDY_START_DATE", "EXPERIMENT_DATE"]
+RESULT_BOUND_COLS = ["RESULT_LOWER_BOUND", "RESULT_UPPER_BOUND"]
+
+# Column listing, per row, the columns whose cells could not be typed
+QUARANTINE_COL = "QUARANTINE"
+
+# Typed properties declared with range indexes, as (label or relation type,
+# property, whether it is a relation property)
+RANGE_INDEX_PROPERTIES = [
+    ("Study", "study start date (date)", False),
+    ("Experiment", "experiment date (date)", False),
+    ("Animal number", "body weight mean (numeric)", False),
+    ("ASSOCIATED", "result lower bound", True),
+    ("ASSOCIATED", "result upper bound", True),
+    ("IS TREATED WITH", "treatment dose (numeric)", True),
+    ("IS TREATED WITH", "total drug dose (numeric)", True),
+    ("IS INFECTED", "pretreatment dose (numeric)", True),
+    ("Measurement", "result type", False),
+    ("Measurement", "result lower bound", False),
+    ("Measurement", "result upper bound", False),
+]
+
+# Free-text properties searched by keyword, as (label or relation type, property,
+# whether it is a relation property), with the template columns they come from
+TEXT_SEARCH_PROPERTIES = [
+    ("Experiment", "experiment protocol", False),  # PROTOCOL_NAME
+    ("Study", "study protocol name", False),  # STUDY_PROTOCOL_NAME
+    ("Study", "provenance", False),  # PROVENANCE
+    ("Partner", "site contact", False),  # PROVENANCE
+    ("ASSOCIATED", "comments", True),  # COMMENTS
+    ("Measurement", "comments", False),  # COMMENTS
+]
+FULLTEXT_NODE_INDEX = "text_search_nodes"
+FULLTEXT_RELATION_INDEX = "text_search_relations"
+
+# Node labels and the property that uniquely identifies a node of that label
+NODE_KEY_PROPERTIES = {
+    "Animal species": "name",
+    "Animal group": "animal group",
+    "Animal number": "animal",
+    "In-vivo study type": "name",
+    "Study": "study id",
+    "Specimen": "name",
+    "Bacteria": "name",
+    "Partner": "name",
+    "Compound": "name",
+    "Batch": "batch id",
+    "Experiment type": "name",
+    "Experiment": "experiment id",
+    "Result": "type",
+    "Measurement": "measurement id",
+    "Unit": "name",
+    "Statistical method": "name",
+}
+
+GRAPH_MANIFEST_FILE = "graph_manifest.json"
+# Properties scoping the entities of an incremental run to its project, see incremental.py
+PROJECTS_PROPERTY = "projects"
+PROJECT_PROPERTY = "project"
+EDGE_HASH_PROPERTY = "edge hash"
+GRAPH_STATS_FILE = "graph_stats.json"
+
+# Rows per chunk of the streaming build, see streaming.py
+STREAM_CHUNK_SIZE = 10000
+# Chunks computed ahead of the writers by a pipelined load, see pipeline.py
+PIPELINE_QUEUE_SIZE = 4
+
+# Preview builds, see preview.py: rows sampled per combination of the strata
+# columns, and the column whose sampled values pull in all their rows within a
+# study, next to the study rows without a value
+PREVIEW_ROWS = 5
+PREVIEW_STRATA = ["SITE", "EXPERIMENT_TYPE", "RESULT_TYPE"]
+PREVIEW_KEY_COLS = {"invivo": "ANIMAL", "invitro": "EXPID"}
+PREVIEW_DIR = "preview"
+LOAD_LEDGER_FILE = "load_ledger.jsonl"
+ACTIVITY_SUMMARY_FILE = "activity_summary.tsv"
+ACTIVITY_MATRIX_FILE = "activity_matrix.npz"
+# Result types whose activity summary has a MIC50 and MIC90, see activity.py
+MIC_RESULT_TYPES = ["MIC"]
+TEXT_INDEX_FILE = "text_index.json"
+METRICS_FILE = "load_metrics.json"
+PROMETHEUS_METRICS_FILE = "load_metrics.prom"
+
+# Template columns the graph builder reads from every in-vivo workbook
+INVIVO_REQUIRED_COLS = [
+    "STUDYID",
+    "STUDY_TYPE",
+    "EXPID",
+    "SITE",
+    "PROVENANCE",
+    "SPECIES_NAME",
+    "GROUP_DESCRIPTION",
+    "ANIMAL",
+    "ANIMAL_ID",
+    "CPD_ID",
+    "EXT_CPD_ID",
+    "BATCH_ID",
+    "EXT_BATCH_ID",
+    "BACTERIAL_STRAIN_NAME",
+    "INFECTION_ROUTE",
+    "PRETREATMENT_CPD_ID",
+    "PRETREATMENT_BATCH_ID",
+    "PRETREATMENT_DOSE",
+    "PRETREATMENT_DOSING_INFO",
+    "PRETREATMENT_ROUTE_OF_ADMINSTRATION",
+    "DOSE",
+    "DOSING_INFO",
+    "FREQUENCY",
+    "TDD",
+    "ROUTE_OF_ADMINISTRATION",
+    "BIOMATERIAL",
+    "EXPERIMENT_TYPE",
+    "EXPERIMENT_DATE",
+    "PROTOCOL_NAME",
+    "CONTROL_GROUP",
+    "PLANNED_RELATIVE_TIMEPOINT",
+    "RELATIVE_TIMEPOINT",
+    "RESULT_TYPE",
+    "RESULT_OPERATOR",
+    "RESULT_VALUE",
+    "RESULT_STATUS",
+    "RESULT_UNIT",
+    "STATISTICAL_METHOD",
+    "COMMENTS",
+]
+
+# Template columns the graph builder reads from every in-vitro workbook
+INVITRO_REQUIRED_COLS = [
+    "STUDYID",
+    "EXPID",
+    "SITE",
+    "PROVENANCE",
+    "SPECIES_NAME",
+    "CPD_ID",
+    "EXT_CPD_ID",
+    "BATCH_ID",
+    "EXT_BATCH_ID",
+    "BACTERIAL_STRAIN_NAME",
+    "BACTERIAL_STRAIN_SITE_REF",
+    "BIOMATERIAL",
+    "MEDIUM",
+    "EXPERIMENT_TYPE",
+    "EXPERIMENT_DATE",
+    "PROTOCOL_NAME",
+    "CONTROL_GROUP",
+    "No of replicates",
+    "RESULT_TYPE",
+    "RESULT_OPERATOR",
+    "RESULT_VALUE",
+    "RESULT_STATUS",
+    "RESULT_UNIT",
+    "STATISTICAL_METHOD",
+    "COMMENTS",
+]
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""In-memory CSR representation of the graph for fast traversals without Neo4J."""
+
+import logging
+from numbers import Number
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from collector import build_graph
+
+logger = logging.getLogger("__name__")
+
+
+def _to_column(values: list) -> np.ndarray:
+    """Turn a list of property values into a NumPy column.
+
+    Columns holding only numbers become float arrays with NaN for missing
+    values, all others are object arrays with None for missing values.
+    """
+    present = [v for v in values if v is not None]
+    if present and all(
+        isinstance(v, Number) and not isinstance(v, bool) for v in present
+    ):
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+    column = np.empty(len(values), dtype=object)
+    column[:] = values
+    return column
+
+
+def _expand(
+    indptr: np.ndarray, frontier: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions in the CSR arrays of all edges leaving the frontier nodes.
+    :return: Edge positions and, for each of them, the index in the frontier
+    """
+    starts = indptr[frontier]
+    counts = indptr[frontier + 1] - starts
+    owners = np.repeat(np.arange(len(frontier)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets, owners
+
+
+class CSRGraph:
+    """Compact adjacency structure of the graph with one CSR block per relation type.
+
+    Nodes are identified by consecutive integers. For every relation type, the
+    outgoing and incoming edges are stored as CSR arrays (``indptr``, ``indices``)
+    together with the edge number of every entry, which indexes the columnar edge
+    properties of that type.
+    """
+
+    def __init__(
+        self,
+        node_labels: np.ndarray,
+        node_keys: np.ndarray,
+        labels: List[str],
+        edges: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        edge_properties: Dict[str, Dict[str, np.ndarray]],
+    ):
+        self.labels = labels
+        self.node_labels = node_labels
+        self.node_keys = node_keys
+        self.edge_properties = edge_properties
+
+        self._label_codes = {label: code for code, label in enumerate(labels)}
+        self._ids = {
+            (labels[code], key): idx
+            for idx, (code, key) in enumerate(zip(node_labels, node_keys))
+        }
+
+        num_nodes = len(node_keys)
+        self._out = {}
+        self._in = {}
+        for rel_type, (src, dst) in edges.items():
+            self._out[rel_type] = self._csr(src, dst, num_nodes)
+            self._in[rel_type] = self._csr(dst, src, num_nodes)
+
+    @staticmethod
+    def _csr(src: np.ndarray, dst: np.ndarray, num_nodes: int) -> tuple:
+        order = np.argsort(src, kind="stable")
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+        return indptr, dst[order], order.astype(np.int32)
+
+    @classmethod
+    def from_graph(cls, node_dict: dict, relationships: list) -> "CSRGraph":
+        """Build the CSR graph from the output of add_nodes and add_relations.
+        :param node_dict: Node dictionary produced by add_nodes
+        :param relationships: Relations produced by add_relations
+        """
+        labels = list(node_dict)
+        node_labels = []
+        keys = []
+        for code, label in enumerate(labels):
+            node_labels.extend([code] * len(node_dict[label]))
+            keys.extend(node_dict[label])
+
+        node_keys = np.empty(len(keys), dtype=object)
+        node_keys[:] = keys
+
+        ids = {
+            object_id: idx
+            for idx, object_id in enumerate(
+                id(node) for label in labels for node in node_dict[label].values()
+            )
+        }
+
+        endpoints: Dict[str, Tuple[list, list]] = {}
+        properties: Dict[str, List[dict]] = {}
+        for rel in relationships:
+            rel_type = type(rel).__name__
+            src, dst = endpoints.setdefault(rel_type, ([], []))
+            src.append(ids[id(rel.start_node)])
+            dst.append(ids[id(rel.end_node)])
+            properties.setdefault(rel_type, []).append(dict(rel))
+
+        edges = {
+            rel_type: (np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32))
+            for rel_type, (src, dst) in endpoints.items()
+        }
+
+        edge_properties = {}
+        for rel_type, rows in properties.items():
+            columns = sorted({key for row in rows for key in row})
+            edge_properties[rel_type] = {
+                column: _to_column([row.get(column) for row in rows])
+                for column in columns
+            }
+
+        return cls(
+            node_labels=np.array(node_labels, dtype=np.int16),
+            node_keys=node_keys,
+            labels=labels,
+            edges=edges,
+            edge_properties=edge_properties,
+        )
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_keys)
+
+    @property
+    def relation_types(self) -> List[str]:
+        return list(self._out)
+
+    def num_edges(self, rel_type: Optional[str] = None) -> int:
+        """Number of edges of one relation type, or of all types."""
+        types = [rel_type] if rel_type else self.relation_types
+        return sum(len(self._out[t][1]) for t in types)
+
+    def degrees(self, rel_type: Optional[str] = None, direction: str = "both") -> np.ndarray:
+        """Degree of every node for one relation type, or for all types.
+        :param rel_type: Relation type, all types if None
+        :param direction: "out", "in" or "both"
+        """
+        degrees = np.zeros(self.num_nodes, dtype=np.int64)
+        for _, (indptr, _, _) in self._blocks(rel_type, direction):
+            degrees += np.diff(indptr)
+        return degrees
+
+    def endpoints(self, rel_type: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Source and target ids of all edges of a relation type, by edge number."""
+        indptr, indices, edge_ids = self._out[rel_type]
+        src = np.empty(len(indices), dtype=np.int32)
+        dst = np.empty(len(indices), dtype=np.int32)
+        src[edge_ids] = np.repeat(np.arange(self.num_nodes, dtype=np.int32), np.diff(indptr))
+        dst[edge_ids] = indices
+        return src, dst
+
+    def node_id(self, label: str, key) -> int:
+        """Integer id of a node given its label and natural key."""
+        return self._ids[(label, key)]
+
+    def node(self, node_id: int) -> Tuple[str, object]:
+        """Label and natural key of a node id."""
+        return self.labels[self.node_labels[node_id]], self.node_keys[node_id]
+
+    def nodes(self, label: str) -> np.ndarray:
+        """Ids of all nodes with the given label."""
+        return np.flatnonzero(self.node_labels == self._label_codes[label])
+
+    def _blocks(self, rel_type: Optional[str], direction: str) -> list:
+        types = [rel_type] if rel_type else self.relation_types
+        blocks = []
+        for t in types:
+            if t not in self._out:
+                continue
+            if direction in ("out", "both"):
+                blocks.append((t, self._out[t]))
+            if direction in ("in", "both"):
+                blocks.append((t, self._in[t]))
+        return blocks
+
+    def edges(
+        self,
+        node_ids,
+        rel_type: str,
+        direction: str = "out",
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """All edges of one relation type leaving (or entering) the given nodes.
+        :param node_ids: Node id or array of node ids
+        :param rel_type: Relation type
+        :param direction: "out" or "in"
+        :return: Source ids, neighbour ids and edge numbers into the edge properties
+        """
+        frontier = np.atleast_1d(np.asarray(node_ids, dtype=np.int64))
+        indptr, indices, edge_ids = (self._out if direction == "out" else self._in)[
+            rel_type
+        ]
+        positions, owners = _expand(indptr, frontier)
+        return frontier[owners], indices[positions], edge_ids[positions]
+
+    def edge_property(self, rel_type: str, name: str, edge_ids: np.ndarray) -> np.ndarray:
+        """Values of one edge property for the given edge numbers."""
+        return self.edge_properties[rel_type][name][edge_ids]
+
+    def neighbors(
+        self,
+        node_ids,
+        rel_type: Optional[str] = None,
+        direction: str = "out",
+        label: Optional[str] = None,
+    ) -> np.ndarray:
+        """Distinct neighbours of one or several nodes.
+        :param node_ids: Node id or array of node ids
+        :param rel_type: Only follow this relation type, all types if None
+        :param direction: "out", "in" or "both"
+        :param label: Only keep neighbours with this label
+        :return: Sorted array of neighbour ids
+        """
+        frontier = np.atleast_1d(np.asarray(node_ids, dtype=np.int64))
+        found = [np.empty(0, dtype=np.int32)]
+        for _, (indptr, indices, _) in self._blocks(rel_type, direction):
+            positions, _ = _expand(indptr, frontier)
+            found.append(indices[positions])
+
+        result = np.unique(np.concatenate(found))
+        if label is not None:
+            result = result[self.node_labels[result] == self._label_codes[label]]
+        return result
+
+    def k_hop(
+        self,
+        node_ids,
+        k: int,
+        rel_type: Optional[str] = None,
+        direction: str = "both",
+    ) -> np.ndarray:
+        """Nodes reachable in at most k hops, excluding the start nodes.
+        :param node_ids: Node id or array of node ids
+        :param k: Maximum number of hops
+        :param rel_type: Only follow this relation type, all types if None
+        :param direction: "out", "in" or "both"
+        :return: Sorted array of node ids
+        """
+        start = np.atleast_1d(np.asarray(node_ids, dtype=np.int64))
+        visited = np.zeros(self.num_nodes, dtype=bool)
+        visited[start] = True
+        frontier = start
+
+        for _ in range(k):
+            if len(frontier) == 0:
+                break
+            reached = self.neighbors(frontier, rel_type=rel_type, direction=direction)
+            frontier = reached[~visited[reached]]
+            visited[frontier] = True
+
+        visited[start] = False
+        return np.flatnonzero(visited)
+
+    def match_path(
+        self,
+        start_ids,
+        pattern: Sequence[Tuple[str, str, Optional[str]]],
+    ) -> np.ndarray:
+        """Match a typed path pattern from the start nodes.
+
+        Every step of the pattern is a (relation type, direction, label) tuple,
+        for example ``[("ASSOCIATED", "in", "Batch"), ("ASSOCIATED", "in", "Compound")]``.
+        A label of None accepts any neighbour.
+        :param start_ids: Node id or array of node ids
+        :param pattern: Steps of the path
+        :return: Array with one row per matched path and one column per node
+        """
+        paths = np.atleast_1d(np.asarray(start_ids, dtype=np.int64))[:, None]
+
+        for rel_type, direction, label in pattern:
+            if rel_type not in self._out:
+                return np.empty((0, paths.shape[1] + 1), dtype=np.int64)
+
+            indptr, indices, _ = (self._out if direction == "out" else self._in)[
+                rel_type
+            ]
+            positions, owners = _expand(indptr, paths[:, -1])
+            targets = indices[positions]
+
+            if label is not None:
+                keep = self.node_labels[targets] == self._label_codes[label]
+                owners, targets = owners[keep], targets[keep]
+
+            paths = np.unique(np.column_stack([paths[owners], targets]), axis=0)
+
+        return paths
+
+
+def build_csr_graph(invivo_df: pd.DataFrame, invitro_df: pd.DataFrame) -> CSRGraph:
+    """Main function to build the in-memory graph from the processed data.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :return: CSR graph
+    """
+    node_dict, collector = build_graph(invivo_df=invivo_df, invitro_df=invitro_df)
+    csr_graph = CSRGraph.from_graph(node_dict, collector.relationships)
+
+    logger.warning(
+        f"Built CSR graph with {csr_graph.num_nodes} nodes and "
+        f"{csr_graph.num_edges()} edges"
+    )
+
+    return csr_graph
@@ -3,10 +3,31 @@
 """Cleaning and ontology harmonization of the data."""
 import pandas as pd
 import logging
-from constants import MAPPING_DIR, ANNOTATION_COLS
+from typing import Dict, Iterable, List, Optional
+from constants import (
+    MAPPING_DIR,
+    ANNOTATION_COLS,
+    CATEGORICAL_COLS,
+    TEXT_COLS,
+    TYPED_NUMERIC_COLS,
+    TYPED_DATE_COLS,
+    RESULT_BOUND_COLS,
+    QUARANTINE_COL,
+)
+from instrumentation import instrumented
 
 logger = logging.getLogger("__name__")
 
+NUMBER_PATTERN = r"([-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)"
+# Optional operator written in the value cell, like "<= 0.5"
+RESULT_PATTERN = rf"^(<=|>=|<|>|=|≤|≥)?\s*{NUMBER_PATTERN}$"
+# Leading number of a cell, like "20 mg/kg"
+LEADING_NUMBER_PATTERN = rf"^{NUMBER_PATTERN}(?:\s*[A-Za-zµ/%]+(?:/[A-Za-z]+)?)?$"
+DATE_FORMATS = ["%Y-%m-%d", "%d/%m/%Y", "%d.%m.%Y"]
+OPERATORS = {"≤": "<=", "≥": ">=", "==": "="}
+
+_mapping_store = None  # MappingStore used instead of the mapping files, see set_mapping_store
+
 
 def get_bacterial_mapper() -> dict:
     """Method to get bacterial strain dictionary."""
@@ -347,10 +368,39 @@ def get_ontology_mapper() -> dict:
     return ontology_dict
 
 
-def harmonize_data(df: pd.DataFrame):
-    """Main function to harmonise terms in template with ontology."""
+def set_mapping_store(path: Optional[str]) -> None:
+    """Harmonize the data with a mapping store instead of the mapping files.
+    :param path: Path of the SQLite file, None to use the mapping files again
+    """
+    global _mapping_store
+    from mapping_store import MappingStore
+
+    _mapping_store = MappingStore(path) if path is not None else None
+
 
-    data_mapper = get_ontology_mapper()
+def get_annotations(data_mapper, column: str, terms: Iterable[str]) -> Dict[str, dict]:
+    """Method to get the annotations of the known terms of a column.
+    :param data_mapper: Dictionaries returned by get_ontology_mapper, or a MappingStore
+    :param column: Template column
+    :param terms: Unique stripped terms
+    :return: Annotation per known term
+    """
+    if hasattr(data_mapper, "lookup"):
+        return data_mapper.lookup(column, terms)
+
+    mapping = data_mapper[column]
+    return {term: mapping[term] for term in terms if term in mapping}
+
+
+@instrumented("harmonize_data", rows=lambda df, *args, **kwargs: len(df))
+def harmonize_data(df: pd.DataFrame, data_mapper=None):
+    """Main function to harmonise terms in template with ontology.
+    :param df: Data of a template
+    :param data_mapper: Mapping dictionaries or MappingStore, by default the store set by
+        set_mapping_store or else the mapping files
+    """
+    if data_mapper is None:
+        data_mapper = _mapping_store if _mapping_store is not None else get_ontology_mapper()
 
     df.replace("#NA (not applicable)", "", inplace=True)
 
@@ -359,12 +409,167 @@ def harmonize_data(df: pd.DataFrame):
             continue
 
         df[column].fillna("", inplace=True)  # Replace all nans with empty values
+
+        # Every distinct term is looked up once
+        terms = {value: value.rstrip().lstrip() for value in df[column].unique()}
+        annotations = get_annotations(data_mapper, column, set(terms.values()))
         df[f"{column}_annotation"] = df[column].map(
-            lambda x: (
-                data_mapper[column][x.rstrip().lstrip()]
-                if x.rstrip().lstrip() in data_mapper[column]
-                else ""
-            )
+            lambda x: annotations.get(terms[x], "")
+        )
+
+    return df
+
+
+def _is_categorical_column(column: str) -> bool:
+    return (
+        column in CATEGORICAL_COLS
+        or column in ANNOTATION_COLS
+        or column.endswith("_annotation")
+    )
+
+
+def _to_float(value):
+    # Python's float() round-trips the written decimals, pd.to_numeric may be off by an ulp
+    if pd.isna(value):
+        return float("nan")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _get_text(series: pd.Series) -> pd.Series:
+    text = series.astype(object).where(series.notna()).astype("string").str.strip()
+    return text.mask(text.isin(["", "#NA (not applicable)"]))
+
+
+def _parse_dates(text: pd.Series) -> pd.Series:
+    dates = pd.Series(pd.NaT, index=text.index, dtype="datetime64[ns]")
+
+    # Excel dates are read as "2022-03-07 00:00:00"
+    text = text.str.replace(r"[ T]00:00:00$", "", regex=True)
+
+    for date_format in DATE_FORMATS:
+        missing = dates.isna() & text.notna()
+        if not missing.any():
+            break
+        dates[missing] = pd.to_datetime(
+            text[missing], format=date_format, errors="coerce"
+        )
+
+    return dates
+
+
+@instrumented("coerce_types", rows=lambda df: len(df))
+def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Add typed columns next to the text columns used for range queries.
+
+    Result operators and values become numeric lower and upper bounds, doses and
+    body weights become floats and dates become datetimes. The original text
+    columns are kept, and the columns whose non-empty cells could not be parsed
+    are listed per row in the quarantine column.
+    :param df: Harmonized data
+    :return: Data with the typed and quarantine columns
+    """
+    failed = {}
+
+    if "RESULT_VALUE" in df.columns:
+        text = _get_text(df["RESULT_VALUE"])
+        parts = text.str.extract(RESULT_PATTERN)
+        value = parts[1].astype(object).map(_to_float).astype(float)
+
+        operator = (
+            _get_text(df["RESULT_OPERATOR"])
+            if "RESULT_OPERATOR" in df.columns
+            else pd.Series(pd.NA, index=df.index, dtype="string")
         )
+        operator = operator.fillna(parts[0]).replace(OPERATORS).fillna("=")
+
+        lower, upper = RESULT_BOUND_COLS
+        df[lower] = value.where(operator.isin(["=", ">", ">="]))
+        df[upper] = value.where(operator.isin(["=", "<", "<="]))
+
+        failed["RESULT_VALUE"] = text.notna() & value.isna()
+        failed["RESULT_OPERATOR"] = ~operator.isin(["=", "<", "<=", ">", ">="])
+
+    for column in TYPED_NUMERIC_COLS:
+        if column not in df.columns:
+            continue
+        text = _get_text(df[column])
+        number = text.str.extract(LEADING_NUMBER_PATTERN)[0]
+        df[f"{column}_numeric"] = number.astype(object).map(_to_float).astype(float)
+        failed[column] = text.notna() & df[f"{column}_numeric"].isna()
+
+    for column in TYPED_DATE_COLS:
+        if column not in df.columns:
+            continue
+        text = _get_text(df[column])
+        df[f"{column}_date"] = _parse_dates(text)
+        failed[column] = text.notna() & df[f"{column}_date"].isna()
+
+    quarantine = pd.Series("", index=df.index, dtype=object)
+    for column, mask in failed.items():
+        if mask.any():
+            logger.warning(f"Quarantined {mask.sum()} {column} cells that are not typed")
+            quarantine = quarantine.where(~mask, quarantine + column + ";")
+
+    df[QUARANTINE_COL] = quarantine.str.rstrip(";").replace("", None)
+
+    return df
+
+
+def get_dtype_plan(columns: List[str]) -> Dict[str, str]:
+    """Method to get the dtypes used to parse the processed data.
+    :param columns: Columns of the processed data
+    """
+    return {
+        column: (
+            "category"
+            if _is_categorical_column(column)
+            else float
+            if column in RESULT_BOUND_COLS or column.endswith("_numeric")
+            else str
+        )
+        for column in columns
+    }
+
+
+def optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the data to memory-lean dtypes.
+
+    Ontology annotations are stored as their text representation, like in the
+    processed TSV files. The low cardinality columns listed in CATEGORICAL_COLS
+    and the annotations become categoricals, and the result values are always text.
+    :param df: Harmonized data
+    :return: Data with optimized dtypes
+    """
+    for column in df.columns:
+        series = df[column]
+
+        if column.endswith("_annotation") and series.dtype == object:
+            series = series.map(
+                lambda x: str(x) if isinstance(x, dict) else (None if x == "" else x)
+            )
+
+        # Typed dates are written as ISO dates in the processed data
+        if column.endswith("_date") and series.dtype == object:
+            df[column] = pd.to_datetime(series, format="%Y-%m-%d")
+            continue
+
+        if column in TEXT_COLS:
+            # Values read from the workbooks may be numbers or empty, like in to_csv
+            df[column] = series.astype(object).map(
+                lambda x: x if pd.isna(x) else (str(x) or None)
+            )
+            continue
+
+        if isinstance(series.dtype, pd.CategoricalDtype) or series.dtype != object:
+            df[column] = series
+            continue
+
+        if _is_categorical_column(column):
+            series = series.astype("category")
+
+        df[column] = series
 
     return df
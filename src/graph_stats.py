@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""Statistics of the node and edge sets of the graph, to catch degenerate shapes before loading."""
+
+import argparse
+import json
+import logging
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from collector import build_graph
+from csr_graph import CSRGraph
+from constants import GRAPH_STATS_FILE
+
+logger = logging.getLogger("__name__")
+
+TOP_K = 10
+# A node is a supernode when it has this many relations and this share of all relations
+SUPERNODE_MIN_DEGREE = 1000
+SUPERNODE_EDGE_SHARE = 0.01
+# Share of the relations of a type parallel to another one above which it is reported
+PARALLEL_EDGE_SHARE = 0.5
+
+
+def get_histogram(values: np.ndarray) -> Dict[str, int]:
+    """Method to count values in power of two buckets, e.g. {"< 1": 3, "< 2": 10, "< 4": 7}."""
+    if len(values) == 0:
+        return {}
+
+    buckets = np.ceil(np.log2(np.asarray(values, dtype=float) + 1)).astype(np.int64)
+    counts = np.bincount(buckets)
+    return {f"< {2 ** bucket}": int(count) for bucket, count in enumerate(counts) if count}
+
+
+def get_distribution(values: np.ndarray) -> dict:
+    """Method to summarize the positive values, e.g. the degrees of the connected nodes."""
+    values = values[values > 0]
+    if len(values) == 0:
+        return {"nodes": 0}
+
+    return {
+        "nodes": int(len(values)),
+        "min": int(values.min()),
+        "mean": float(values.mean()),
+        "median": float(np.median(values)),
+        "p99": float(np.percentile(values, 99)),
+        "max": int(values.max()),
+        "histogram": get_histogram(values),
+    }
+
+
+def _top_nodes(graph: CSRGraph, degrees: np.ndarray, top_k: int) -> List[dict]:
+    top_k = min(top_k, int((degrees > 0).sum()))
+    if top_k == 0:
+        return []
+
+    top = np.argpartition(-degrees, top_k - 1)[:top_k]
+    top = top[np.argsort(-degrees[top], kind="stable")]
+
+    nodes = []
+    for node_id in top:
+        label, key = graph.node(node_id)
+        nodes.append({"label": label, "key": str(key), "degree": int(degrees[node_id])})
+    return nodes
+
+
+def _property_sizes(properties: Dict[str, np.ndarray], count: int) -> np.ndarray:
+    """Number of characters of the property names and values of every edge."""
+    sizes = np.zeros(count, dtype=np.int64)
+
+    for name, column in properties.items():
+        values = pd.Series(column)
+        present = values.notna().to_numpy()
+        if column.dtype.kind == "f":
+            lengths = np.full(count, 8)
+        else:
+            lengths = values.astype(str).str.len().to_numpy()
+        sizes += np.where(present, lengths + len(name), 0)
+
+    return sizes
+
+
+def get_relation_statistics(graph: CSRGraph, rel_type: str, top_k: int = TOP_K) -> dict:
+    """Method to get the statistics of the relations of one type.
+    :param graph: CSR graph
+    :param rel_type: Relation type
+    :param top_k: Number of highest-degree nodes to report
+    """
+    src, dst = graph.endpoints(rel_type)
+    count = len(src)
+
+    # Parallel relations share both endpoints
+    pairs = src.astype(np.int64) * graph.num_nodes + dst
+    _, multiplicity = np.unique(pairs, return_counts=True)
+
+    properties = graph.edge_properties.get(rel_type, {})
+    rows = pd.DataFrame({"start": src, "end": dst, **properties})
+    duplicates = int(rows.duplicated().sum())
+
+    label_pairs, pair_counts = np.unique(
+        graph.node_labels[src].astype(np.int64) * len(graph.labels)
+        + graph.node_labels[dst],
+        return_counts=True,
+    )
+
+    return {
+        "count": count,
+        "endpoints": {
+            f"{graph.labels[code // len(graph.labels)]} -> "
+            f"{graph.labels[code % len(graph.labels)]}": int(n)
+            for code, n in zip(label_pairs, pair_counts)
+        },
+        "out_degree": get_distribution(graph.degrees(rel_type, "out")),
+        "in_degree": get_distribution(graph.degrees(rel_type, "in")),
+        "top_nodes": _top_nodes(graph, graph.degrees(rel_type, "both"), top_k),
+        "parallel": int((multiplicity - 1).sum()),
+        "parallel_pairs": int((multiplicity > 1).sum()),
+        "max_multiplicity": int(multiplicity.max()) if count else 0,
+        "duplicates": duplicates,
+        "property_size": get_histogram(_property_sizes(properties, count)),
+    }
+
+
+def get_graph_statistics(node_dict: dict, relationships: list, top_k: int = TOP_K) -> dict:
+    """Main function to compute the statistics of the nodes and relations of the graph.
+
+    Besides counts and degree distributions, the report lists findings that
+    make queries or loads slow: supernodes, parallel and duplicate relations.
+    :param node_dict: Node dictionary produced by add_nodes
+    :param relationships: Relations produced by add_relations
+    :param top_k: Number of highest-degree nodes to report
+    :return: JSON serializable report
+    """
+    graph = CSRGraph.from_graph(node_dict, relationships)
+
+    label_counts = np.bincount(graph.node_labels, minlength=len(graph.labels))
+    node_sizes = {
+        label: get_histogram(
+            np.array(
+                [len(json.dumps(dict(node), default=str)) for node in nodes.values()]
+            )
+        )
+        for label, nodes in node_dict.items()
+    }
+
+    relations = {
+        rel_type: get_relation_statistics(graph, rel_type, top_k)
+        for rel_type in sorted(graph.relation_types)
+    }
+
+    degrees = graph.degrees()
+    total = graph.num_edges()
+    threshold = max(SUPERNODE_MIN_DEGREE, SUPERNODE_EDGE_SHARE * total)
+
+    findings = []
+    for node_id in np.flatnonzero(degrees >= threshold):
+        label, key = graph.node(node_id)
+        findings.append(
+            f"Supernode {label} '{key}' has {degrees[node_id]} relations, "
+            f"{degrees[node_id] / total:.1%} of all relations"
+        )
+
+    for rel_type, stats in relations.items():
+        if stats["duplicates"]:
+            findings.append(
+                f"{stats['duplicates']} {rel_type} relations duplicate another one "
+                "with the same endpoints and properties"
+            )
+        if stats["count"] and stats["parallel"] / stats["count"] > PARALLEL_EDGE_SHARE:
+            findings.append(
+                f"{stats['parallel'] / stats['count']:.0%} of the {rel_type} relations "
+                f"are parallel to another one, up to {stats['max_multiplicity']} "
+                "between the same nodes"
+            )
+
+    return {
+        "nodes": int(graph.num_nodes),
+        "relationships": int(total),
+        "labels": {
+            label: int(count) for label, count in zip(graph.labels, label_counts)
+        },
+        "node_property_size": node_sizes,
+        "relations": relations,
+        "top_nodes": _top_nodes(graph, degrees, top_k),
+        "findings": findings,
+    }
+
+
+def format_statistics(stats: dict) -> str:
+    """Method to render the report as a short human readable summary."""
+    lines = [f"{stats['nodes']} nodes, {stats['relationships']} relations", ""]
+
+    for label, count in stats["labels"].items():
+        lines.append(f"  {label:<24} {count:>10}")
+
+    lines.append("")
+    lines.append(
+        f"  {'relation':<24} {'count':>10} {'parallel':>10} {'duplicates':>10} "
+        f"{'max in':>8} {'max out':>8}"
+    )
+    for rel_type, relation in stats["relations"].items():
+        lines.append(
+            f"  {rel_type:<24} {relation['count']:>10} {relation['parallel']:>10} "
+            f"{relation['duplicates']:>10} {relation['in_degree'].get('max', 0):>8} "
+            f"{relation['out_degree'].get('max', 0):>8}"
+        )
+
+    lines.append("")
+    lines.append("Highest-degree nodes:")
+    for node in stats["top_nodes"]:
+        lines.append(f"  {node['degree']:>10}  {node['label']} '{node['key']}'")
+
+    if stats["findings"]:
+        lines.append("")
+        lines.append("Findings:")
+        lines.extend(f"  {finding}" for finding in stats["findings"])
+
+    return "\n".join(lines)
+
+
+def write_graph_statistics(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    exp_dir: str,
+    top_k: int = TOP_K,
+    measurements: bool = False,
+) -> dict:
+    """Compute the statistics of the graph of the processed data, without a database.
+
+    The report is written to the experiment directory and its findings are logged.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param exp_dir: Experiment directory
+    :param top_k: Number of highest-degree nodes to report
+    :param measurements: Model every result row as a measurement node
+    :return: Report returned by get_graph_statistics
+    """
+    node_dict, collector = build_graph(
+        invivo_df=invivo_df, invitro_df=invitro_df, measurements=measurements
+    )
+    stats = get_graph_statistics(node_dict, collector.relationships, top_k=top_k)
+
+    with open(f"{exp_dir}/{GRAPH_STATS_FILE}", "w") as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+
+    for finding in stats["findings"]:
+        logger.warning(finding)
+
+    return stats
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Report the statistics and supernodes of the graph of an experiment."
+    )
+    parser.add_argument("exp_dir", help="Experiment directory with processed data")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument(
+        "--measurements", action="store_true", help="Model results as measurement nodes"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    parser.add_argument(
+        "--strict", action="store_true", help="Fail when the report has findings"
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    from main import read_processed_data
+
+    args = get_parser().parse_args(argv)
+
+    invivo_df, invitro_df = read_processed_data(exp_dir=args.exp_dir)
+    stats = write_graph_statistics(
+        invivo_df,
+        invitro_df,
+        args.exp_dir,
+        top_k=args.top_k,
+        measurements=args.measurements,
+    )
+
+    if args.json:
+        print(json.dumps(stats, indent=2, ensure_ascii=False))
+    else:
+        print(format_statistics(stats))
+
+    return int(args.strict and bool(stats["findings"]))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+"""Incremental update of the graph based on a manifest of the previous run."""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+from py2neo import Graph
+from py2neo.bulk import create_relationships
+from py2neo.cypher import cypher_escape
+
+from collector import build_graph, get_node_keys, hash_content
+from constants import (
+    FULLTEXT_NODE_INDEX,
+    FULLTEXT_RELATION_INDEX,
+    EDGE_HASH_PROPERTY,
+    GRAPH_MANIFEST_FILE,
+    NODE_KEY_PROPERTIES,
+    PROJECT_PROPERTY,
+    PROJECTS_PROPERTY,
+    RANGE_INDEX_PROPERTIES,
+    TEXT_SEARCH_PROPERTIES,
+)
+
+logger = logging.getLogger("__name__")
+
+BATCH_SIZE = 1000
+
+
+def _chunks(items: list, size: int = BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def get_manifest(node_dict: dict, relationships: list) -> dict:
+    """Method to build the manifest of the nodes and relations of a graph.
+    :param node_dict: Node dictionary produced by add_nodes
+    :param relationships: Relations produced by add_relations
+    :return: Manifest with one hash per node and one entry per distinct relation
+    """
+    node_keys = get_node_keys(node_dict)
+
+    manifest = {"nodes": {}, "edges": {}}
+
+    for label, nodes in node_dict.items():
+        manifest["nodes"][label] = {
+            str(key): hash_content(dict(node)) for key, node in nodes.items()
+        }
+
+    for rel in relationships:
+        start = node_keys[id(rel.start_node)]
+        end = node_keys[id(rel.end_node)]
+        rel_type = type(rel).__name__
+        properties = dict(rel)
+
+        edge_hash = hash_content(rel_type, start, end, properties)
+
+        if edge_hash in manifest["edges"]:
+            manifest["edges"][edge_hash]["count"] += 1
+            continue
+
+        manifest["edges"][edge_hash] = {
+            "type": rel_type,
+            "start": list(start),
+            "end": list(end),
+            "properties": properties,
+            "count": 1,
+        }
+
+    return manifest
+
+
+def diff_manifests(old: dict, new: dict) -> dict:
+    """Compare two manifests and list the writes needed to go from old to new.
+    :param old: Manifest of the last run
+    :param new: Manifest of the current inputs
+    :return: Node creates/updates/deletes and relation creates/deletes
+    """
+    diff = {
+        "node_creates": {},
+        "node_updates": {},
+        "node_deletes": {},
+        "edge_creates": {},
+        "edge_deletes": {},
+    }
+
+    for label in set(old["nodes"]) | set(new["nodes"]):
+        old_nodes = old["nodes"].get(label, {})
+        new_nodes = new["nodes"].get(label, {})
+
+        diff["node_creates"][label] = [k for k in new_nodes if k not in old_nodes]
+        diff["node_deletes"][label] = [k for k in old_nodes if k not in new_nodes]
+        diff["node_updates"][label] = [
+            k for k in new_nodes if k in old_nodes and old_nodes[k] != new_nodes[k]
+        ]
+
+    for edge_hash in set(old["edges"]) | set(new["edges"]):
+        old_count = old["edges"].get(edge_hash, {}).get("count", 0)
+        new_count = new["edges"].get(edge_hash, {}).get("count", 0)
+
+        if new_count > old_count:
+            diff["edge_creates"][edge_hash] = new_count - old_count
+        elif old_count > new_count:
+            diff["edge_deletes"][edge_hash] = old_count - new_count
+
+    return diff
+
+
+def _node_pattern(label: str, variable: str, value: str) -> str:
+    """Cypher pattern matching a node by its natural key."""
+    return (
+        f"({variable}:{cypher_escape(label)} "
+        f"{{{cypher_escape(NODE_KEY_PROPERTIES[label])}: {value}}})"
+    )
+
+
+def get_project_name(exp_dir: str) -> str:
+    """Name of the project of an experiment directory, which scopes its graph entities."""
+    return os.path.basename(os.path.normpath(exp_dir))
+
+
+def ensure_key_indexes(graph: Graph) -> None:
+    """Create the uniqueness constraints used to look up nodes by their natural key.
+
+    The constraints also make concurrent MERGE statements of the same node wait
+    for each other instead of creating duplicates. Plain indexes on the same
+    properties, declared by earlier versions, are dropped first, as a constraint
+    cannot be created next to them.
+    """
+    indexes = graph.run(
+        "SHOW INDEXES YIELD name, type, entityType, labelsOrTypes, properties, "
+        "owningConstraint "
+        "WHERE entityType = 'NODE' AND owningConstraint IS NULL "
+        "AND NOT type IN ['FULLTEXT', 'LOOKUP'] "
+        "RETURN name, labelsOrTypes, properties"
+    ).data()
+
+    for label, key in NODE_KEY_PROPERTIES.items():
+        for index in indexes:
+            if index["labelsOrTypes"] == [label] and index["properties"] == [key]:
+                graph.run(f"DROP INDEX {cypher_escape(index['name'])} IF EXISTS")
+
+        graph.run(
+            f"CREATE CONSTRAINT IF NOT EXISTS FOR (n:{cypher_escape(label)}) "
+            f"REQUIRE n.{cypher_escape(key)} IS UNIQUE"
+        )
+
+
+def ensure_range_indexes(graph: Graph) -> None:
+    """Create the indexes used by range queries on the typed properties."""
+    for name, key, is_relation in RANGE_INDEX_PROPERTIES:
+        pattern = (
+            f"()-[n:{cypher_escape(name)}]-()"
+            if is_relation
+            else f"(n:{cypher_escape(name)})"
+        )
+        graph.run(f"CREATE INDEX IF NOT EXISTS FOR {pattern} ON (n.{cypher_escape(key)})")
+
+
+def ensure_fulltext_indexes(graph: Graph) -> None:
+    """Create the full-text indexes of the free-text properties, see TEXT_SEARCH_PROPERTIES."""
+    for name, is_relation in (
+        (FULLTEXT_NODE_INDEX, False),
+        (FULLTEXT_RELATION_INDEX, True),
+    ):
+        fields = [field for field in TEXT_SEARCH_PROPERTIES if field[2] == is_relation]
+        types = "|".join(
+            cypher_escape(label) for label in dict.fromkeys(label for label, _, _ in fields)
+        )
+        keys = ", ".join(
+            f"n.{cypher_escape(key)}" for key in dict.fromkeys(key for _, key, _ in fields)
+        )
+
+        pattern = f"()-[n:{types}]-()" if is_relation else f"(n:{types})"
+        graph.run(
+            f"CREATE FULLTEXT INDEX {cypher_escape(name)} IF NOT EXISTS "
+            f"FOR {pattern} ON EACH [{keys}]"
+        )
+
+
+def apply_diff(
+    graph: Graph,
+    diff: dict,
+    node_dict: dict,
+    old: dict,
+    new: dict,
+    project: str,
+) -> None:
+    """Send only the changed nodes and relations to the graph.
+
+    Nodes such as compounds or bacteria are shared by the projects loaded into
+    the same database, so every node lists the projects using it and is only
+    deleted when the last one drops it. Relations belong to the project that
+    created them and are identified by the hash of their manifest entry.
+    :param graph: Graph connection
+    :param diff: Diff computed by diff_manifests
+    :param node_dict: Node dictionary of the current inputs
+    :param old: Manifest of the last run
+    :param new: Manifest of the current inputs
+    :param project: Name of the project owning the changes
+    """
+    node_values = {
+        label: {str(key): node for key, node in nodes.items()}
+        for label, nodes in node_dict.items()
+    }
+    projects = cypher_escape(PROJECTS_PROPERTY)
+
+    tx = graph.begin()
+
+    # Relations first, so that node deletes never leave dangling edges behind
+    edge_deletes = _group_edges(diff["edge_deletes"], old)
+    for (rel_type, start_label, end_label), rows in edge_deletes.items():
+        query = (
+            "UNWIND $data AS d "
+            f"MATCH {_node_pattern(start_label, 'a', 'd.start')}"
+            f"-[r:{cypher_escape(rel_type)}]->"
+            f"{_node_pattern(end_label, 'b', 'd.end')} "
+            f"WHERE r.{cypher_escape(EDGE_HASH_PROPERTY)} = d.hash "
+            f"AND r.{cypher_escape(PROJECT_PROPERTY)} = $project "
+            "WITH d, collect(r)[..d.count] AS rels "
+            "FOREACH (rel IN rels | DELETE rel)"
+        )
+        for batch in _chunks(rows):
+            tx.run(query, data=batch, project=project)
+
+    for label, keys in diff["node_deletes"].items():
+        query = (
+            f"UNWIND $data AS k MATCH {_node_pattern(label, 'n', 'k')} "
+            f"SET n.{projects} = [p IN coalesce(n.{projects}, []) WHERE p <> $project] "
+            f"WITH n WHERE size(n.{projects}) = 0 "
+            "DETACH DELETE n"
+        )
+        for batch in _chunks(keys):
+            tx.run(query, data=batch, project=project)
+
+    for label, keys in diff["node_updates"].items():
+        query = (
+            f"UNWIND $data AS d MATCH {_node_pattern(label, 'n', 'd.key')} "
+            f"WITH n, d, n.{projects} AS projects "
+            f"SET n = d.properties SET n.{projects} = projects"
+        )
+        rows = [_node_row(node_values[label][key], label) for key in keys]
+        for batch in _chunks(rows):
+            tx.run(query, data=batch)
+
+    for label, keys in diff["node_creates"].items():
+        # Another project may already hold the node, which then only gains this one
+        query = (
+            f"UNWIND $data AS d MERGE {_node_pattern(label, 'n', 'd.key')} "
+            "ON CREATE SET n = d.properties "
+            f"WITH n WHERE NOT $project IN coalesce(n.{projects}, []) "
+            f"SET n.{projects} = coalesce(n.{projects}, []) + $project"
+        )
+        rows = [_node_row(node_values[label][key], label) for key in keys]
+        for batch in _chunks(rows):
+            tx.run(query, data=batch, project=project)
+
+    edge_creates = _group_edges(diff["edge_creates"], new)
+    for (rel_type, start_label, end_label), rows in edge_creates.items():
+        data = []
+        for row in rows:
+            properties = {
+                **row["properties"],
+                EDGE_HASH_PROPERTY: row["hash"],
+                PROJECT_PROPERTY: project,
+            }
+            data.extend([(row["start"], properties, row["end"])] * row["count"])
+
+        for batch in _chunks(data):
+            create_relationships(
+                tx,
+                batch,
+                rel_type,
+                start_node_key=(start_label, NODE_KEY_PROPERTIES[start_label]),
+                end_node_key=(end_label, NODE_KEY_PROPERTIES[end_label]),
+            )
+
+    graph.commit(tx)
+
+
+def _node_row(node, label: str) -> dict:
+    """Natural key and properties of a node for the batched queries."""
+    return {"key": node[NODE_KEY_PROPERTIES[label]], "properties": dict(node)}
+
+
+def _group_edges(edge_counts: Dict[str, int], manifest: dict) -> Dict[tuple, List[dict]]:
+    """Group relation changes by type and endpoint labels for batched queries."""
+    groups = {}
+
+    for edge_hash, count in edge_counts.items():
+        edge = manifest["edges"][edge_hash]
+        (start_label, start_key), (end_label, end_key) = edge["start"], edge["end"]
+
+        groups.setdefault((edge["type"], start_label, end_label), []).append(
+            {
+                "hash": edge_hash,
+                "start": start_key,
+                "end": end_key,
+                "properties": edge["properties"],
+                "count": count,
+            }
+        )
+
+    return groups
+
+
+def has_untracked_nodes(graph: Graph) -> bool:
+    """Method to check whether a graph holds nodes written outside of incremental runs."""
+    return (
+        graph.evaluate(
+            f"MATCH (n) WHERE n.{cypher_escape(PROJECTS_PROPERTY)} IS NULL "
+            "RETURN n LIMIT 1"
+        )
+        is not None
+    )
+
+
+def update_graph(
+    graph: Graph,
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    exp_dir: str,
+    measurements: bool = False,
+    project: Optional[str] = None,
+    activity: bool = False,
+) -> dict:
+    """Main function to bring the graph in line with the current inputs.
+
+    Only the nodes and relations of the project are changed, the entities of
+    other projects loaded into the same database are left alone.
+    :param graph: Graph connection
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param exp_dir: Experiment directory holding the manifest of the last run
+    :param measurements: Model every result row as a measurement node
+    :param project: Name of the project, the name of the experiment directory if None
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Diff that was applied
+    """
+    project = project or get_project_name(exp_dir)
+    manifest_path = f"{exp_dir}/{GRAPH_MANIFEST_FILE}"
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            old_manifest = json.load(f)
+    else:
+        # Entities of full builds carry no project, so they would all be created again
+        if has_untracked_nodes(graph):
+            raise ValueError(
+                f"No manifest found in {exp_dir} and the database holds nodes of a "
+                "full build, which incremental runs cannot track. Clear the database "
+                "and load the project again with incremental=True (--incremental)"
+            )
+        logger.warning(f"No manifest found in {exp_dir}, adding all its entities")
+        old_manifest = {"nodes": {}, "edges": {}}
+
+    node_dict, collector = build_graph(
+        invivo_df=invivo_df,
+        invitro_df=invitro_df,
+        measurements=measurements,
+        activity=activity,
+    )
+    new_manifest = get_manifest(node_dict, collector.relationships)
+
+    ensure_key_indexes(graph)
+
+    diff = diff_manifests(old_manifest, new_manifest)
+
+    logger.warning(
+        "Node changes: "
+        f"{sum(map(len, diff['node_creates'].values()))} created, "
+        f"{sum(map(len, diff['node_updates'].values()))} updated, "
+        f"{sum(map(len, diff['node_deletes'].values()))} deleted"
+    )
+    logger.warning(
+        "Relation changes: "
+        f"{sum(diff['edge_creates'].values())} created, "
+        f"{sum(diff['edge_deletes'].values())} deleted"
+    )
+
+    apply_diff(
+        graph=graph,
+        diff=diff,
+        node_dict=node_dict,
+        old=old_manifest,
+        new=new_manifest,
+        project=project,
+    )
+
+    with open(manifest_path, "w") as f:
+        json.dump(new_manifest, f, ensure_ascii=False, default=str)
+
+    return diff
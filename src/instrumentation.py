@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""Timing, throughput, memory and network instrumentation of the pipeline stages."""
+
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+logger = logging.getLogger("__name__")
+
+METRIC_PREFIX = "template2graphs"
+
+# Metric name, Prometheus type and help text of every recorded stage statistic
+STAGE_METRICS = {
+    "calls": ("calls_total", "counter", "Number of times the stage ran"),
+    "wall_seconds": ("wall_seconds", "counter", "Wall time spent in the stage"),
+    "cpu_seconds": ("cpu_seconds", "counter", "CPU time of the process during the stage"),
+    "rows": ("rows_total", "counter", "Data rows processed by the stage"),
+    "rows_per_second": ("rows_per_second", "gauge", "Rows processed per wall second"),
+    "peak_traced_bytes": (
+        "peak_traced_memory_bytes",
+        "gauge",
+        "Peak memory allocated by Python during the stage",
+    ),
+    "max_rss_bytes": (
+        "max_rss_bytes",
+        "gauge",
+        "Peak resident set size of the process at the end of the stage",
+    ),
+    "bolt_round_trips": (
+        "bolt_round_trips_total",
+        "counter",
+        "Bolt messages flushed to the server during the stage",
+    ),
+    "bolt_bytes_sent": ("bolt_bytes_sent_total", "counter", "Bolt bytes sent"),
+    "bolt_bytes_received": (
+        "bolt_bytes_received_total",
+        "counter",
+        "Bolt bytes received",
+    ),
+}
+
+_active: Optional["Instrumentation"] = None
+_null_stage = contextlib.nullcontext()
+
+
+def _max_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Instrumentation:
+    """Collector of per-stage statistics while instrumentation is enabled."""
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, dict] = {}
+        self.bolt = {"round_trips": 0, "bytes_sent": 0, "bytes_received": 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wire_send = None
+        self._wire_read = None
+
+    def start(self) -> None:
+        """Start memory tracing and the counting of Bolt traffic."""
+        from py2neo.wiring import Wire
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+        self._wire_send, self._wire_read = Wire.send, Wire.read
+        wire_send, wire_read, bolt = self._wire_send, self._wire_read, self.bolt
+
+        def send(wire, final=False):
+            sent = wire_send(wire, final=final)
+            if sent:
+                bolt["round_trips"] += 1
+                bolt["bytes_sent"] += sent
+            return sent
+
+        def read(wire, n):
+            data = wire_read(wire, n)
+            bolt["bytes_received"] += len(data)
+            return data
+
+        Wire.send, Wire.read = send, read
+
+    def stop(self) -> None:
+        """Restore the Bolt wire and stop memory tracing."""
+        from py2neo.wiring import Wire
+
+        if self._wire_send is not None:
+            Wire.send, Wire.read = self._wire_send, self._wire_read
+            self._wire_send = self._wire_read = None
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _stack(self) -> list:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _stats(self, name: str) -> dict:
+        if name not in self.stages:
+            self.stages[name] = {
+                "calls": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "rows": 0,
+                "peak_traced_bytes": 0,
+                "max_rss_bytes": None,
+                "bolt_round_trips": 0,
+                "bolt_bytes_sent": 0,
+                "bolt_bytes_received": 0,
+            }
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rows: Optional[int] = None):
+        """Record the statistics of a stage, which may be nested in another stage.
+        :param name: Name of the stage
+        :param rows: Number of data rows processed by the stage
+        """
+        stack = self._stack()
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+
+        if tracing:
+            # Keep the peak of the enclosing stage before measuring this one
+            peak = tracemalloc.get_traced_memory()[1]
+            if stack:
+                stack[-1]["peak"] = max(stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+
+        frame = {"peak": 0}
+        stack.append(frame)
+        bolt = dict(self.bolt)
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu_start
+            stack.pop()
+
+            if tracing:
+                frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                if stack:
+                    stack[-1]["peak"] = max(stack[-1]["peak"], frame["peak"])
+
+            with self._lock:
+                stats = self._stats(name)
+                stats["calls"] += 1
+                stats["wall_seconds"] += wall
+                stats["cpu_seconds"] += cpu
+                stats["rows"] += rows or 0
+                stats["peak_traced_bytes"] = max(stats["peak_traced_bytes"], frame["peak"])
+                stats["max_rss_bytes"] = _max_rss_bytes()
+                stats["bolt_round_trips"] += self.bolt["round_trips"] - bolt["round_trips"]
+                stats["bolt_bytes_sent"] += self.bolt["bytes_sent"] - bolt["bytes_sent"]
+                stats["bolt_bytes_received"] += (
+                    self.bolt["bytes_received"] - bolt["bytes_received"]
+                )
+
+    def add_rows(self, name: str, rows: int) -> None:
+        """Add rows to a stage whose row count is only known once it finished."""
+        with self._lock:
+            self._stats(name)["rows"] += rows
+
+    def report(self) -> dict:
+        """Method to get the statistics of all stages, including their throughput."""
+        stages = {}
+
+        for name, stats in self.stages.items():
+            stages[name] = dict(stats)
+            stages[name]["rows_per_second"] = (
+                stats["rows"] / stats["wall_seconds"]
+                if stats["rows"] and stats["wall_seconds"]
+                else None
+            )
+
+        return {"stages": stages, "bolt": dict(self.bolt)}
+
+    def to_prometheus(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """Method to render the report in the Prometheus text exposition format.
+        :param labels: Labels added to every sample, e.g. the project
+        """
+        report = self.report()
+        lines = []
+
+        def label_text(stage: str) -> str:
+            items = {**(labels or {}), "stage": stage}
+            values = ",".join(
+                f'{key}="{_escape_label(value)}"' for key, value in items.items()
+            )
+            return "{" + values + "}"
+
+        for key, (metric, metric_type, help_text) in STAGE_METRICS.items():
+            name = f"{METRIC_PREFIX}_stage_{metric}"
+            samples = [
+                f"{name}{label_text(stage)} {stats[key]}"
+                for stage, stats in report["stages"].items()
+                if stats[key] is not None
+            ]
+            if not samples:
+                continue
+
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+
+        return "\n".join(lines) + "\n"
+
+
+def enable(trace_memory: bool = False) -> Instrumentation:
+    """Start collecting statistics for every instrumented stage.
+    :param trace_memory: Trace Python allocations to report the peak memory per stage,
+        which slows down allocation heavy stages several times over
+    :return: Instrumentation collecting the statistics
+    """
+    global _active
+
+    if _active is not None:
+        _active.stop()
+
+    _active = Instrumentation(trace_memory=trace_memory)
+    _active.start()
+    return _active
+
+
+def disable() -> Optional[Instrumentation]:
+    """Stop collecting statistics and return the instrumentation that was active."""
+    global _active
+
+    instrumentation, _active = _active, None
+    if instrumentation is not None:
+        instrumentation.stop()
+    return instrumentation
+
+
+def stage(name: str, rows: Optional[int] = None):
+    """Context manager recording a stage, which does nothing when disabled."""
+    if _active is None:
+        return _null_stage
+    return _active.stage(name, rows)
+
+
+def add_rows(name: str, rows: int) -> None:
+    """Add rows to a stage, which does nothing when disabled."""
+    if _active is not None:
+        _active.add_rows(name, rows)
+
+
+def instrumented(name: str, rows: Optional[Callable[..., int]] = None):
+    """Decorator recording every call of a function as a stage.
+    :param name: Name of the stage
+    :param rows: Function of the call arguments returning the number of rows
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+
+            with _active.stage(name, rows(*args, **kwargs) if rows else None):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_report(
+    instrumentation: Instrumentation,
+    path: str,
+    prometheus_path: Optional[str] = None,
+    labels: Optional[Dict[str, str]] = None,
+) -> None:
+    """Write the report as JSON, and optionally in the Prometheus text format.
+    :param instrumentation: Instrumentation holding the statistics
+    :param path: Path of the JSON report
+    :param prometheus_path: Path of the Prometheus text file
+    :param labels: Labels added to the report and to every Prometheus sample
+    """
+    with open(path, "w") as f:
+        json.dump({**(labels or {}), **instrumentation.report()}, f, indent=2)
+
+    if prometheus_path:
+        with open(prometheus_path, "w") as f:
+            f.write(instrumentation.to_prometheus(labels))
+
+    logger.warning(f"Wrote stage metrics to {path}")
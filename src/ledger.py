@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Ledger of the batches committed by a graph load, used to resume failed loads."""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+logger = logging.getLogger("__name__")
+
+
+class BatchLedger:
+    """Append-only file recording the (stage, batch id, content hash) of each commit.
+
+    A record is appended and flushed to disk right after its batch is committed,
+    so a batch is only written twice if the process dies between the two steps.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.committed: Dict[Tuple[str, int], str] = self._read()
+
+    def _read(self) -> Dict[Tuple[str, int], str]:
+        committed = {}
+
+        if not os.path.exists(self.path):
+            return committed
+
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written last line of an interrupted load
+                    continue
+                committed[(record["stage"], record["batch"])] = record["hash"]
+
+        return committed
+
+    def is_committed(self, stage: str, batch_id: int, content_hash: str) -> bool:
+        """Check whether the given batch was committed by an earlier run."""
+        return self.committed.get((stage, batch_id)) == content_hash
+
+    def is_consistent(self, stage: str, hashes: Dict[int, str]) -> bool:
+        """Check whether the recorded batches of a stage match the current inputs.
+        :param stage: Load stage
+        :param hashes: Content hash of every batch of the stage
+        """
+        return all(
+            hashes.get(batch_id) == content_hash
+            for (recorded_stage, batch_id), content_hash in self.committed.items()
+            if recorded_stage == stage
+        )
+
+    def record(self, stage: str, batch_id: int, content_hash: str) -> None:
+        """Append a committed batch to the ledger."""
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(
+                    json.dumps({"stage": stage, "batch": batch_id, "hash": content_hash})
+                    + "\n"
+                )
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.committed[(stage, batch_id)] = content_hash
+
+    def clear(self) -> None:
+        """Forget all committed batches."""
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.committed = {}
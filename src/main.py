@@ -6,15 +6,33 @@ import logging
 import os
 import pandas as pd
 import json
-from typing import Dict
-import numpy as np
+from typing import Dict, List, Optional, Tuple
 from tqdm import tqdm
 from py2neo import Graph
 
 from nodes import add_nodes
 from relations import add_relations
-from data_preprocessing import harmonize_data
-from constants import DATA_DIR
+from data_preprocessing import (
+    harmonize_data,
+    coerce_types,
+    get_dtype_plan,
+    optimize_dtypes,
+)
+from collector import get_node_dict
+from incremental import update_graph, ensure_fulltext_indexes, ensure_range_indexes
+from writer_pool import load_graph
+from ledger import BatchLedger
+from instrumentation import stage, add_rows, instrumented
+from validation import check_experiment
+from activity import export_activity
+from queries import invalidate_caches
+from constants import (
+    DATA_DIR,
+    GRAPH_MANIFEST_FILE,
+    LOAD_LEDGER_FILE,
+    QUARANTINE_COL,
+    STREAM_CHUNK_SIZE,
+)
 
 logger = logging.getLogger("__name__")
 
@@ -47,7 +65,7 @@ def get_invitro_data(
         col.rstrip().lstrip() for col in df_invitro.columns
     ]  # remove leading and trailing spaces
 
-    return harmonize_data(df_invitro)
+    return optimize_dtypes(coerce_types(harmonize_data(df_invitro)))
 
 
 def get_invivo_data(
@@ -85,8 +103,8 @@ def get_invivo_data(
 
         # QC checking - Removing experiments with empty data
         if "GROUP_DESCRIPTION" in tmp_df.columns:
-            exmp_vals = tmp_df["GROUP_DESCRIPTION"].values
-            if np.nan in exmp_vals:
+            if tmp_df["GROUP_DESCRIPTION"].isna().any():
+                logger.warning(f"Skipping in-vivo sheet with empty groups: {sheet}")
                 continue
 
         if tmp_df.empty:
@@ -115,7 +133,7 @@ def get_invivo_data(
         col.rstrip().lstrip() for col in df_invivo_all.columns
     ]  # remove leading and trailing spaces
 
-    df_invivo_all = harmonize_data(df_invivo_all)
+    df_invivo_all = optimize_dtypes(coerce_types(harmonize_data(df_invivo_all)))
 
     return df_invivo_all
 
@@ -125,39 +143,106 @@ def create_graph(
     invitro_df: pd.DataFrame,
     credentials: Dict[str, str],
     exp_dir: str,
+    incremental: bool = False,
+    workers: int = 1,
+    resume: bool = False,
+    database: Optional[str] = None,
+    measurements: bool = False,
+    pipeline: bool = False,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    activity: bool = False,
 ):
     """Main function to create and populate the graph.
     :param invivo_df: In-vivo data
     :param invitro_df: In-vitro data
     :param credentials: Graph credentials
+    :param exp_dir: Experiment directory
+    :param incremental: Only send the changes since the last incremental run
+    :param workers: Number of concurrent writer transactions
+    :param resume: Continue an interrupted load from its ledger of committed batches
+    :param database: Name of the Neo4J database, the default database if None
+    :param measurements: Model every result row as a measurement node, see measurements.py
+    :param pipeline: Compute the batches while the previous ones are written, see pipeline.py,
+        which cannot be combined with measurements
+    :param chunk_size: Rows per chunk of a pipelined load
+    :param activity: Add the Compound -> Bacteria activity relations and write the
+        activity summary and matrix to the experiment directory, see activity.py
     """
 
+    if pipeline and measurements:
+        # The pipelined batches only follow the result relation schema
+        raise ValueError("A pipelined load cannot model results as measurement nodes")
+
     if invivo_df.empty and invitro_df.empty:
         logger.error("No data to create the graph")
         return
 
+    if activity:
+        with stage("activity_summary", rows=len(invivo_df) + len(invitro_df)):
+            export_activity(invivo_df, invitro_df, exp_dir)
+
     graph = Graph(
         credentials["uri"],
         auth=(credentials["user"], credentials["password"]),
+        name=database,
+        max_size=max(workers, 1),
     )
+    ensure_range_indexes(graph)
+    ensure_fulltext_indexes(graph)
+
+    if incremental:
+        with stage("update_graph"):
+            update_graph(
+                graph=graph,
+                invivo_df=invivo_df,
+                invitro_df=invitro_df,
+                exp_dir=exp_dir,
+                measurements=measurements,
+                activity=activity,
+            )
+        invalidate_caches(database)
+        return
+
+    # A full rebuild invalidates the manifest of earlier incremental runs
+    if os.path.exists(f"{exp_dir}/{GRAPH_MANIFEST_FILE}"):
+        os.remove(f"{exp_dir}/{GRAPH_MANIFEST_FILE}")
+
+    if pipeline:
+        from pipeline import pipeline_graph
+
+        with stage("pipeline_graph", rows=len(invivo_df) + len(invitro_df)):
+            pipeline_graph(
+                graph=graph,
+                invivo_df=invivo_df,
+                invitro_df=invitro_df,
+                workers=workers,
+                chunk_size=chunk_size,
+                activity=activity,
+            )
+        invalidate_caches(database)
+        return
+
+    if workers > 1 or resume:
+        with stage("load_graph", rows=len(invivo_df) + len(invitro_df)):
+            node_map = load_graph(
+                graph=graph,
+                invivo_df=invivo_df,
+                invitro_df=invitro_df,
+                workers=workers,
+                ledger=BatchLedger(f"{exp_dir}/{LOAD_LEDGER_FILE}") if resume else None,
+                measurements=measurements,
+                activity=activity,
+            )
+        with open(f"{exp_dir}/node_dict.json", "w") as f:
+            json.dump(node_map, f, indent=2, ensure_ascii=False)
+        invalidate_caches(database)
+        return
+
     tx = graph.begin()
-    graph.delete_all()  # delete existing data
-
-    node_dict = {
-        "Animal species": {},
-        "Animal group": {},
-        "Animal number": {},
-        "In-vivo study type": {},
-        "Study": {},
-        "Specimen": {},
-        "Bacteria": {},
-        "Partner": {},
-        "Compound": {},
-        "Batch": {},
-        "Experiment type": {},
-        "Experiment": {},
-        "Result": {},
-    }
+    with stage("delete_all"):
+        graph.delete_all()  # delete existing data
+
+    node_dict = get_node_dict()
 
     # Creating nodes for invivo experiments
     if not invivo_df.empty:
@@ -169,50 +254,90 @@ def create_graph(
         logger.warning("Creating nodes for invitro experiments")
         node_map = add_nodes(tx=tx, df=invitro_df, node_dict=node_dict)
 
+    if measurements:
+        from measurements import add_measurement_nodes, add_measurement_relations
+
+        logger.warning("Creating measurement nodes")
+        for df in (invivo_df, invitro_df):
+            if not df.empty:
+                node_map = add_measurement_nodes(tx=tx, df=df, node_dict=node_dict)
+
     with open(f"{exp_dir}/node_dict.json", "w") as f:
         json.dump(node_map, f, indent=2, ensure_ascii=False)
 
-    graph.commit(tx)
+    with stage("commit_nodes"):
+        graph.commit(tx)
 
     tx = graph.begin()
 
     # Creating edges between the nodes
     logger.warning("Creating relations")
     add_relations(
-        invivo_df=invivo_df, invitro_df=invitro_df, node_mapping_dict=node_map, tx=tx
+        invivo_df=invivo_df,
+        invitro_df=invitro_df,
+        node_mapping_dict=node_map,
+        tx=tx,
+        activity=activity,
+        results=not measurements,
     )
 
-    graph.commit(tx)
+    if measurements:
+        add_measurement_relations(invivo_df, invitro_df, node_map, tx)
+
+    with stage("commit_relations"):
+        graph.commit(tx)
+
+    # Cached query results describe the previous graph
+    invalidate_caches(database)
+
+
+def read_workbooks(paths: List[str]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Parse and harmonize the data of in-vivo and in-vitro workbooks.
+    :param paths: Paths of the workbooks
+    :return: Dataframes for in-vivo and in-vitro data, empty if there are no such workbooks
+    """
+    invivo_dfs = []
+    invitro_dfs = []
+
+    for path in tqdm(paths):
+        excel_file = pd.ExcelFile(path)
+        sheet_names = excel_file.sheet_names
 
+        if len(sheet_names) > 3:
+            invivo_dfs.append(get_invivo_data(excel_file))
+        else:
+            invitro_dfs.append(get_invitro_data(excel_file))
+
+    return tuple(
+        optimize_dtypes(pd.concat(dfs, ignore_index=True)) if dfs else pd.DataFrame()
+        for dfs in (invivo_dfs, invitro_dfs)
+    )
 
-def load_data(exp_dir: str) -> None:
+
+@instrumented("load_data")
+def load_data(exp_dir: str, validate: bool = True, strict: bool = False) -> None:
     """Loading data recursively.
     :param exp_dir: Directory containing the experiments
+    :param validate: Check the templates first and stop on errors before parsing them
+    :param strict: Also stop on validation warnings
     :return: Dataframes for in-vivo and in-vitro data
     """
-    invivo_dfs = []
-    invitro_dfs = []
+    if validate:
+        with stage("validate_templates"):
+            check_experiment(exp_dir, strict=strict)
 
-    # Recursive function to load data
-    for path, dirs, files in tqdm(list(os.walk(exp_dir, topdown=True))):
+    workbooks = []
+    for path, dirs, files in os.walk(exp_dir, topdown=True):
         for name in files:
-            if not name.endswith(".xlsx"):
-                continue
-            excel_file = pd.ExcelFile(os.path.join(path, name))
-            sheet_names = excel_file.sheet_names
-
-            if len(sheet_names) > 3:
-                df = get_invivo_data(excel_file)
-                invivo_dfs.append(df)
-            else:
-                df = get_invitro_data(excel_file)
-                invitro_dfs.append(df)
+            if name.endswith(".xlsx"):
+                workbooks.append(os.path.join(path, name))
 
-    invivo_df = pd.concat(invivo_dfs, ignore_index=True)
-    invivo_df.to_csv(f"{exp_dir}/processed_invivo_data.tsv", index=False, sep="\t")
+    invivo_df, invitro_df = read_workbooks(workbooks)
+    add_rows("load_data", len(invivo_df) + len(invitro_df))
 
-    invitro_df = pd.concat(invitro_dfs, ignore_index=True)
-    invitro_df.to_csv(f"{exp_dir}/processed_invitro_data.tsv", index=False, sep="\t")
+    with stage("write_processed_data", rows=len(invivo_df) + len(invitro_df)):
+        invivo_df.to_csv(f"{exp_dir}/processed_invivo_data.tsv", index=False, sep="\t")
+        invitro_df.to_csv(f"{exp_dir}/processed_invitro_data.tsv", index=False, sep="\t")
 
     logger.warning(f"No.of in-vivo data points: {len(invivo_df)}")
     logger.warning(f"No.of in-vitro data points: {len(invitro_df)}")
@@ -220,6 +345,34 @@ def load_data(exp_dir: str) -> None:
     return None
 
 
+def read_processed_data(exp_dir: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Read the harmonized data written by load_data with memory-lean dtypes.
+    :param exp_dir: Directory containing the experiments
+    :return: Dataframes for in-vivo and in-vitro data
+    """
+    dfs = []
+
+    for data_type in ["invivo", "invitro"]:
+        path = f"{exp_dir}/processed_{data_type}_data.tsv"
+        columns = pd.read_csv(path, sep="\t", nrows=0).columns
+        df = pd.read_csv(
+            path,
+            sep="\t",
+            dtype=get_dtype_plan(columns),
+            low_memory=False,
+        )
+        df = optimize_dtypes(df)
+
+        # Processed data written before typed columns were added
+        if QUARANTINE_COL not in df.columns:
+            df = coerce_types(df)
+
+        dfs.append(df)
+
+    invivo_df, invitro_df = dfs
+    return invivo_df, invitro_df
+
+
 if __name__ == "__main__":
 
     exp_dir_name = f"{DATA_DIR}/exps/noso-502"
@@ -227,18 +380,7 @@ if __name__ == "__main__":
     if not os.path.exists(f"{exp_dir_name}/processed_invivo_data.tsv"):
         load_data(exp_dir=exp_dir_name)  # Load data from experiments
 
-    edge_data_invivo = pd.read_csv(
-        f"{exp_dir_name}/processed_invivo_data.tsv",
-        sep="\t",
-        dtype=str,
-        low_memory=False,
-    )
-    edge_data_invitro = pd.read_csv(
-        f"{exp_dir_name}/processed_invitro_data.tsv",
-        sep="\t",
-        dtype=str,
-        low_memory=False,
-    )
+    edge_data_invivo, edge_data_invitro = read_processed_data(exp_dir=exp_dir_name)
 
     # Neo4j graph connection details - Change as per your setup
     graph_url = "bolt://localhost:7687"
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""On-disk SQLite index of the ontology mappings, for vocabularies too large for memory."""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+logger = logging.getLogger("__name__")
+
+CHUNK_SIZE = 100000
+# SQLite limits the number of variables of a statement, 999 in older versions
+LOOKUP_BATCH_SIZE = 900
+
+SYNONYM_PATTERN = re.compile(r'^"((?:[^"\\]|\\.)*)"\s+EXACT')
+
+
+def _to_json(annotation: dict) -> str:
+    # Values read by pandas may be numpy scalars
+    return json.dumps(annotation, ensure_ascii=False, default=lambda value: value.item())
+
+
+def _property_name(column: str) -> str:
+    return re.sub(r"\W+", "_", column.strip()).strip("_").lower()
+
+
+def read_tsv_terms(path: str) -> Iterator[Tuple[str, dict]]:
+    """Method to stream the terms of a mapping file in chunks.
+
+    The first column holds the template terms and a Curie column their ontology
+    mapping, like the files in the mapping directory. The other columns are kept
+    as annotation properties, a "Name" column becoming "ontology_name".
+    :param path: Path of the TSV file
+    :return: Template term and its annotation
+    """
+    for chunk in pd.read_csv(path, sep="\t", dtype=str, chunksize=CHUNK_SIZE):
+        term_column = chunk.columns[0]
+        chunk = chunk.dropna(subset=[term_column, "Curie"])
+        others = [
+            column for column in chunk.columns if column not in (term_column, "Curie")
+        ]
+
+        for values in chunk.to_dict("records"):
+            term = values[term_column].strip()
+            annotation = {"curie": values["Curie"], "name": term}
+            for column in others:
+                if pd.notna(values[column]):
+                    name = _property_name(column)
+                    annotation[name if name != "name" else "ontology_name"] = values[column]
+            yield term, annotation
+
+
+def read_obo_terms(path: str) -> Iterator[Tuple[str, dict]]:
+    """Method to stream the names and exact synonyms of the terms of an OBO file.
+
+    Obsolete terms are skipped.
+    :param path: Path of the OBO file, e.g. of NCBITaxon or ChEBI
+    :return: Term name or synonym and its annotation
+    """
+
+    def _terms(stanza: dict) -> Iterator[Tuple[str, dict]]:
+        if "id" not in stanza or "name" not in stanza or stanza.get("obsolete"):
+            return
+        for term in [stanza["name"]] + stanza["synonyms"]:
+            yield term, {
+                "curie": stanza["id"],
+                "name": term,
+                "ontology_name": stanza["name"],
+            }
+
+    stanza = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if line.startswith("["):
+                if stanza is not None:
+                    yield from _terms(stanza)
+                stanza = {"synonyms": []} if line == "[Term]" else None
+                continue
+
+            if stanza is None or ":" not in line:
+                continue
+
+            tag, _, value = line.partition(":")
+            value = value.strip()
+
+            if tag == "id":
+                stanza["id"] = value
+            elif tag == "name":
+                stanza["name"] = value
+            elif tag == "synonym":
+                match = SYNONYM_PATTERN.match(value)
+                if match:
+                    stanza["synonyms"].append(match.group(1).replace('\\"', '"'))
+            elif tag == "is_obsolete" and value == "true":
+                stanza["obsolete"] = True
+
+    if stanza is not None:
+        yield from _terms(stanza)
+
+
+def build_mapping_store(
+    path: str,
+    sources: Optional[List[Tuple[str, str]]] = None,
+    mapping_files: bool = True,
+) -> Dict[str, int]:
+    """Main function to build the mapping store from mapping files and ontologies.
+
+    Terms are inserted in chunks, so that sources with millions of terms never
+    have to fit in memory. A term found in several sources of a column keeps the
+    annotation of the first one.
+    :param path: Path of the SQLite file, replaced if it exists
+    :param sources: (template column, path of a .tsv or .obo file) pairs
+    :param mapping_files: Also index the mapping files of the repository
+    :return: Number of terms per column
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute(
+        "CREATE TABLE terms (field TEXT, term TEXT, annotation TEXT, "
+        "PRIMARY KEY (field, term)) WITHOUT ROWID"
+    )
+
+    def _insert(column: str, terms: Iterable[Tuple[str, dict]]) -> None:
+        batch = []
+        for term, annotation in terms:
+            batch.append((column, term, _to_json(annotation)))
+            if len(batch) >= CHUNK_SIZE:
+                conn.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?, ?)", batch)
+
+    if mapping_files:
+        from data_preprocessing import get_ontology_mapper
+
+        for column, mapping in get_ontology_mapper().items():
+            # Terms are matched exactly, like the stripped template values in harmonize_data
+            _insert(
+                column,
+                ((term, value) for term, value in mapping.items() if isinstance(term, str)),
+            )
+
+    for column, source in sources or []:
+        logger.warning(f"Indexing {source} for {column}")
+        if source.endswith(".obo"):
+            _insert(column, read_obo_terms(source))
+        else:
+            _insert(column, read_tsv_terms(source))
+
+    conn.commit()
+    counts = dict(conn.execute("SELECT field, count(*) FROM terms GROUP BY field"))
+    conn.close()
+    os.replace(tmp_path, path)
+
+    logger.warning(f"Indexed {sum(counts.values())} terms of {len(counts)} columns in {path}")
+    return counts
+
+
+class MappingStore:
+    """Read-only access to a mapping store, looking up batches of terms.
+
+    Only the pages of the index touched by the lookups are read, so memory
+    stays flat whatever the size of the vocabularies.
+    """
+
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No mapping store at {path}")
+
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def lookup(self, column: str, terms: Iterable[str]) -> Dict[str, dict]:
+        """Method to get the annotations of the known terms of a column.
+        :param column: Template column, e.g. BACTERIAL_STRAIN_NAME
+        :param terms: Unique terms to look up
+        :return: Annotation per known term, unknown terms are left out
+        """
+        terms = list(terms)
+        annotations = {}
+
+        for start in range(0, len(terms), LOOKUP_BATCH_SIZE):
+            batch = terms[start : start + LOOKUP_BATCH_SIZE]
+            rows = self._conn.execute(
+                "SELECT term, annotation FROM terms WHERE field = ? AND term IN "
+                f"({', '.join('?' * len(batch))})",
+                [column, *batch],
+            )
+            for term, annotation in rows:
+                annotations[term] = json.loads(annotation)
+
+        return annotations
+
+    def columns(self) -> Dict[str, int]:
+        """Method to get the number of terms per column."""
+        return dict(self._conn.execute("SELECT field, count(*) FROM terms GROUP BY field"))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build or query the on-disk index of the ontology mappings."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build the mapping store")
+    build.add_argument("store", help="Path of the SQLite file")
+    build.add_argument(
+        "--source",
+        action="append",
+        default=[],
+        metavar="COLUMN=PATH",
+        help="TSV or OBO file mapping the terms of a template column, may be repeated",
+    )
+    build.add_argument(
+        "--no-mapping-files",
+        action="store_true",
+        help="Do not index the mapping files of the repository",
+    )
+
+    lookup = subparsers.add_parser("lookup", help="Look up template terms")
+    lookup.add_argument("store", help="Path of the SQLite file")
+    lookup.add_argument("column", help="Template column, e.g. BACTERIAL_STRAIN_NAME")
+    lookup.add_argument("terms", nargs="+")
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    if args.command == "build":
+        sources = []
+        for source in args.source:
+            column, _, path = source.partition("=")
+            sources.append((column, path))
+        counts = build_mapping_store(
+            args.store, sources, mapping_files=not args.no_mapping_files
+        )
+        print(json.dumps(counts, indent=2))
+        return 0
+
+    store = MappingStore(args.store)
+    annotations = store.lookup(args.column, args.terms)
+    print(json.dumps(annotations, indent=2, ensure_ascii=False))
+    return int(len(annotations) < len(set(args.terms)))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+"""Result modeling with one measurement node per result row, instead of relations to the Result nodes."""
+
+import ast
+import logging
+from typing import List
+
+import pandas as pd
+from py2neo import Node, Relationship
+from py2neo.database import Transaction
+
+from collector import hash_content
+from instrumentation import instrumented
+from relations import _format_value
+
+logger = logging.getLogger("__name__")
+
+# Columns identifying a result row, identical rows are told apart by their occurrence
+MEASUREMENT_ID_COLS = [
+    "STUDYID",
+    "EXPID",
+    "ANIMAL",
+    "CPD_ID",
+    "BATCH_ID",
+    "BACTERIAL_STRAIN_NAME",
+    "EXPERIMENT_TYPE",
+    "RELATIVE_TIMEPOINT",
+    "RESULT_TYPE",
+    "RESULT_OPERATOR",
+    "RESULT_VALUE",
+    "RESULT_UNIT",
+    "STATISTICAL_METHOD",
+    "RESULT_STATUS",
+]
+
+MEASUREMENT_COLS = [
+    "EXPID",
+    "ANIMAL",
+    "CPD_ID",
+    "BACTERIAL_STRAIN_NAME",
+    "RESULT_TYPE",
+    "RESULT_OPERATOR",
+    "RESULT_VALUE",
+    "RESULT_LOWER_BOUND",
+    "RESULT_UPPER_BOUND",
+    "RESULT_STATUS",
+    "RESULT_UNIT_annotation",
+    "STATISTICAL_METHOD_annotation",
+    "RELATIVE_TIMEPOINT",
+    "COMMENTS",
+]
+
+
+def _parse_annotation(annotation) -> dict:
+    """Method to get an ontology annotation of the processed data as a dictionary."""
+    if isinstance(annotation, dict):
+        return annotation
+
+    if pd.isna(annotation) or annotation == "":
+        return {}
+
+    annotation = ast.literal_eval(annotation.replace("nan", "None").replace("null", "None"))
+    return {key: value for key, value in annotation.items() if value is not None}
+
+
+def get_measurement_ids(df: pd.DataFrame) -> List[str]:
+    """Method to get the ids of the measurements of the result rows.
+
+    Ids are hashes of the columns identifying a result, so the same data always
+    gives the same ids, and repeated rows are numbered in their order of appearance.
+    :param df: Harmonized data
+    :return: Id of every row
+    """
+    keys = df.reindex(columns=MEASUREMENT_ID_COLS).astype(object)
+    keys = keys.where(keys.notna(), None).applymap(
+        lambda value: None if value is None else str(value)
+    )
+    occurrences = keys.groupby(MEASUREMENT_ID_COLS, dropna=False, sort=False).cumcount()
+
+    return [
+        hash_content("Measurement", *values, int(occurrence))
+        for values, occurrence in zip(keys.values.tolist(), occurrences)
+    ]
+
+
+def _iter_measurements(df: pd.DataFrame):
+    """Result rows with an experiment or an animal, with their measurement id."""
+    rows = df.reindex(columns=MEASUREMENT_COLS)
+    for measurement_id, row in zip(
+        get_measurement_ids(df), rows.itertuples(index=False)
+    ):
+        if pd.isna(row.RESULT_TYPE) or (pd.isna(row.EXPID) and pd.isna(row.ANIMAL)):
+            continue
+        yield measurement_id, row
+
+
+@instrumented("add_measurement_nodes", rows=lambda tx, df, node_dict: len(df))
+def add_measurement_nodes(tx: Transaction, df: pd.DataFrame, node_dict: dict) -> dict:
+    """Create one measurement node per result row, with its unit and method nodes.
+    :param tx: Transaction
+    :param df: Harmonized data
+    :param node_dict: Node dictionary produced by add_nodes
+    :return: Node dictionary with the measurement, unit and statistical method nodes
+    """
+    for measurement_id, row in _iter_measurements(df):
+        unit = _parse_annotation(row.RESULT_UNIT_annotation)
+        if unit.get("name") and unit["name"] not in node_dict["Unit"]:
+            node_dict["Unit"][unit["name"]] = Node("Unit", **unit)
+            tx.create(node_dict["Unit"][unit["name"]])
+
+        method = _parse_annotation(row.STATISTICAL_METHOD_annotation)
+        if method.get("name") and method["name"] not in node_dict["Statistical method"]:
+            node_dict["Statistical method"][method["name"]] = Node(
+                "Statistical method", **method
+            )
+            tx.create(node_dict["Statistical method"][method["name"]])
+
+        if measurement_id in node_dict["Measurement"]:
+            continue
+
+        annotation = {
+            "measurement id": measurement_id,
+            "result type": row.RESULT_TYPE,
+        }
+
+        if pd.notna(row.RESULT_VALUE):
+            annotation["result value"] = row.RESULT_VALUE
+
+        if pd.notna(row.RESULT_OPERATOR):
+            annotation["result operator"] = row.RESULT_OPERATOR
+
+        if pd.notna(row.RESULT_LOWER_BOUND):
+            annotation["result lower bound"] = float(row.RESULT_LOWER_BOUND)
+
+        if pd.notna(row.RESULT_UPPER_BOUND):
+            annotation["result upper bound"] = float(row.RESULT_UPPER_BOUND)
+
+        if pd.notna(row.RESULT_STATUS):
+            annotation["result status"] = row.RESULT_STATUS
+
+        if pd.notna(row.RESULT_VALUE) and pd.notna(row.RESULT_OPERATOR) and "name" in unit:
+            annotation["result"] = f"{row.RESULT_OPERATOR} {_format_value(row.RESULT_VALUE)}"
+            if unit["name"] != "No unit":
+                annotation["result"] += f" {unit['name']}"
+
+        if pd.notna(row.RELATIVE_TIMEPOINT):
+            annotation["relative timepoint"] = row.RELATIVE_TIMEPOINT
+
+        if pd.notna(row.COMMENTS):
+            annotation["comments"] = row.COMMENTS
+
+        if pd.notna(row.EXPID):
+            annotation["ELN"] = (
+                f"https://www.sciencecloud.com/experiments/notebook/experiment/{row.EXPID}"
+            )
+
+        node_dict["Measurement"][measurement_id] = Node("Measurement", **annotation)
+        tx.create(node_dict["Measurement"][measurement_id])
+
+    return node_dict
+
+
+def add_measurement_relations(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    node_mapping_dict: dict,
+    tx: Transaction,
+) -> None:
+    """Populate the relations of the measurement nodes.
+
+    A measurement is linked to its experiment, animal, compound and strain, and
+    to its result type, unit and statistical method. The measured values are
+    properties of the measurement node, so the relations carry no properties.
+    """
+    for df in (invivo_df, invitro_df):
+        if df.empty:
+            continue
+
+        for measurement_id, row in _iter_measurements(df):
+            measurement = node_mapping_dict["Measurement"][measurement_id]
+
+            for label, key in (
+                ("Experiment", row.EXPID),
+                ("Animal number", row.ANIMAL),
+                ("Compound", row.CPD_ID),
+                ("Bacteria", row.BACTERIAL_STRAIN_NAME),
+            ):
+                if pd.notna(key) and key in node_mapping_dict[label]:
+                    tx.create(
+                        Relationship(
+                            node_mapping_dict[label][key], "HAS MEASUREMENT", measurement
+                        )
+                    )
+
+            tx.create(
+                Relationship(
+                    measurement, "HAS TYPE", node_mapping_dict["Result"][row.RESULT_TYPE]
+                )
+            )
+
+            unit = _parse_annotation(row.RESULT_UNIT_annotation).get("name")
+            if unit in node_mapping_dict["Unit"]:
+                tx.create(Relationship(measurement, "HAS UNIT", node_mapping_dict["Unit"][unit]))
+
+            method = _parse_annotation(row.STATISTICAL_METHOD_annotation).get("name")
+            if method in node_mapping_dict["Statistical method"]:
+                tx.create(
+                    Relationship(
+                        measurement,
+                        "HAS METHOD",
+                        node_mapping_dict["Statistical method"][method],
+                    )
+                )
@@ -7,6 +7,8 @@ from ast import literal_eval
 from py2neo import Node
 from py2neo.database import Transaction
 
+from instrumentation import instrumented
+
 
 def _format_text(text):
     replace_items = [
@@ -25,6 +27,7 @@ def _format_text(text):
     return text
 
 
+@instrumented("add_nodes", rows=lambda tx, df, node_dict: len(df))
 def add_nodes(
     tx: Transaction,
     df: pd.DataFrame,
@@ -106,7 +109,8 @@ def add_nodes(
     if 'ANIMAL' in df.columns:
         for row in df[
             ['ANIMAL', 'ANIMAL_ID', 'ANIMAL_SEX_annotation', 'ANIMAL_STRAIN', 'ANIMAL_VENDOR',
-             'ANIMAL_BODYWEIGHT_RANGE', 'ANIMAL_BODYWEIGHT_MEAN', 'ANIMAL_AGE_RANGE']
+             'ANIMAL_BODYWEIGHT_RANGE', 'ANIMAL_BODYWEIGHT_MEAN', 'ANIMAL_AGE_RANGE',
+             'ANIMAL_BODYWEIGHT_MEAN_numeric']
         ].values:
             (
                 animal,
@@ -116,7 +120,8 @@ def add_nodes(
                 animal_vendor,
                 animal_bodyweight_range,
                 animal_bodyweight_mean,
-                animal_age_range
+                animal_age_range,
+                animal_bodyweight_mean_numeric
             ) = row
 
             if pd.isna(animal):
@@ -149,6 +154,9 @@ def add_nodes(
             if pd.notna(animal_bodyweight_mean):
                 animal_annotation['body weight mean'] = animal_bodyweight_mean
 
+            if pd.notna(animal_bodyweight_mean_numeric):
+                animal_annotation['body weight mean (numeric)'] = animal_bodyweight_mean_numeric
+
             if pd.notna(animal_bodyweight_range):
                 animal_annotation['body weight range'] = animal_bodyweight_range
 
@@ -183,7 +191,8 @@ def add_nodes(
     # Study
     if 'STUDY_PROTOCOL_NAME' in df.columns:
         for row in df[
-            ['STUDYID', 'EXPID', 'STUDY_PROTOCOL_NAME', 'STUDY_START_DATE', 'PROVENANCE', 'PROJECT_LICENCE_NUMBER']
+            ['STUDYID', 'EXPID', 'STUDY_PROTOCOL_NAME', 'STUDY_START_DATE', 'PROVENANCE', 'PROJECT_LICENCE_NUMBER',
+             'STUDY_START_DATE_date']
         ].values:
             (
                 study_id,
@@ -191,7 +200,8 @@ def add_nodes(
                 study_protocol_name,
                 study_start_date,
                 provenance_invivo,
-                project_licence_number
+                project_licence_number,
+                study_start_day
             ) = row
 
             if pd.isna(study_id):
@@ -214,6 +224,9 @@ def add_nodes(
             if pd.notna(study_start_date):
                 study_annotation['study start date'] = study_start_date
 
+            if pd.notna(study_start_day):
+                study_annotation['study start date (date)'] = study_start_day.date()
+
             if pd.notna(provenance_invivo):
                 study_annotation['provenance'] = _format_text(provenance_invivo)
 
@@ -408,7 +421,8 @@ def add_nodes(
             'PROTOCOL_NAME',
             'CONTROL_GROUP',
             'PLANNED_RELATIVE_TIMEPOINT',
-            'RELATIVE_TIMEPOINT'
+            'RELATIVE_TIMEPOINT',
+            'EXPERIMENT_DATE_date'
         ]
         for row in df[cols].values:
             (
@@ -419,7 +433,8 @@ def add_nodes(
                 experiment_protocol,
                 control_group,
                 planned_relative_timepoint,
-                relative_timepoint
+                relative_timepoint,
+                experiment_day
             ) = row
 
             if pd.isna(experiment_id):
@@ -442,6 +457,9 @@ def add_nodes(
             if pd.notna(experiment_date):
                 experiment_annotation['experiment date'] = experiment_date
 
+            if pd.notna(experiment_day):
+                experiment_annotation['experiment date (date)'] = experiment_day.date()
+
             if pd.notna(experiment_protocol):
                 experiment_annotation['experiment protocol'] = experiment_protocol
 
@@ -466,7 +484,8 @@ def add_nodes(
                 'PROTOCOL_NAME',
                 'No of replicates',
                 'CONTROL_GROUP',
-                'MEDIUM_annotation'
+                'MEDIUM_annotation',
+                'EXPERIMENT_DATE_date'
         ]
         for row in df[cols].values:
             (
@@ -476,7 +495,8 @@ def add_nodes(
                 experiment_protocol,
                 replicate_num,
                 control_group,
-                experiment_medium
+                experiment_medium,
+                experiment_day
             ) = row
 
             if pd.isna(experiment_id):
@@ -496,6 +516,9 @@ def add_nodes(
             if pd.notna(experiment_date):
                 experiment_annotation['experiment date'] = experiment_date
 
+            if pd.notna(experiment_day):
+                experiment_annotation['experiment date (date)'] = experiment_day.date()
+
             if pd.notna(experiment_protocol):
                 experiment_annotation['experiment protocol'] = experiment_protocol
 
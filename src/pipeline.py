@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""Pipelined load of the graph, computing the next batches while the writers commit the previous ones."""
+
+import logging
+import queue
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+import pandas as pd
+from py2neo import Graph
+
+from activity import get_activity_summary
+from incremental import ensure_key_indexes
+from streaming import NodeRegistry, get_activity_batches, iter_graph_batches
+from writer_pool import BATCH_SIZE, Batch, WriterPool, _write_edges, _write_nodes
+from constants import PIPELINE_QUEUE_SIZE, STREAM_CHUNK_SIZE
+
+logger = logging.getLogger("__name__")
+
+_DONE = object()
+
+
+def iter_frame_chunks(
+    invivo_df: pd.DataFrame, invitro_df: pd.DataFrame, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """Split the processed data into chunks, in-vivo data first like in create_graph.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param chunk_size: Maximum number of rows per chunk
+    :return: "invivo" or "invitro" and a chunk of the data
+    """
+    for kind, df in (("invivo", invivo_df), ("invitro", invitro_df)):
+        for start in range(0, len(df), chunk_size):
+            yield kind, df.iloc[start : start + chunk_size]
+
+
+def _put(batch_queue: queue.Queue, item, stop: threading.Event) -> bool:
+    """Wait for room in the queue, unless the consumer stopped."""
+    while not stop.is_set():
+        try:
+            batch_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(
+    batches: Iterator[Tuple[List[Batch], List[Batch]]],
+    batch_queue: queue.Queue,
+    stop: threading.Event,
+    timings: dict,
+) -> None:
+    """Compute the batches ahead of the writers, then signal the end or the error."""
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(batches)
+            except StopIteration:
+                break
+            timings["compute_seconds"] += time.perf_counter() - start
+
+            if not _put(batch_queue, item, stop):
+                return
+    except Exception as e:
+        _put(batch_queue, e, stop)
+        return
+
+    _put(batch_queue, _DONE, stop)
+
+
+def write_pipelined(
+    pool: WriterPool,
+    batches: Iterator[Tuple[List[Batch], List[Batch]]],
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+) -> dict:
+    """Commit node and relation batches while the following ones are computed.
+
+    A producer thread draws the batches into a bounded queue, so it never gets
+    more than `queue_size` items ahead of the writers. The relations of an item
+    only refer to nodes of the same or of earlier items, so they are written as
+    soon as the nodes of their item are committed.
+    :param pool: Writer pool committing the batches
+    :param batches: Node batches and relation batches of every chunk
+    :param queue_size: Maximum number of computed items waiting for the writers
+    :return: Number of items, nodes and relations written, and the compute and write times
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    stats = {
+        "chunks": 0,
+        "nodes": 0,
+        "relationships": 0,
+        "compute_seconds": 0.0,
+        "write_seconds": 0.0,
+    }
+
+    producer = threading.Thread(
+        target=_produce,
+        args=(iter(batches), batch_queue, stop, stats),
+        name="graph-batches",
+        daemon=True,
+    )
+    producer.start()
+
+    try:
+        while True:
+            item = batch_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            node_batches, edge_batches = item
+            start = time.perf_counter()
+            pool.write(node_batches, _write_nodes)
+            pool.write(edge_batches, _write_edges)
+            stats["write_seconds"] += time.perf_counter() - start
+
+            stats["chunks"] += 1
+            stats["nodes"] += sum(len(batch.rows) for batch in node_batches)
+            stats["relationships"] += sum(len(batch.rows) for batch in edge_batches)
+    finally:
+        stop.set()  # unblock the producer when a write failed
+        producer.join()
+
+    return stats
+
+
+def pipeline_graph(
+    graph: Graph,
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    workers: int = 1,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    batch_size: int = BATCH_SIZE,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+    activity: bool = False,
+) -> dict:
+    """Main function to populate the graph with the computation overlapping the writes.
+
+    The data is split into chunks whose nodes and relations are computed like
+    in a streaming build, see streaming.iter_graph_batches, while the writers
+    commit the batches of the previous chunks. The activity relations, which
+    need all results, come last if requested.
+    :param graph: Graph connection with a pool of at least `workers` connections
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param workers: Number of concurrent transactions
+    :param chunk_size: Maximum number of rows per chunk
+    :param batch_size: Maximum number of rows per transaction
+    :param queue_size: Maximum number of computed chunks waiting for the writers
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Number of chunks, nodes and relations written, and the compute and write times
+    """
+    start = time.perf_counter()
+
+    graph.delete_all()  # delete existing data
+    ensure_key_indexes(graph)
+
+    registry = NodeRegistry()
+
+    def _iter_batches():
+        yield from iter_graph_batches(
+            iter_frame_chunks(invivo_df, invitro_df, chunk_size), registry, batch_size
+        )
+        if activity:
+            summary = get_activity_summary([invivo_df, invitro_df])
+            yield [], get_activity_batches(summary, registry, batch_size)
+
+    stats = write_pipelined(
+        WriterPool(graph=graph, workers=workers), _iter_batches(), queue_size=queue_size
+    )
+    stats["seconds"] = time.perf_counter() - start
+
+    logger.warning(
+        f"Wrote {stats['nodes']} nodes and {stats['relationships']} relations in "
+        f"{stats['seconds']:.1f}s, with {stats['compute_seconds']:.1f}s of computation "
+        f"and {stats['write_seconds']:.1f}s of writes"
+    )
+    return stats
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+"""Preview builds of the graph from a stratified sample of the data of a project."""
+
+import argparse
+import json
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from cli import (
+    DEFAULT_URI,
+    DEFAULT_USER,
+    add_password_argument,
+    ensure_database,
+    get_database_name,
+)
+from main import create_graph, read_processed_data, read_workbooks
+from sharding import get_workbooks
+from constants import PREVIEW_DIR, PREVIEW_KEY_COLS, PREVIEW_ROWS, PREVIEW_STRATA
+
+logger = logging.getLogger("__name__")
+
+
+def sample_rows(
+    df: pd.DataFrame,
+    rows: int = PREVIEW_ROWS,
+    key_col: Optional[str] = None,
+    strata: Optional[List[str]] = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Method to draw a stratified sample of the rows of the harmonized data.
+
+    Every combination of the strata columns contributes at most `rows` random
+    rows. The rows of the sampled studies without a key value are added, e.g.
+    the study details of in-vivo studies, and then all rows of the sampled key
+    values within their study, e.g. the other results of a sampled animal, so
+    that the subgraphs are complete and connected.
+    :param df: Harmonized data
+    :param rows: Number of rows sampled per combination of the strata columns
+    :param key_col: Column identifying the rows kept together within a study, none if None
+    :param strata: Columns defining the strata, PREVIEW_STRATA if None
+    :param seed: Seed of the random sample
+    :return: Sampled rows, in their original order
+    """
+    if df.empty:
+        return df
+
+    strata = [col for col in (strata or PREVIEW_STRATA) if col in df.columns]
+
+    order = pd.Series(np.random.default_rng(seed).random(len(df)), index=df.index)
+    if strata:
+        order = order.groupby(
+            [df[col] for col in strata], dropna=False, observed=True, sort=False
+        )
+    sampled = order.rank(method="first").to_numpy() <= rows
+
+    if key_col is not None and key_col in df.columns:
+        key_cols = [key_col]
+        if "STUDYID" in df.columns:
+            studies = df["STUDYID"]
+            sampled |= (studies.isin(studies[sampled]) & df[key_col].isna()).to_numpy()
+            key_cols.insert(0, "STUDYID")
+
+        keys = df.groupby(key_cols, dropna=False, observed=True, sort=False).ngroup()
+        sampled = np.isin(keys.to_numpy(), keys.to_numpy()[sampled])
+
+    return df[sampled]
+
+
+def get_preview_data(
+    exp_dir: str, rows: int = PREVIEW_ROWS, seed: int = 0
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Method to sample the data of a project.
+
+    The processed data is used when it exists, otherwise the workbooks are
+    parsed without writing processed data.
+    :param exp_dir: Directory containing the experiments
+    :param rows: Number of rows sampled per stratum
+    :param seed: Seed of the random sample
+    :return: Sampled in-vivo and in-vitro data
+    """
+    if os.path.exists(f"{exp_dir}/processed_invivo_data.tsv"):
+        invivo_df, invitro_df = read_processed_data(exp_dir=exp_dir)
+    else:
+        invivo_df, invitro_df = read_workbooks(
+            [os.path.join(exp_dir, workbook) for workbook in get_workbooks(exp_dir)]
+        )
+
+    return (
+        sample_rows(invivo_df, rows, key_col=PREVIEW_KEY_COLS["invivo"], seed=seed),
+        sample_rows(invitro_df, rows, key_col=PREVIEW_KEY_COLS["invitro"], seed=seed),
+    )
+
+
+def write_preview(
+    exp_dir: str,
+    rows: int = PREVIEW_ROWS,
+    seed: int = 0,
+    credentials: Optional[dict] = None,
+    database: Optional[str] = None,
+    workers: int = 1,
+    plan: Optional[str] = None,
+) -> dict:
+    """Main function to build the preview of a project.
+
+    The sample is written as the processed data of the preview directory of the
+    project, so that every tool reading processed data works on it. It is then
+    loaded into a scratch database, or recorded in a write plan.
+    :param exp_dir: Directory containing the experiments
+    :param rows: Number of rows sampled per stratum
+    :param seed: Seed of the random sample
+    :param credentials: Graph credentials, the preview is not loaded if None
+    :param database: Name of the scratch database, "<project>-preview" if None. The
+        preview is not loaded when the database cannot be created, e.g. on Neo4J
+        Community, as it would replace the graph of the default database
+    :param workers: Number of concurrent writer transactions
+    :param plan: Path of a write plan to record the preview to, see write_plan.py
+    :return: Summary of the preview
+    """
+    start = time.perf_counter()
+    preview_dir = os.path.join(exp_dir, PREVIEW_DIR)
+    os.makedirs(preview_dir, exist_ok=True)
+
+    invivo_df, invitro_df = get_preview_data(exp_dir, rows=rows, seed=seed)
+    invivo_df.to_csv(f"{preview_dir}/processed_invivo_data.tsv", index=False, sep="\t")
+    invitro_df.to_csv(f"{preview_dir}/processed_invitro_data.tsv", index=False, sep="\t")
+
+    summary = {
+        "project": exp_dir,
+        "preview": preview_dir,
+        "invivo_rows": len(invivo_df),
+        "invitro_rows": len(invitro_df),
+    }
+    logger.warning(
+        f"Sampled {len(invivo_df)} in-vivo and {len(invitro_df)} in-vitro rows to {preview_dir}"
+    )
+
+    if plan is not None:
+        from write_plan import record_plan
+
+        summary["plan"] = plan
+        summary.update(record_plan(preview_dir, plan))
+
+    if credentials is not None:
+        database = database or f"{get_database_name(exp_dir)}-preview"
+        scratch = database
+        database = ensure_database(credentials, scratch)
+        if database is None:
+            # Loading a preview replaces the graph, which must never be the project one
+            logger.error(
+                f"Could not create the scratch database {scratch}, the preview is not "
+                "loaded into the default database, record it with --plan instead"
+            )
+            summary["error"] = f"scratch database {scratch} unavailable"
+            summary["seconds"] = time.perf_counter() - start
+            return summary
+
+        # Read back, so that the preview has the dtypes of a processed data load
+        invivo_df, invitro_df = read_processed_data(exp_dir=preview_dir)
+        create_graph(
+            invivo_df=invivo_df,
+            invitro_df=invitro_df,
+            credentials=credentials,
+            exp_dir=preview_dir,
+            workers=workers,
+            database=database,
+            pipeline=True,
+        )
+        summary["database"] = database
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build a preview graph from a stratified sample of a project."
+    )
+    parser.add_argument("exp_dir", help="Experiment directory")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=PREVIEW_ROWS,
+        help=f"Rows sampled per {' x '.join(PREVIEW_STRATA)} combination",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the sample")
+    parser.add_argument(
+        "--plan", help="Record the preview to this write plan instead of loading it"
+    )
+    parser.add_argument(
+        "--database", help="Scratch database, <project>-preview if omitted"
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI", DEFAULT_URI))
+    parser.add_argument("--user", default=os.environ.get("NEO4J_USER", DEFAULT_USER))
+    add_password_argument(parser, required=False)
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.plan is None and args.password is None:
+        parser.error("--password or NEO4J_PASSWORD is required without --plan")
+
+    credentials = None
+    if args.plan is None:
+        credentials = {"uri": args.uri, "user": args.user, "password": args.password}
+
+    summary = write_preview(
+        args.exp_dir,
+        rows=args.rows,
+        seed=args.seed,
+        credentials=credentials,
+        database=args.database,
+        workers=args.workers,
+        plan=args.plan,
+    )
+    print(json.dumps(summary, indent=2))
+    return int("error" in summary)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
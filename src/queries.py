@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""Parameterized queries for the common questions on the graph, with a result cache."""
+
+import argparse
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import List, Optional
+
+from py2neo import Graph
+
+from cli import DEFAULT_URI, DEFAULT_USER, add_password_argument
+
+logger = logging.getLogger("__name__")
+
+# Parameters are always passed separately, so that the server plans each query once
+QUERIES = {
+    "compound_strains": """
+        MATCH (b:Bacteria)-[:ASSOCIATED]->(c:Compound {name: $compound})
+        RETURN b.name AS strain
+        ORDER BY strain
+    """,
+    "compound_activity": """
+        MATCH (c:Compound {name: $compound})-[a:ACTIVITY]->(b:Bacteria)
+        WHERE $result_type IS NULL OR a.`result type` = $result_type
+        RETURN b.name AS strain, a.`result type` AS result_type, a.unit AS unit,
+               a.`number of results` AS n, a.min AS min, a.median AS median,
+               a.`geometric mean` AS geometric_mean, a.MIC50 AS mic50,
+               a.MIC90 AS mic90, a.max AS max
+        ORDER BY strain, result_type
+    """,
+    "study_results": """
+        MATCH (s:Study {`study id`: $study})-[:ASSOCIATED]->(g:`Animal group`)
+              -[:ASSOCIATED]->(a:`Animal number`)-[r:ASSOCIATED]->(res:Result)
+        RETURN g.`animal group` AS group, a.animal AS animal, res.type AS result_type,
+               r.`result operator` AS operator, r.`result value` AS value,
+               r.`result lower bound` AS lower_bound,
+               r.`result upper bound` AS upper_bound, r.name AS unit
+        ORDER BY group, animal, result_type
+        LIMIT $limit
+    """,
+    "results_below": """
+        MATCH (e:Experiment)-[r:ASSOCIATED]->(res:Result {type: $result_type})
+        WHERE r.`result upper bound` <= $max_value
+        RETURN e.`experiment id` AS experiment, r.`result operator` AS operator,
+               r.`result value` AS value, r.name AS unit
+        ORDER BY r.`result upper bound`
+        LIMIT $limit
+    """,
+    # Graphs built with measurement nodes, see measurements.py
+    "compound_measurements": """
+        MATCH (c:Compound {name: $compound})-[:`HAS MEASUREMENT`]->(m:Measurement)
+        WHERE $result_type IS NULL OR m.`result type` = $result_type
+        OPTIONAL MATCH (b:Bacteria)-[:`HAS MEASUREMENT`]->(m)
+        OPTIONAL MATCH (e:Experiment)-[:`HAS MEASUREMENT`]->(m)
+        OPTIONAL MATCH (m)-[:`HAS UNIT`]->(u:Unit)
+        RETURN e.`experiment id` AS experiment, b.name AS strain,
+               m.`result type` AS result_type, m.`result operator` AS operator,
+               m.`result value` AS value, m.`result lower bound` AS lower_bound,
+               m.`result upper bound` AS upper_bound, u.name AS unit
+        ORDER BY strain, result_type, experiment
+        LIMIT $limit
+    """,
+    "strain_measurements": """
+        MATCH (b:Bacteria {name: $strain})-[:`HAS MEASUREMENT`]->(m:Measurement)
+        WHERE $result_type IS NULL OR m.`result type` = $result_type
+        OPTIONAL MATCH (c:Compound)-[:`HAS MEASUREMENT`]->(m)
+        OPTIONAL MATCH (e:Experiment)-[:`HAS MEASUREMENT`]->(m)
+        OPTIONAL MATCH (m)-[:`HAS UNIT`]->(u:Unit)
+        RETURN e.`experiment id` AS experiment, c.name AS compound,
+               m.`result type` AS result_type, m.`result operator` AS operator,
+               m.`result value` AS value, m.`result lower bound` AS lower_bound,
+               m.`result upper bound` AS upper_bound, u.name AS unit
+        ORDER BY compound, result_type, experiment
+        LIMIT $limit
+    """,
+    # Full-text indexes of the free-text properties, see ensure_fulltext_indexes
+    "text_search_nodes": """
+        CALL db.index.fulltext.queryNodes("text_search_nodes", $query) YIELD node, score
+        RETURN labels(node)[0] AS label, properties(node) AS properties, score
+        ORDER BY score DESC
+        LIMIT $limit
+    """,
+    "text_search_relations": """
+        CALL db.index.fulltext.queryRelationships("text_search_relations", $query)
+        YIELD relationship, score
+        RETURN labels(startNode(relationship))[0] AS start_label,
+               properties(startNode(relationship)) AS start,
+               labels(endNode(relationship))[0] AS end_label,
+               properties(endNode(relationship)) AS end,
+               relationship.comments AS comments, score
+        ORDER BY score DESC
+        LIMIT $limit
+    """,
+}
+
+# Optional parameters of every query and their default value
+QUERY_DEFAULTS = {
+    "compound_activity": {"result_type": None},
+    "study_results": {"limit": 1000},
+    "results_below": {"limit": 1000},
+    "compound_measurements": {"result_type": None, "limit": 1000},
+    "strain_measurements": {"result_type": None, "limit": 1000},
+    "text_search_nodes": {"limit": 100},
+    "text_search_relations": {"limit": 100},
+}
+
+_caches = weakref.WeakSet()
+
+
+class QueryCache:
+    """Least recently used cache of query results, whose entries expire after a time to live."""
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Cached value of a key, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or (
+                self.ttl is not None and time.monotonic() - entry[0] > self.ttl
+            ):
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        """Cache a value, evicting the least recently used entries beyond the maximum size."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@functools.lru_cache(maxsize=None)
+def get_graph(
+    uri: str, user: str, password: str, database: Optional[str] = None, max_size: int = 10
+) -> Graph:
+    """Method to get a graph connection shared by all callers with the same details.
+
+    py2neo keeps a pool of up to `max_size` connections per graph, so sharing the
+    graph object avoids opening new connections for every query.
+    """
+    return Graph(uri, auth=(user, password), name=database, max_size=max_size)
+
+
+class GraphQueries:
+    """Prepared queries on a graph built by create_graph, served from a cache when possible.
+
+    The cache of every instance is cleared when a load of the same database
+    commits in this process. Loads from other processes are only seen once
+    the entries expire.
+    """
+
+    def __init__(
+        self,
+        graph: Graph,
+        database: Optional[str] = None,
+        cache_size: int = 256,
+        ttl: Optional[float] = 300.0,
+    ):
+        self.graph = graph
+        self.database = database
+        self.cache = QueryCache(maxsize=cache_size, ttl=ttl)
+        _caches.add(self)
+
+    def run(self, name: str, **params) -> List[dict]:
+        """Run a prepared query, or get its result from the cache.
+        :param name: Name of the query in QUERIES
+        :param params: Query parameters, the optional ones default to QUERY_DEFAULTS
+        :return: Records as dictionaries
+        """
+        if name not in QUERIES:
+            raise KeyError(f"Unknown query {name}, expected one of {', '.join(QUERIES)}")
+
+        params = {**QUERY_DEFAULTS.get(name, {}), **params}
+        key = (name, tuple(sorted(params.items())))
+
+        records = self.cache.get(key)
+        if records is None:
+            records = self.graph.run(QUERIES[name], params).data()
+            self.cache.put(key, records)
+
+        return [dict(record) for record in records]
+
+    def compound_strains(self, compound: str) -> List[dict]:
+        """Strains a compound was tested on."""
+        return self.run("compound_strains", compound=compound)
+
+    def compound_activity(self, compound: str, result_type: Optional[str] = None) -> List[dict]:
+        """Aggregated activity of a compound per strain, e.g. its MIC profile."""
+        return self.run("compound_activity", compound=compound, result_type=result_type)
+
+    def study_results(self, study: str, limit: int = 1000) -> List[dict]:
+        """Results of the animals of an in-vivo study, per animal group."""
+        return self.run("study_results", study=study, limit=limit)
+
+    def results_below(self, result_type: str, max_value: float, limit: int = 1000) -> List[dict]:
+        """Results of a type whose upper bound is at most a value, e.g. MIC <= 2."""
+        return self.run(
+            "results_below", result_type=result_type, max_value=max_value, limit=limit
+        )
+
+    def compound_measurements(
+        self, compound: str, result_type: Optional[str] = None, limit: int = 1000
+    ) -> List[dict]:
+        """Measurements of a compound, in graphs built with measurement nodes."""
+        return self.run(
+            "compound_measurements", compound=compound, result_type=result_type, limit=limit
+        )
+
+    def strain_measurements(
+        self, strain: str, result_type: Optional[str] = None, limit: int = 1000
+    ) -> List[dict]:
+        """Measurements on a strain, in graphs built with measurement nodes."""
+        return self.run(
+            "strain_measurements", strain=strain, result_type=result_type, limit=limit
+        )
+
+    def text_search(self, query: str, limit: int = 100) -> List[dict]:
+        """Nodes and relations whose free-text properties match a Lucene query."""
+        return self.run("text_search_nodes", query=query, limit=limit) + self.run(
+            "text_search_relations", query=query, limit=limit
+        )
+
+    def invalidate(self) -> None:
+        """Drop all cached results."""
+        self.cache.clear()
+
+
+def invalidate_caches(database: Optional[str] = None) -> None:
+    """Clear the caches of the queries on a database, called when a load commits.
+    :param database: Name of the loaded database, all caches are cleared if None
+    """
+    for queries in list(_caches):
+        if database is None or queries.database in (None, database):
+            queries.invalidate()
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run a prepared query on a graph.")
+    parser.add_argument("query", choices=sorted(QUERIES))
+    parser.add_argument(
+        "params", nargs="*", help="Query parameters as name=value, e.g. compound=GN-1234"
+    )
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI", DEFAULT_URI))
+    parser.add_argument("--user", default=os.environ.get("NEO4J_USER", DEFAULT_USER))
+    add_password_argument(parser)
+    parser.add_argument("--database", help="Neo4J database, the default one if omitted")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    params = {}
+    for param in args.params:
+        name, _, value = param.partition("=")
+        try:
+            params[name] = json.loads(value)
+        except json.JSONDecodeError:
+            params[name] = value
+
+    graph = get_graph(args.uri, args.user, args.password, args.database)
+    queries = GraphQueries(graph, database=args.database)
+    print(json.dumps(queries.run(args.query, **params), indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming export of the graph as RDF N-Triples or N-Quads."""
+
+import datetime
+import gzip
+import logging
+import math
+import os
+import re
+from typing import Optional
+from urllib.parse import quote
+
+import pandas as pd
+from py2neo import Node, Relationship
+
+from nodes import add_nodes
+from relations import add_relations
+from collector import get_node_dict
+from constants import NODE_KEY_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+BASE_IRI = "urn:template2graphs:"
+VOCAB_IRI = f"{BASE_IRI}vocab:"
+
+OBO_IRI = "http://purl.obolibrary.org/obo/"
+BIOREGISTRY_IRI = "https://bioregistry.io/"
+
+# Namespaces of the prefixes used by the curies in the mapping files
+CURIE_PREFIXES = {
+    "NCBITaxon": f"{OBO_IRI}NCBITaxon_",
+    "NCIT": f"{OBO_IRI}NCIT_",
+    "UO": f"{OBO_IRI}UO_",
+    "OBI": f"{OBO_IRI}OBI_",
+    "PATO": f"{OBO_IRI}PATO_",
+    "STATO": f"{OBO_IRI}STATO_",
+    "VO": f"{OBO_IRI}VO_",
+    "MICRO": f"{OBO_IRI}MICRO_",
+    "OBCS": f"{OBO_IRI}OBCS_",
+    "BAO": "http://www.bioassayontology.org/bao#BAO_",
+    "EFO": "http://www.ebi.ac.uk/efo/EFO_",
+    "SIO": "http://semanticscience.org/resource/SIO_",
+    "ARO": f"{BIOREGISTRY_IRI}aro:",
+    "ATCC": f"{BIOREGISTRY_IRI}atcc:",
+    "DSM": f"{BIOREGISTRY_IRI}dsmz:",
+    "NCTC": f"{BIOREGISTRY_IRI}nctc:",
+    "SNOMED": f"{BIOREGISTRY_IRI}snomedct:",
+    "GNA": f"{BASE_IRI}GNA:",
+    "NBT": f"{BASE_IRI}NBT:",
+}
+
+RDF_TYPE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"
+RDF_STATEMENT = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#Statement>"
+RDF_SUBJECT = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#subject>"
+RDF_PREDICATE = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#predicate>"
+RDF_OBJECT = "<http://www.w3.org/1999/02/22-rdf-syntax-ns#object>"
+XSD = "http://www.w3.org/2001/XMLSchema#"
+
+
+def _slug(text: str) -> str:
+    """Turn a label, relation type or property name into an IRI local name."""
+    return re.sub(r"[^0-9A-Za-z]+", "_", text).strip("_")
+
+
+def _iri(value: str) -> str:
+    return f"<{value}>"
+
+
+def expand_curie(curie: str) -> str:
+    """Method to get the IRI of a curie from the mapping files."""
+    prefix, _, local_id = curie.partition(":")
+    namespace = CURIE_PREFIXES.get(prefix, f"{BASE_IRI}{quote(prefix, safe='')}:")
+    return f"{namespace}{quote(local_id.strip(), safe='')}"
+
+
+def node_iri(node: Node) -> str:
+    """Method to get the IRI of a node, based on its curie when it has one."""
+    if node.get("curie"):
+        return _iri(expand_curie(node["curie"]))
+
+    label = next(iter(node.labels))
+    key = node.get(NODE_KEY_PROPERTIES[label], "")
+    return _iri(f"{BASE_IRI}{_slug(label)}:{quote(str(key), safe='')}")
+
+
+def literal(value) -> Optional[str]:
+    """Method to serialize a property value as an N-Triples literal."""
+    if isinstance(value, bool):
+        return f'"{str(value).lower()}"^^<{XSD}boolean>'
+
+    if isinstance(value, int):
+        return f'"{value}"^^<{XSD}integer>'
+
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        return f'"{value!r}"^^<{XSD}double>'
+
+    if isinstance(value, datetime.date):
+        return f'"{value.isoformat()}"^^<{XSD}date>'
+
+    text = (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace('"', '\\"')
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+    return f'"{text}"'
+
+
+class RDFWriter:
+    """Stand-in for a py2neo transaction that writes every created entity as RDF.
+
+    Statements are written as soon as they are created and the output is split
+    into files of at most `chunk_size` statements, so memory use does not grow
+    with the size of the graph. Relations with properties are reified as
+    numbered ``rdf:Statement`` resources, which unlike blank nodes stay valid
+    across file boundaries.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        name: str = "graph",
+        graph_name: Optional[str] = None,
+        compress: bool = True,
+        chunk_size: int = 1_000_000,
+    ):
+        """Prepare the writer.
+        :param out_dir: Output directory
+        :param name: Prefix of the output files
+        :param graph_name: Named graph of the statements, N-Triples are written if None
+        :param compress: Write gzip compressed files
+        :param chunk_size: Maximum number of statements per file
+        """
+        self.out_dir = out_dir
+        self.name = name
+        self.graph = f" {_iri(graph_name)}" if graph_name else ""
+        self.compress = compress
+        self.chunk_size = chunk_size
+
+        self.files = []
+        self.num_statements = 0
+        self._num_relations = 0
+        self._file = None
+
+        os.makedirs(out_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _open_next_file(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+        extension = "nq" if self.graph else "nt"
+        path = f"{self.out_dir}/{self.name}-{len(self.files):05d}.{extension}"
+
+        if self.compress:
+            path += ".gz"
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+
+        self.files.append(path)
+
+    def _write(self, subject: str, predicate: str, obj: Optional[str]) -> None:
+        if obj is None:
+            return
+
+        if self.num_statements % self.chunk_size == 0:
+            self._open_next_file()
+
+        self._file.write(f"{subject} {predicate} {obj}{self.graph} .\n")
+        self.num_statements += 1
+
+    def _write_properties(self, subject: str, properties: dict) -> None:
+        for key, value in properties.items():
+            if value is None or value == "":
+                continue
+            self._write(subject, _iri(f"{VOCAB_IRI}{_slug(key)}"), literal(value))
+
+    def create(self, subgraph):
+        """Write a node or relationship as RDF statements.
+        :param subgraph: Node or relationship created by the pipeline
+        """
+        if isinstance(subgraph, Relationship):
+            subject = node_iri(subgraph.start_node)
+            predicate = _iri(f"{VOCAB_IRI}{_slug(type(subgraph).__name__)}")
+            obj = node_iri(subgraph.end_node)
+
+            self._write(subject, predicate, obj)
+
+            properties = dict(subgraph)
+            if properties:
+                statement = _iri(f"{BASE_IRI}relation:{self._num_relations}")
+                self._num_relations += 1
+
+                self._write(statement, RDF_TYPE, RDF_STATEMENT)
+                self._write(statement, RDF_SUBJECT, subject)
+                self._write(statement, RDF_PREDICATE, predicate)
+                self._write(statement, RDF_OBJECT, obj)
+                self._write_properties(statement, properties)
+        else:
+            subject = node_iri(subgraph)
+            for label in subgraph.labels:
+                self._write(subject, RDF_TYPE, _iri(f"{VOCAB_IRI}{_slug(label)}"))
+            self._write_properties(subject, dict(subgraph))
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def export_rdf(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    out_dir: str,
+    graph_name: Optional[str] = None,
+    compress: bool = True,
+    chunk_size: int = 1_000_000,
+) -> list:
+    """Main function to export the graph as RDF.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param out_dir: Output directory
+    :param graph_name: Write N-Quads in the named graph of this project instead of N-Triples
+    :param compress: Write gzip compressed files
+    :param chunk_size: Maximum number of statements per file
+    :return: List of written files
+    """
+    if graph_name:
+        graph_name = f"{BASE_IRI}graph:{quote(graph_name, safe='')}"
+
+    with RDFWriter(
+        out_dir=out_dir, graph_name=graph_name, compress=compress, chunk_size=chunk_size
+    ) as writer:
+        node_dict = get_node_dict()
+
+        if not invivo_df.empty:
+            node_dict = add_nodes(tx=writer, df=invivo_df, node_dict=node_dict)
+
+        if not invitro_df.empty:
+            node_dict = add_nodes(tx=writer, df=invitro_df, node_dict=node_dict)
+
+        add_relations(
+            invivo_df=invivo_df,
+            invitro_df=invitro_df,
+            node_mapping_dict=node_dict,
+            tx=writer,
+        )
+
+    logger.warning(
+        f"Wrote {writer.num_statements} statements to {len(writer.files)} files"
+    )
+
+    return writer.files
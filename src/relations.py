@@ -8,7 +8,15 @@ from tqdm import tqdm
 from py2neo import Relationship, Node
 from py2neo.database import Transaction
 
-pd.set_option("display.max_columns", None)
+from activity import get_activity_summary
+from instrumentation import instrumented
+
+
+def _format_value(value) -> str:
+    """Format a result value, writing whole numbers without a trailing ".0"."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
 
 
 def _create_relation(
@@ -21,13 +29,24 @@ def _create_relation(
     tx.create(Relationship(entity_a, relation_type, entity_b, **rel_props))
 
 
+def _count_rows(invivo_df: pd.DataFrame, invitro_df: pd.DataFrame, *args, **kwargs):
+    return len(invivo_df) + len(invitro_df)
+
+
+@instrumented("add_relations", rows=_count_rows)
 def add_relations(
     invivo_df: pd.DataFrame,
     invitro_df: pd.DataFrame,
     node_mapping_dict: dict,
     tx: Transaction,
+    activity: bool = False,
+    results: bool = True,
 ) -> None:
-    """Populate the relations to the graph."""
+    """Populate the relations to the graph.
+    :param activity: Also add the activity relations, which need all results of the graph
+    :param results: Also add the relations to the Result nodes holding the result values,
+        left out when the results are measurement nodes, see measurements.py
+    """
 
     if not invivo_df.empty:
         """Animal species -> Animal group"""
@@ -92,6 +111,11 @@ def add_relations(
         "DOSE",
         "EXT_BATCH_ID",
         "EXT_CPD_ID",
+        "RESULT_LOWER_BOUND",
+        "RESULT_UPPER_BOUND",
+        "DOSE_numeric",
+        "TDD_numeric",
+        "PRETREATMENT_DOSE_numeric",
     ]
 
     if not invivo_df.empty:
@@ -135,6 +159,11 @@ def add_relations(
                 treatment_dose,
                 ext_batch_id,
                 ext_cpd_id,
+                result_lower_bound,
+                result_upper_bound,
+                treatment_dose_numeric,
+                total_drug_dose_numeric,
+                pretreatment_dose_numeric,
             ) = rows
 
             """Study -> Animal group edge"""
@@ -208,6 +237,11 @@ def add_relations(
                     ):
                         annotation["pretreatment dose (mg/kg)"] = pretreatment_dose
 
+                    if pd.notna(pretreatment_dose_numeric):
+                        annotation["pretreatment dose (numeric)"] = (
+                            pretreatment_dose_numeric
+                        )
+
                     if "PRETREATMENT_DOSING_INFO" in invivo_df.columns and pd.notna(
                         pretreatment_dosing_info
                     ):
@@ -280,6 +314,12 @@ def add_relations(
                     if pd.notna(total_drug_dose):
                         annotation["total drug dose (mg/kg)"] = total_drug_dose
 
+                    if pd.notna(treatment_dose_numeric):
+                        annotation["treatment dose (numeric)"] = treatment_dose_numeric
+
+                    if pd.notna(total_drug_dose_numeric):
+                        annotation["total drug dose (numeric)"] = total_drug_dose_numeric
+
                     if pd.notna(roa_dict):
                         if not isinstance(roa_dict, dict):
                             if roa_dict != "":  # empty strings
@@ -308,7 +348,7 @@ def add_relations(
                     )
 
             """Animal number -> Result edge"""
-            if pd.notna(animal_number) and pd.notna(result_type):
+            if results and pd.notna(animal_number) and pd.notna(result_type):
                 annotation = {}
 
                 if pd.notna(value):
@@ -317,6 +357,12 @@ def add_relations(
                 if pd.notna(operator):
                     annotation["result operator"] = operator
 
+                if pd.notna(result_lower_bound):
+                    annotation["result lower bound"] = result_lower_bound
+
+                if pd.notna(result_upper_bound):
+                    annotation["result upper bound"] = result_upper_bound
+
                 if pd.notna(method_dict):
                     if isinstance(method_dict, str) and method_dict != "":
                         method_dict = ast.literal_eval(method_dict)
@@ -340,10 +386,10 @@ def add_relations(
 
                 if pd.notna(value) and pd.notna(operator) and "name" in unit_dict:
                     if unit_dict["name"] == "No unit":
-                        annotation["result"] = str(operator) + " " + str(value)
+                        annotation["result"] = str(operator) + " " + _format_value(value)
                     else:
                         annotation["result"] = (
-                            str(operator) + " " + str(value) + " " + unit_dict["name"]
+                            str(operator) + " " + _format_value(value) + " " + unit_dict["name"]
                         )
 
                 if pd.notna(comments):
@@ -425,7 +471,7 @@ def add_relations(
                 )
 
             """Experiment -> Result edge"""
-            if pd.notna(exp_id) and pd.notna(result_type):
+            if results and pd.notna(exp_id) and pd.notna(result_type):
                 annotation = {}
 
                 if pd.notna(value):
@@ -434,6 +480,12 @@ def add_relations(
                 if pd.notna(operator):
                     annotation["result operator"] = operator
 
+                if pd.notna(result_lower_bound):
+                    annotation["result lower bound"] = result_lower_bound
+
+                if pd.notna(result_upper_bound):
+                    annotation["result upper bound"] = result_upper_bound
+
                 if pd.notna(unit_dict):
                     annotation.update(unit_dict)
 
@@ -452,10 +504,10 @@ def add_relations(
 
                 if pd.notna(value) and pd.notna(operator) and "name" in unit_dict:
                     if unit_dict["name"] == "No unit":
-                        annotation["result"] = str(operator) + " " + str(value)
+                        annotation["result"] = str(operator) + " " + _format_value(value)
                     else:
                         annotation["result"] = (
-                            str(operator) + " " + str(value) + " " + unit_dict["name"]
+                            str(operator) + " " + _format_value(value) + " " + unit_dict["name"]
                         )
 
                 if pd.notna(comments):
@@ -494,6 +546,8 @@ def add_relations(
         "STUDYID",
         "EXT_BATCH_ID",
         "EXT_CPD_ID",
+        "RESULT_LOWER_BOUND",
+        "RESULT_UPPER_BOUND",
     ]
 
     if not invitro_df.empty:
@@ -521,6 +575,8 @@ def add_relations(
                 study_id,
                 ext_batch_id,
                 ext_cpd_id,
+                result_lower_bound,
+                result_upper_bound,
             ) = rows
 
             # relations in both in-vivo and in-vitro dataset
@@ -592,7 +648,7 @@ def add_relations(
                 )
 
             """Experiment -> Result edge"""
-            if pd.notna(exp_id) and pd.notna(result_type):
+            if results and pd.notna(exp_id) and pd.notna(result_type):
                 annotation = {}
 
                 if pd.notna(value):
@@ -601,6 +657,12 @@ def add_relations(
                 if pd.notna(operator):
                     annotation["result operator"] = operator
 
+                if pd.notna(result_lower_bound):
+                    annotation["result lower bound"] = result_lower_bound
+
+                if pd.notna(result_upper_bound):
+                    annotation["result upper bound"] = result_upper_bound
+
                 if pd.isna(unit_dict):
                     unit_dict = {}
                 elif not isinstance(unit_dict, dict):
@@ -622,10 +684,10 @@ def add_relations(
 
                 if pd.notna(value) and pd.notna(operator) and "name" in unit_dict:
                     if unit_dict["name"] == "No unit":
-                        annotation["result"] = str(operator) + " " + str(value)
+                        annotation["result"] = str(operator) + " " + _format_value(value)
                     else:
                         annotation["result"] = (
-                            str(operator) + " " + str(value) + " " + unit_dict["name"]
+                            str(operator) + " " + _format_value(value) + " " + unit_dict["name"]
                         )
 
                 if pd.notna(comments):
@@ -642,3 +704,52 @@ def add_relations(
                     tx=tx,
                     rel_props=annotation,
                 )
+
+    """Compound -> Bacteria activity edges"""
+    if activity:
+        add_activity_relations(
+            get_activity_summary([invivo_df, invitro_df]), node_mapping_dict, tx
+        )
+
+
+def get_activity_properties(row) -> dict:
+    """Method to get the properties of the activity relation of an activity summary row."""
+    annotation = {
+        "result type": row.RESULT_TYPE,
+        "number of results": int(row.n),
+        "min": row.min,
+        "median": row.median,
+        "max": row.max,
+    }
+
+    if pd.notna(row.mic50):
+        annotation["MIC50"] = row.mic50
+        annotation["MIC90"] = row.mic90
+
+    if row.RESULT_UNIT:
+        annotation["unit"] = row.RESULT_UNIT
+
+    if pd.notna(row.geometric_mean):
+        annotation["geometric mean"] = row.geometric_mean
+
+    return annotation
+
+
+def add_activity_relations(
+    summary: pd.DataFrame, node_mapping_dict: dict, tx: Transaction
+) -> None:
+    """Populate the Compound -> Bacteria activity relations of an activity summary."""
+    for row in summary.itertuples(index=False):
+        if (
+            row.CPD_ID not in node_mapping_dict["Compound"]
+            or row.BACTERIAL_STRAIN_NAME not in node_mapping_dict["Bacteria"]
+        ):
+            continue
+
+        _create_relation(
+            entity_a=node_mapping_dict["Compound"][row.CPD_ID],
+            relation_type="ACTIVITY",
+            entity_b=node_mapping_dict["Bacteria"][row.BACTERIAL_STRAIN_NAME],
+            tx=tx,
+            rel_props=get_activity_properties(row),
+        )
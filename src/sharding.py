@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+
+"""Sharded build of the graph of large projects, with content-addressed node ids."""
+
+import argparse
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+from py2neo import Node
+
+from activity import (
+    ACTIVITY_KEYS,
+    count_activity_values,
+    get_activity_values,
+    summarize_activity,
+)
+from collector import get_node_dict, hash_content
+from main import read_workbooks
+from nodes import add_nodes
+from relations import add_relations, get_activity_properties
+from write_plan import RecordingTransaction, dump_record, read_plan
+from constants import NODE_KEY_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+FRAGMENT_PATTERN = re.compile(r"^shard-(\d{4})-of-(\d{4})\.jsonl\.gz$")
+
+
+def node_id(label: str, key) -> str:
+    """Deterministic id of a node from its label and natural key.
+
+    Every shard gives the same id to the same node, so that fragments can be
+    merged without exchanging node dictionaries.
+    """
+    return hash_content(label, str(key))
+
+
+def get_node_id(node: Node) -> str:
+    """Method to get the content-addressed id of a node created by add_nodes."""
+    label = next(iter(node.labels))
+    key_property = NODE_KEY_PROPERTIES.get(label)
+
+    if key_property is None:
+        return hash_content(label, dict(node))
+
+    return node_id(label, node[key_property])
+
+
+def get_workbooks(exp_dir: str) -> List[str]:
+    """Method to list the workbooks of an experiment directory in a stable order.
+    :param exp_dir: Directory containing the experiments
+    :return: Paths relative to the experiment directory, sorted
+    """
+    workbooks = []
+
+    for path, dirs, files in os.walk(exp_dir, topdown=True):
+        for name in files:
+            if name.endswith(".xlsx"):
+                workbooks.append(os.path.relpath(os.path.join(path, name), exp_dir))
+
+    return sorted(workbooks)
+
+
+def get_shard_workbooks(exp_dir: str, shard: int, shards: int) -> List[str]:
+    """Method to get the workbooks assigned to a shard.
+
+    Workbooks are dealt round robin in sorted order, so that every process or
+    host seeing the same shared storage agrees on the assignment.
+    """
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is out of range for {shards} shards")
+
+    return get_workbooks(exp_dir)[shard::shards]
+
+
+def _fragment_name(shard: int, shards: int) -> str:
+    return f"shard-{shard:04d}-of-{shards:04d}"
+
+
+def build_shard(exp_dir: str, output_dir: str, shard: int, shards: int) -> dict:
+    """Main function to build the node and edge fragment of a shard.
+
+    The fragment is a write plan whose node ids are content-addressed. The
+    activity relations need the results of all shards, so the shard writes the
+    number of results per value next to the fragment instead. Both files are renamed into
+    place once complete, so a fragment on disk is always a finished shard.
+    :param exp_dir: Directory containing the experiments
+    :param output_dir: Directory of the fragments, shared by all shards
+    :param shard: Index of the shard, from 0
+    :param shards: Number of shards
+    :return: Summary of the fragment
+    """
+    workbooks = get_shard_workbooks(exp_dir, shard, shards)
+    invivo_df, invitro_df = read_workbooks(
+        [os.path.join(exp_dir, workbook) for workbook in workbooks]
+    )
+
+    os.makedirs(output_dir, exist_ok=True)
+    name = _fragment_name(shard, shards)
+    plan_path = os.path.join(output_dir, f"{name}.jsonl.gz")
+    values_path = os.path.join(output_dir, f"{name}.activity.tsv")
+
+    values = count_activity_values(get_activity_values([invivo_df, invitro_df]))
+    values.to_csv(f"{values_path}.tmp", sep="\t", index=False)
+    os.replace(f"{values_path}.tmp", values_path)
+
+    # The temporary name keeps the .gz suffix, so that the plan is compressed
+    tmp_path = os.path.join(output_dir, f".{name}.jsonl.gz")
+    with RecordingTransaction(tmp_path, node_key=get_node_id) as tx:
+        node_dict = get_node_dict()
+        for df in (invivo_df, invitro_df):
+            if not df.empty:
+                node_dict = add_nodes(tx=tx, df=df, node_dict=node_dict)
+
+        add_relations(
+            invivo_df=invivo_df,
+            invitro_df=invitro_df,
+            node_mapping_dict=node_dict,
+            tx=tx,
+            activity=False,
+        )
+    os.replace(tmp_path, plan_path)
+
+    summary = {"shard": shard, "workbooks": len(workbooks), **tx.summary()}
+    logger.warning(
+        f"Built shard {shard + 1}/{shards} from {len(workbooks)} workbooks: "
+        f"{summary['nodes']} nodes and {summary['relationships']} relations"
+    )
+    return summary
+
+
+def get_fragments(output_dir: str) -> List[str]:
+    """Method to get the fragments of all shards, checking that none is missing.
+    :param output_dir: Directory of the fragments
+    :return: Paths of the fragments, ordered by shard
+    :raises FileNotFoundError: If some shards have not finished
+    """
+    fragments: Dict[int, str] = {}
+    counts = set()
+
+    for path in glob.glob(os.path.join(output_dir, "shard-*-of-*.jsonl.gz")):
+        match = FRAGMENT_PATTERN.match(os.path.basename(path))
+        if match:
+            fragments[int(match.group(1))] = path
+            counts.add(int(match.group(2)))
+
+    if not counts:
+        raise FileNotFoundError(f"No fragments found in {output_dir}")
+    if len(counts) > 1:
+        raise FileNotFoundError(
+            f"Expected the fragments of a single sharded build in {output_dir}, "
+            f"found builds with {sorted(counts)} shards"
+        )
+
+    shards = counts.pop()
+    missing = sorted(set(range(shards)) - set(fragments))
+    if missing:
+        raise FileNotFoundError(
+            f"Missing fragments of shards {', '.join(map(str, missing))} in {output_dir}"
+        )
+
+    return [fragments[shard] for shard in range(shards)]
+
+
+def _write_record(f, record: list) -> None:
+    f.write(dump_record(record))
+
+
+def merge_shards(output_dir: str, plan_path: str, activity: bool = False) -> dict:
+    """Main function to merge the fragments of all shards into a single write plan.
+
+    Nodes are merged by id, combining the properties of a node found in several
+    shards and keeping the value of the lowest shard on conflicts. Relations are per result row, so the relations of
+    all fragments are simply concatenated. The activity relations, if requested,
+    are computed last, from the result values of all shards. Only the node ids and properties
+    are kept in memory, the relations are streamed.
+    :param output_dir: Directory of the fragments
+    :param plan_path: Path of the merged plan, to be loaded with write_plan.replay_plan
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Number of merged nodes and relations
+    """
+    fragments = get_fragments(output_dir)
+
+    nodes: Dict[str, list] = {}
+    for fragment in fragments:
+        for record in read_plan(fragment):
+            if record[0] != "n":
+                continue
+            if record[1] in nodes:
+                for name, value in record[3].items():
+                    nodes[record[1]][3].setdefault(name, value)
+            else:
+                nodes[record[1]] = record
+
+    summary = pd.DataFrame(columns=ACTIVITY_KEYS)
+    if activity:
+        values = pd.concat(
+            [
+                pd.read_csv(
+                    fragment.replace(".jsonl.gz", ".activity.tsv"),
+                    sep="\t",
+                    dtype={key: str for key in ACTIVITY_KEYS},
+                    keep_default_na=False,
+                )
+                for fragment in fragments
+            ],
+            ignore_index=True,
+        )
+        summary = summarize_activity(values)
+
+    relationship_counts = Counter()
+    opener = gzip.open if plan_path.endswith(".gz") else open
+    with opener(plan_path, "wt", encoding="utf-8") as plan:
+        for record in nodes.values():
+            _write_record(plan, record)
+
+        for fragment in fragments:
+            for record in read_plan(fragment):
+                if record[0] == "r":
+                    relationship_counts[record[1]] += 1
+                    _write_record(plan, record)
+
+        for row in summary.itertuples(index=False):
+            start = node_id("Compound", row.CPD_ID)
+            end = node_id("Bacteria", row.BACTERIAL_STRAIN_NAME)
+            if start in nodes and end in nodes:
+                relationship_counts["ACTIVITY"] += 1
+                _write_record(
+                    plan, ["r", "ACTIVITY", start, end, get_activity_properties(row)]
+                )
+
+    stats = {
+        "shards": len(fragments),
+        "nodes": len(nodes),
+        "relationships": sum(relationship_counts.values()),
+        "types": dict(relationship_counts),
+    }
+    logger.warning(
+        f"Merged {stats['shards']} shards into {stats['nodes']} nodes and "
+        f"{stats['relationships']} relations in {plan_path}"
+    )
+    return stats
+
+
+def build_sharded(
+    exp_dir: str,
+    output_dir: str,
+    plan_path: str,
+    shards: int = 4,
+    jobs: Optional[int] = None,
+    activity: bool = False,
+) -> dict:
+    """Build all shards of an experiment in local processes and merge them.
+    :param exp_dir: Directory containing the experiments
+    :param output_dir: Directory of the fragments
+    :param plan_path: Path of the merged plan
+    :param shards: Number of shards
+    :param jobs: Number of concurrent processes, one per shard if None
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Number of merged nodes and relations
+    """
+    with ProcessPoolExecutor(max_workers=jobs or shards) as executor:
+        futures = [
+            executor.submit(build_shard, exp_dir, output_dir, shard, shards)
+            for shard in range(shards)
+        ]
+        for future in futures:
+            future.result()
+
+    return merge_shards(output_dir, plan_path, activity=activity)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build the graph of an experiment in shards, then merge the shards."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    shard = subparsers.add_parser("shard", help="Build the fragment of one shard")
+    shard.add_argument("exp_dir", help="Experiment directory")
+    shard.add_argument("output_dir", help="Directory of the fragments, e.g. on shared storage")
+    shard.add_argument("--shard", type=int, required=True, help="Index of the shard, from 0")
+    shard.add_argument("--shards", type=int, required=True, help="Number of shards")
+
+    merge = subparsers.add_parser("merge", help="Merge the fragments of all shards")
+    merge.add_argument("output_dir", help="Directory of the fragments")
+    merge.add_argument("plan", help="Merged plan file, gzip compressed if it ends with .gz")
+    merge.add_argument(
+        "--activity", action="store_true", help="Add the compound activity relations"
+    )
+
+    build = subparsers.add_parser("build", help="Build all shards locally and merge them")
+    build.add_argument("exp_dir", help="Experiment directory")
+    build.add_argument("output_dir", help="Directory of the fragments")
+    build.add_argument("plan", help="Merged plan file, gzip compressed if it ends with .gz")
+    build.add_argument("--shards", type=int, default=4)
+    build.add_argument("--jobs", type=int, help="Number of processes, one per shard by default")
+    build.add_argument(
+        "--activity", action="store_true", help="Add the compound activity relations"
+    )
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    if args.command == "shard":
+        stats = build_shard(args.exp_dir, args.output_dir, args.shard, args.shards)
+    elif args.command == "merge":
+        stats = merge_shards(args.output_dir, args.plan, activity=args.activity)
+    else:
+        stats = build_sharded(
+            args.exp_dir,
+            args.output_dir,
+            args.plan,
+            shards=args.shards,
+            jobs=args.jobs,
+            activity=args.activity,
+        )
+
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
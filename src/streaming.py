@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming build of the graph, from workbook rows to graph batches in bounded chunks."""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import warnings
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+from py2neo import Graph
+
+from cli import DEFAULT_URI, DEFAULT_USER, add_password_argument
+from activity import (
+    export_activity_summary,
+    get_activity_counts,
+    summarize_activity,
+    update_activity_counts,
+)
+from collector import GraphCollector, get_node_dict
+from data_preprocessing import coerce_types, harmonize_data, optimize_dtypes
+from incremental import ensure_fulltext_indexes, ensure_key_indexes, ensure_range_indexes
+from main import intersection
+from nodes import add_nodes
+from queries import invalidate_caches
+from relations import add_relations, get_activity_properties
+from sharding import get_workbooks, node_id
+from validation import check_experiment
+from writer_pool import (
+    BATCH_SIZE,
+    Batch,
+    WriterPool,
+    get_edge_batches,
+    get_node_batches,
+    split_edge_rows,
+    _write_edges,
+    _write_nodes,
+)
+from write_plan import dump_record
+from constants import NODE_KEY_PROPERTIES, STREAM_CHUNK_SIZE
+
+logger = logging.getLogger("__name__")
+
+DROPPED_COLS = ["Variable", "#NA (not applicable)", "#NA (not applicable).1", "StdDev"]
+# Row of the column names of the sheets, as parsed by get_invivo_data and get_invitro_data
+INVIVO_HEADER_ROWS = {"StudyDetails": 6, "Treatment": 7, "ExperimentResults": 6}
+INVITRO_HEADER_ROW = 6
+
+# Columns tracking which rows of the small sheets were merged with a result row
+STUDY_ROW = "_study_row"
+TREATMENT_ROW = "_treatment_row"
+
+
+def _convert_cell(cell):
+    """Value of a cell as converted by pandas.read_excel."""
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float("nan")
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+
+def _to_frame(header: list, rows: List[list]) -> pd.DataFrame:
+    """Parse rows like pandas.read_excel with dtype=str, with the same missing values."""
+    return TextParser(
+        [header] + rows, header=0, dtype=str, skip_blank_lines=False
+    ).read()
+
+
+def read_sheet_chunks(
+    ws, header_row: int, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Method to stream the rows of a sheet as DataFrames of at most `chunk_size` rows.
+
+    Cells beyond the last column name are ignored. Empty rows are kept, except
+    at the end of the sheet, like pandas.read_excel does.
+    :param ws: Worksheet opened in read-only mode
+    :param header_row: Row number of the column names
+    :param chunk_size: Maximum number of rows per chunk
+    """
+    ws.reset_dimensions()
+    rows = ws.iter_rows(min_row=header_row)
+
+    header = [_convert_cell(cell) for cell in next(rows, ())]
+    while header and header[-1] == "":
+        header.pop()
+    if not header:
+        return
+
+    width = len(header)
+    chunk = []
+    empty_rows = 0
+
+    for row in rows:
+        values = [_convert_cell(cell) for cell in row[:width]]
+        if all(value == "" for value in values):
+            empty_rows += 1
+            continue
+
+        chunk.extend([[""] * width for _ in range(empty_rows)])
+        empty_rows = 0
+        chunk.append(values + [""] * (width - len(values)))
+
+        if len(chunk) >= chunk_size:
+            yield _to_frame(header, chunk)
+            chunk = []
+
+    if chunk:
+        yield _to_frame(header, chunk)
+
+
+def _clean(df: pd.DataFrame) -> pd.DataFrame:
+    return df.drop(DROPPED_COLS, axis=1, errors="ignore")
+
+
+def _finish(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = [col.rstrip().lstrip() for col in df.columns]
+    return optimize_dtypes(coerce_types(harmonize_data(df)))
+
+
+def iter_invitro_chunks(
+    path: str, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Method to stream the harmonized data of an in-vitro workbook, see get_invitro_data."""
+    wb = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        for chunk in read_sheet_chunks(wb.worksheets[0], INVITRO_HEADER_ROW, chunk_size):
+            yield _finish(_clean(chunk))
+    finally:
+        wb.close()
+
+
+def _read_sheet(ws, header_row: int) -> pd.DataFrame:
+    chunks = [_clean(chunk) for chunk in read_sheet_chunks(ws, header_row)]
+    if not chunks:
+        return pd.DataFrame(dtype=str)
+    return pd.concat(chunks, ignore_index=True).dropna(axis=0, how="all")
+
+
+def _has_missing_groups(ws, header_row: int) -> bool:
+    """Whether a result sheet has rows without group, which get_invivo_data skips."""
+    for chunk in read_sheet_chunks(ws, header_row):
+        chunk = chunk.dropna(axis=0, how="all")
+        if "GROUP_DESCRIPTION" in chunk.columns and chunk["GROUP_DESCRIPTION"].isna().any():
+            return True
+    return False
+
+
+def iter_invivo_chunks(
+    path: str, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[pd.DataFrame]:
+    """Method to stream the harmonized data of an in-vivo workbook in chunks.
+
+    The study details and treatments are small and read once. Every chunk of
+    result rows is merged with them as in get_invivo_data, and the study and
+    treatment rows without any result are emitted last, so that the chunks hold
+    the rows of the outer merges of get_invivo_data.
+    :param path: Path of the workbook
+    :param chunk_size: Maximum number of result rows per chunk
+    """
+    wb = load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        study = _read_sheet(wb["StudyDetails"], INVIVO_HEADER_ROWS["StudyDetails"])
+        treatment = _read_sheet(wb["Treatment"], INVIVO_HEADER_ROWS["Treatment"])
+
+        result_sheets = []
+        columns = []
+        for sheet in wb.sheetnames:
+            if not sheet.startswith("ExperimentResults"):
+                continue
+
+            ws = wb[sheet]
+            if _has_missing_groups(ws, INVIVO_HEADER_ROWS["ExperimentResults"]):
+                logger.warning(f"Skipping in-vivo sheet with empty groups: {sheet}")
+                continue
+
+            result_sheets.append(sheet)
+            header = next(
+                read_sheet_chunks(ws, INVIVO_HEADER_ROWS["ExperimentResults"], 1), None
+            )
+            if header is not None:
+                columns.extend(c for c in _clean(header).columns if c not in columns)
+        columns.append("Experiment")
+
+        study_keys = intersection(study.columns, columns)
+        study = study.assign(**{STUDY_ROW: range(len(study))})
+        treatment = treatment.assign(**{TREATMENT_ROW: range(len(treatment))})
+        merged_studies, merged_treatments = set(), set()
+
+        def _merge_treatment(study_exp: pd.DataFrame) -> pd.DataFrame:
+            keys = intersection(treatment.columns, study_exp.columns)
+            with warnings.catch_warnings():
+                # pandas warns about the empty result columns used as merge keys
+                warnings.simplefilter("ignore", FutureWarning)
+                df = pd.merge(treatment, study_exp, how="right", on=keys)
+            merged_studies.update(df[STUDY_ROW].dropna().astype(int))
+            merged_treatments.update(df[TREATMENT_ROW].dropna().astype(int))
+            return df
+
+        for sheet in result_sheets:
+            for chunk in read_sheet_chunks(
+                wb[sheet], INVIVO_HEADER_ROWS["ExperimentResults"], chunk_size
+            ):
+                chunk = _clean(chunk).dropna(axis=0, how="all")
+                if chunk.empty:
+                    continue
+
+                chunk["Experiment"] = sheet
+                # Columns of the other result sheets, missing like in the concatenation
+                chunk = chunk.reindex(columns=columns).astype(object)
+
+                study_exp = pd.merge(study, chunk, how="right", on=study_keys)
+                df = _merge_treatment(study_exp)
+                yield _finish(df.drop([STUDY_ROW, TREATMENT_ROW], axis=1))
+
+        # Rows of the outer merges without any result
+        study_columns = list(study.columns) + [c for c in columns if c not in study.columns]
+        study_exp = (
+            study[~study[STUDY_ROW].isin(merged_studies)]
+            .reindex(columns=study_columns)
+            .astype(object)
+        )
+        df = _merge_treatment(study_exp)
+        df = pd.concat(
+            [df, treatment[~treatment[TREATMENT_ROW].isin(merged_treatments)]],
+            ignore_index=True,
+        )
+
+        if not df.empty:
+            yield _finish(df.drop([STUDY_ROW, TREATMENT_ROW], axis=1))
+    finally:
+        wb.close()
+
+
+def iter_chunks(
+    exp_dir: str, chunk_size: int = STREAM_CHUNK_SIZE
+) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """Main function to stream the harmonized data of all workbooks of an experiment.
+
+    In-vivo workbooks come first, like in create_graph, so that the first row
+    seen of a node defines its properties in both modes.
+    :param exp_dir: Directory containing the experiments
+    :param chunk_size: Maximum number of rows per chunk
+    :return: "invivo" or "invitro" and a chunk of harmonized data
+    """
+    invivo, invitro = [], []
+    for workbook in get_workbooks(exp_dir):
+        path = os.path.join(exp_dir, workbook)
+        wb = load_workbook(path, read_only=True)
+        (invivo if len(wb.sheetnames) > 3 else invitro).append(path)
+        wb.close()
+
+    for path in invivo:
+        for chunk in iter_invivo_chunks(path, chunk_size):
+            yield "invivo", chunk
+
+    for path in invitro:
+        for chunk in iter_invitro_chunks(path, chunk_size):
+            yield "invitro", chunk
+
+
+class NodeRegistry:
+    """Natural keys of the nodes already emitted, the only state kept across chunks."""
+
+    def __init__(self):
+        self.keys: Dict[str, set] = {}
+
+    def __contains__(self, node) -> bool:
+        label, key = node
+        return key in self.keys.get(label, ())
+
+    def add(self, label: str, key) -> None:
+        self.keys.setdefault(label, set()).add(key)
+
+    def __len__(self) -> int:
+        return sum(len(keys) for keys in self.keys.values())
+
+
+def iter_graph_batches(
+    chunks: Iterator[Tuple[str, pd.DataFrame]],
+    registry: Optional[NodeRegistry] = None,
+    batch_size: int = BATCH_SIZE,
+    activity_counts: Optional[Counter] = None,
+) -> Iterator[Tuple[List[Batch], List[Batch]]]:
+    """Main function to turn chunks of harmonized data into node and relation batches.
+
+    The nodes and relations of every chunk are computed with a node dictionary
+    of that chunk only. Nodes already emitted by an earlier chunk are left out
+    of its node batches, and relations refer to their endpoints by natural key,
+    so nothing but the registry of emitted keys outlives a chunk.
+    :param chunks: Chunks returned by iter_chunks
+    :param registry: Keys of the nodes already emitted, updated in place
+    :param batch_size: Maximum number of rows per batch
+    :param activity_counts: Histogram updated with the result values of every chunk, if given
+    :return: Node batches and relation batches of every chunk
+    """
+    registry = NodeRegistry() if registry is None else registry
+
+    for kind, chunk in chunks:
+        collector = GraphCollector()
+        node_dict = add_nodes(tx=collector, df=chunk, node_dict=get_node_dict())
+
+        empty = pd.DataFrame()
+        add_relations(
+            invivo_df=chunk if kind == "invivo" else empty,
+            invitro_df=chunk if kind == "invitro" else empty,
+            node_mapping_dict=node_dict,
+            tx=collector,
+            activity=False,
+        )
+
+        new_nodes = get_node_dict()
+        for label, nodes in node_dict.items():
+            for key, node in nodes.items():
+                if (label, key) not in registry:
+                    registry.add(label, key)
+                    new_nodes[label][key] = node
+
+        if activity_counts is not None:
+            update_activity_counts(activity_counts, [chunk])
+
+        yield (
+            get_node_batches(new_nodes, batch_size=batch_size),
+            get_edge_batches(node_dict, collector.relationships, batch_size=batch_size),
+        )
+
+
+def get_activity_batches(
+    summary: pd.DataFrame, registry: NodeRegistry, batch_size: int = BATCH_SIZE
+) -> List[Batch]:
+    """Method to get the batches of the activity relations of the emitted nodes."""
+    rows = [
+        (row.CPD_ID, get_activity_properties(row), row.BACTERIAL_STRAIN_NAME)
+        for row in summary.itertuples(index=False)
+        if ("Compound", row.CPD_ID) in registry
+        and ("Bacteria", row.BACTERIAL_STRAIN_NAME) in registry
+    ]
+    return split_edge_rows({("ACTIVITY", "Compound", "Bacteria"): rows}, batch_size)
+
+
+def stream_graph(
+    graph: Graph,
+    exp_dir: str,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    workers: int = 1,
+    batch_size: int = BATCH_SIZE,
+    validate: bool = True,
+    activity: bool = False,
+) -> dict:
+    """Main function to populate the graph straight from the workbooks of an experiment.
+
+    The batches of every chunk are committed before the next chunk is read, so
+    memory stays bounded by the chunk size and the registry of node keys. The
+    activity relations, if requested, are written last, from the histogram of
+    the result values of all chunks, see activity.update_activity_counts.
+    :param graph: Graph connection with a pool of at least `workers` connections
+    :param exp_dir: Directory containing the experiments
+    :param chunk_size: Maximum number of rows per chunk
+    :param workers: Number of concurrent transactions
+    :param batch_size: Maximum number of rows per transaction
+    :param validate: Check the templates first and stop on errors
+    :param activity: Add the activity relations and write the activity summary
+    :return: Number of chunks, rows, nodes and relations written
+    """
+    if validate:
+        check_experiment(exp_dir)
+
+    graph.delete_all()
+    ensure_key_indexes(graph)
+    ensure_range_indexes(graph)
+    ensure_fulltext_indexes(graph)
+
+    pool = WriterPool(graph=graph, workers=workers)
+    registry = NodeRegistry()
+    counts = Counter() if activity else None
+    stats = {
+        "chunks": 0,
+        "invivo_rows": 0,
+        "invitro_rows": 0,
+        "nodes": 0,
+        "relationships": 0,
+    }
+
+    def _count_rows(chunks):
+        for kind, chunk in chunks:
+            stats[f"{kind}_rows"] += len(chunk)
+            yield kind, chunk
+
+    for node_batches, edge_batches in iter_graph_batches(
+        _count_rows(iter_chunks(exp_dir, chunk_size)), registry, batch_size, counts
+    ):
+        pool.write(node_batches, _write_nodes)
+        pool.write(edge_batches, _write_edges)
+        stats["chunks"] += 1
+        stats["nodes"] += sum(len(batch.rows) for batch in node_batches)
+        stats["relationships"] += sum(len(batch.rows) for batch in edge_batches)
+
+    if activity:
+        summary = summarize_activity(get_activity_counts(counts))
+        export_activity_summary(summary, exp_dir)
+        activity_batches = get_activity_batches(summary, registry, batch_size)
+        pool.write(activity_batches, _write_edges)
+        stats["relationships"] += sum(len(batch.rows) for batch in activity_batches)
+
+    invalidate_caches(graph.name)
+    logger.warning(
+        f"Streamed {stats['chunks']} chunks into {stats['nodes']} nodes and "
+        f"{stats['relationships']} relations"
+    )
+    return stats
+
+
+def stream_plan(
+    exp_dir: str, path: str, chunk_size: int = STREAM_CHUNK_SIZE, activity: bool = False
+) -> dict:
+    """Stream the graph of an experiment into a write plan instead of a database.
+
+    Nodes get the content-addressed ids of sharded builds, so the plan can be
+    replayed with write_plan.py.
+    :param exp_dir: Directory containing the experiments
+    :param path: Path of the plan file, gzip compressed if it ends with .gz
+    :param chunk_size: Maximum number of rows per chunk
+    :param activity: Add the activity relations
+    :return: Number of chunks, nodes and relations written
+    """
+    registry = NodeRegistry()
+    counts = Counter() if activity else None
+    stats = {"chunks": 0, "nodes": 0, "relationships": 0}
+
+    def _write_edge_batches(f, batches: List[Batch]) -> None:
+        for batch in batches:
+            for start_key, properties, end_key in batch.rows:
+                record = [
+                    "r",
+                    batch.kind,
+                    node_id(batch.start_label, start_key),
+                    node_id(batch.end_label, end_key),
+                    properties,
+                ]
+                f.write(dump_record(record))
+            stats["relationships"] += len(batch.rows)
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt", encoding="utf-8") as f:
+        for node_batches, edge_batches in iter_graph_batches(
+            iter_chunks(exp_dir, chunk_size), registry, activity_counts=counts
+        ):
+            for batch in node_batches:
+                for properties in batch.rows:
+                    key = properties.get(NODE_KEY_PROPERTIES[batch.kind])
+                    record = ["n", node_id(batch.kind, key), [batch.kind], properties]
+                    f.write(dump_record(record))
+                stats["nodes"] += len(batch.rows)
+
+            _write_edge_batches(f, edge_batches)
+            stats["chunks"] += 1
+
+        if activity:
+            summary = summarize_activity(get_activity_counts(counts))
+            _write_edge_batches(f, get_activity_batches(summary, registry))
+
+    logger.warning(
+        f"Streamed {stats['chunks']} chunks into {stats['nodes']} nodes and "
+        f"{stats['relationships']} relations in {path}"
+    )
+    return stats
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Stream the workbooks of an experiment into a graph in bounded chunks."
+    )
+    parser.add_argument("exp_dir", help="Experiment directory")
+    parser.add_argument("--plan", help="Write a plan file instead of loading a database")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--activity", action="store_true", help="Add the compound activity relations"
+    )
+    parser.add_argument("--uri", default=os.environ.get("NEO4J_URI", DEFAULT_URI))
+    parser.add_argument("--user", default=os.environ.get("NEO4J_USER", DEFAULT_USER))
+    add_password_argument(parser, required=False)
+    parser.add_argument("--database", help="Neo4J database, the default one if omitted")
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.plan is None and args.password is None:
+        parser.error("--password or NEO4J_PASSWORD is required without --plan")
+
+    if args.plan:
+        stats = stream_plan(
+            args.exp_dir, args.plan, chunk_size=args.chunk_size, activity=args.activity
+        )
+    else:
+        graph = Graph(
+            args.uri,
+            auth=(args.user, args.password),
+            name=args.database,
+            max_size=max(args.workers, 1),
+        )
+        stats = stream_graph(
+            graph,
+            args.exp_dir,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            activity=args.activity,
+        )
+
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
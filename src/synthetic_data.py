@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+"""Generator of synthetic lab data templates for load testing."""
+
+import argparse
+import logging
+import os
+import random
+from datetime import date, timedelta
+from typing import Dict, List
+
+import pandas as pd
+from openpyxl import Workbook
+
+from constants import MAPPING_DIR
+
+logger = logging.getLogger("__name__")
+
+ANIMALS_PER_GROUP = 5
+
+STUDY_COLS = [
+    "STUDYID", "STUDY_TYPE", "EXPID", "SITE", "PROJECT_LICENCE_NUMBER",
+    "STUDY_START_DATE", "STUDY_PROTOCOL_NAME", "PROVENANCE", "SPECIES_NAME",
+    "ANIMAL_STRAIN", "ANIMAL_SEX", "ANIMAL_AGE_RANGE", "ANIMAL_BODYWEIGHT_MEAN",
+    "ANIMAL_BODYWEIGHT_RANGE", "ANIMAL_VENDOR", "HOUSING_CAGE_NO_ANIMALS",
+    "HOUSING_CAGE_SIZE", "HOUSING_FOOD", "HOUSING_FOOD_RESTRICTED",
+    "HOUSING_FOOD_SUPPLEMENT", "HOUSING_LIGHT_DARK_CYCLE",
+]
+
+TREATMENT_COLS = [
+    "GROUP_DESCRIPTION", "ANIMAL", "ANIMAL_ID", "PRETREATMENT_CPD_ID",
+    "PRETREATMENT_BATCH_ID", "PRETREATMENT_DOSING_INFO", "PRETREATMENT_DOSE",
+    "PRETREATMENT_ROUTE_OF_ADMINSTRATION", "BACTERIAL_STRAIN_NAME",
+    "BACTERIAL_STRAIN_DOSE", "INFECTION_ROUTE", "CPD_ID", "BATCH_ID", "EXT_CPD_ID",
+    "EXT_BATCH_ID", "DOSING_INFO", "FREQUENCY", "DOSE", "TDD",
+    "ROUTE_OF_ADMINISTRATION", "COMMENT",
+]
+
+ACTIVITY_COLS = ["GROUP_DESCRIPTION", "ACTIVITY", "PLANNED_RELATIVE_TIMEPOINT", "COMMENTS"]
+
+INVIVO_RESULT_COLS = [
+    "STUDYID", "EXPID", "SITE", "PROVENANCE", "BACTERIAL_STRAIN_NAME", "CPD_ID",
+    "BATCH_ID", "TDD", "GROUP_DESCRIPTION", "ANIMAL", "ANIMAL_ID",
+    "EXPERIMENT_TYPE", "BIOMATERIAL", "EXPERIMENT_DATE", "PROTOCOL_NAME",
+    "PLANNED_RELATIVE_TIMEPOINT", "RELATIVE_TIMEPOINT", "RESULT_TYPE",
+    "STATISTICAL_METHOD", "RESULT_OPERATOR", "RESULT_VALUE", "RESULT_UNIT",
+    "#NA (not applicable)", "CONTROL_GROUP", "RESULT_STATUS", "COMMENTS",
+]
+
+INVITRO_COLS = [
+    "STUDYID", "EXPID", "CPD_ID", "BATCH_ID", "EXT_CPD_ID", "EXT_BATCH_ID", "SITE",
+    "PROVENANCE", "EXPERIMENT_DATE", "BIOMATERIAL", "SPECIES_NAME",
+    "BACTERIAL_STRAIN_NAME", "BACTERIAL_STRAIN_SITE_REF", "EXPERIMENT_TYPE",
+    "PROTOCOL_NAME", "No of replicates", "RESULT_TYPE", "STATISTICAL_METHOD",
+    "RESULT_OPERATOR", "RESULT_VALUE", "RESULT_UNIT", "StdDev", "MEDIUM",
+    "CONTROL_GROUP", "RESULT_STATUS", "COMMENTS",
+]
+
+# Free text vocabulary of the templates, which has no mapping file
+SITES = ["EMC", "NBT", "UPPS", "BRC", "LMU"]
+RESULT_TYPES = ["MIC", "dCFU", "CFU", "FoR", "IC50", "Cmax", "AUC"]
+RESULT_OPERATORS = ["=", "=", "=", "<", ">", "<=", ">="]
+RESULT_STATUSES = ["V (valid)", "V (valid)", "V (valid)", "NV (non valid)"]
+CONTROL_GROUPS = ["InfectionControl", "GrowthControl", "plates without compound"]
+ANIMAL_STRAINS = ["CD-1 Crl:CD1(ICR)", "BALB/c", "C57BL/6"]
+
+# Mapping files and the template column whose vocabulary they hold
+VOCABULARY_FILES = {
+    "BIOMATERIAL": "biomaterials.tsv",
+    "BACTERIAL_STRAIN_NAME": "bacterial_strain.tsv",
+    "EXPERIMENT_TYPE": "experimental_type.tsv",
+    "MEDIUM": "medium.tsv",
+    "RESULT_UNIT": "result_unit.tsv",
+    "ROUTE_OF_ADMINISTRATION": "roa.tsv",
+    "ANIMAL_SEX": "sex.tsv",
+    "SPECIES_NAME": "species.tsv",
+    "STATISTICAL_METHOD": "statistical_method.tsv",
+    "STUDY_TYPE": "study_type.tsv",
+}
+
+
+def get_vocabulary() -> Dict[str, List[str]]:
+    """Method to get the terms of the mapping files per template column.
+
+    Only the terms with an ontology mapping are kept, like in the harmonization,
+    so that the generated data has no unmapped values.
+    """
+    vocabulary = {}
+
+    for column, file_name in VOCABULARY_FILES.items():
+        tmp_df = pd.read_csv(f"{MAPPING_DIR}/{file_name}", sep="\t", dtype=str)
+        tmp_df = tmp_df.dropna(subset=["Curie"])
+        terms = tmp_df[tmp_df.columns[0]].dropna().str.strip()
+        vocabulary[column] = sorted(set(terms[terms != ""]))
+
+    return vocabulary
+
+
+def _write_sheet(wb: Workbook, title: str, columns: List[str], rows, offset: int = 5):
+    """Stream a template sheet: description rows, the variable row and the data.
+    :param wb: Write-only workbook
+    :param title: Sheet name
+    :param columns: Variable names of the sheet
+    :param rows: Iterable of data rows
+    :param offset: Number of description rows above the variable row
+    """
+    ws = wb.create_sheet(title)
+
+    description = [
+        ["Category"],
+        ["Label", *[column.replace("_", " ").capitalize() for column in columns]],
+        ["Comments/Description"],
+        ["Format", *["VARCHAR"] * len(columns)],
+        ["Required (R) or \nOptional (O)", *["R"] * len(columns)],
+    ]
+    for row in [[None, "To be completed by the Data Producer"]] * (offset - 5):
+        ws.append(row)
+    for row in description:
+        ws.append(row)
+
+    ws.append(["Variable", *columns])
+
+    for row in rows:
+        ws.append([None, *row])
+
+
+class TemplateGenerator:
+    """Seeded generator of in-vivo and in-vitro lab data templates."""
+
+    def __init__(
+        self,
+        compounds: int = 100,
+        strains: int = 20,
+        seed: int = 0,
+    ):
+        self.rng = random.Random(seed)
+        self.vocabulary = get_vocabulary()
+
+        self.compounds = [
+            (f"CPD_{idx:05d}", f"BATCH_ID_{idx:05d}") for idx in range(1, compounds + 1)
+        ]
+
+        known_strains = self.vocabulary["BACTERIAL_STRAIN_NAME"]
+        self.strains = self.rng.sample(known_strains, min(strains, len(known_strains)))
+        self.strains += [f"SYNTH {idx:05d}" for idx in range(strains - len(self.strains))]
+
+    def _choice(self, column: str) -> str:
+        return self.rng.choice(self.vocabulary[column])
+
+    def _date(self) -> str:
+        day = date(2019, 1, 1) + timedelta(days=self.rng.randrange(5 * 365))
+        return day.isoformat()
+
+    def _result(self) -> list:
+        value = round(self.rng.lognormvariate(0, 2), 6)
+        return [
+            self.rng.choice(RESULT_TYPES),
+            self._choice("STATISTICAL_METHOD"),
+            self.rng.choice(RESULT_OPERATORS),
+            value,
+            self._choice("RESULT_UNIT"),
+        ]
+
+    def write_invivo(
+        self,
+        path: str,
+        study: int,
+        animals: int = 50,
+        rows: int = 1000,
+        result_sheets: int = 3,
+    ) -> None:
+        """Method to write an in-vivo workbook of one study.
+        :param path: Path of the workbook
+        :param study: Number of the study, used in its identifiers
+        :param animals: Number of animals of the study
+        :param rows: Number of rows per result sheet
+        :param result_sheets: Number of ExperimentResults sheets
+        """
+        wb = Workbook(write_only=True)
+        rng = self.rng
+
+        study_id = f"SYNTH_STUDY_{study:05d}"
+        exp_id = f"ELN-SYNTH-{study:05d}"
+        site = rng.choice(SITES)
+        provenance = f"{site}@synthetic.org"
+        strain = rng.choice(self.strains)
+        start_date = self._date()
+
+        study_row = [
+            study_id, self._choice("STUDY_TYPE"), exp_id, site, f"LIC-{study:05d}",
+            start_date, f"protocol_{study:05d}.pdf", provenance,
+            self._choice("SPECIES_NAME"), rng.choice(ANIMAL_STRAINS),
+            self._choice("ANIMAL_SEX"), "7-8", round(rng.uniform(18, 30), 1),
+            "18-30", "Synthetic vendor", ANIMALS_PER_GROUP, None, "ad libitum",
+            None, None, "12-12",
+        ]
+
+        treatments = []
+        for idx in range(1, animals + 1):
+            group = (idx - 1) // ANIMALS_PER_GROUP + 1
+            # Animal numbers are unique across studies, as they are the key of their nodes
+            animal = (study - 1) * animals + idx
+            cpd_id, batch_id = self.compounds[(study + group) % len(self.compounds)]
+            dose = 2 ** (group % 6)
+            treatments.append(
+                [
+                    f"Group-{group:03d}", animal, f"{study:05d}-{idx:05d}",
+                    None, None, None, None, None, strain, 3000000, "i.n.", cpd_id,
+                    batch_id, None, None, "single dose", 6, dose, dose,
+                    self._choice("ROUTE_OF_ADMINISTRATION"), None,
+                ]
+            )
+
+        wb.create_sheet("Info").append(["Information", "Version", "Changes"])
+        _write_sheet(wb, "StudyDetails", STUDY_COLS, [study_row])
+        _write_sheet(wb, "Treatment", TREATMENT_COLS, treatments, offset=6)
+        groups = sorted({treatment[0] for treatment in treatments})
+        _write_sheet(
+            wb, "Activities", ACTIVITY_COLS, [[g, "Sampling", 6, None] for g in groups]
+        )
+
+        for sheet in range(1, result_sheets + 1):
+            experiment_type = self._choice("EXPERIMENT_TYPE")
+            biomaterial = self._choice("BIOMATERIAL")
+
+            def result_rows():
+                for idx in range(rows):
+                    treatment = treatments[idx % len(treatments)]
+                    timepoint = 6 * (idx // len(treatments) + 1)
+                    yield [
+                        study_id, exp_id, site, provenance, strain, treatment[11],
+                        treatment[12], treatment[18], treatment[0], treatment[1],
+                        treatment[2], experiment_type, biomaterial, start_date,
+                        f"protocol_{study:05d}.pdf", timepoint, timepoint,
+                        *self._result(), None, rng.choice(CONTROL_GROUPS),
+                        rng.choice(RESULT_STATUSES), None,
+                    ]
+
+            _write_sheet(
+                wb, f"ExperimentResults_{sheet:02d}", INVIVO_RESULT_COLS, result_rows()
+            )
+
+        wb.save(path)
+
+    def write_invitro(self, path: str, study: int, rows: int = 1000) -> None:
+        """Method to write an in-vitro workbook of one study.
+        :param path: Path of the workbook
+        :param study: Number of the study, used in its identifiers
+        :param rows: Number of result rows
+        """
+        wb = Workbook(write_only=True)
+        rng = self.rng
+
+        study_id = f"SYNTH_INVITRO_{study:05d}"
+        site = rng.choice(SITES)
+        experiment_type = self._choice("EXPERIMENT_TYPE")
+
+        def rows_iter():
+            for idx in range(rows):
+                cpd_id, batch_id = self.compounds[idx % len(self.compounds)]
+                strain = self.strains[(idx // len(self.compounds)) % len(self.strains)]
+                yield [
+                    study_id, f"ELN-SYNTH-{study:05d}-{idx // 1000:03d}", cpd_id,
+                    batch_id, None, None, site, f"{site}@synthetic.org", self._date(),
+                    "Bacteria", "#NA (not applicable)", strain, None, experiment_type,
+                    f"{experiment_type}_protocol.pdf", 3, *self._result(), None,
+                    self._choice("MEDIUM"), rng.choice(CONTROL_GROUPS),
+                    rng.choice(RESULT_STATUSES), None,
+                ]
+
+        _write_sheet(wb, f"EXP{study:05d}_Data", INVITRO_COLS, rows_iter())
+        wb.save(path)
+
+
+def generate_experiment(
+    exp_dir: str,
+    invivo_workbooks: int = 1,
+    invitro_workbooks: int = 1,
+    rows: int = 1000,
+    animals: int = 50,
+    compounds: int = 100,
+    strains: int = 20,
+    result_sheets: int = 3,
+    seed: int = 0,
+) -> List[str]:
+    """Main function to write a synthetic experiment directory.
+    :param exp_dir: Experiment directory to write the workbooks to
+    :param invivo_workbooks: Number of in-vivo workbooks, one study each
+    :param invitro_workbooks: Number of in-vitro workbooks
+    :param rows: Rows per in-vivo result sheet and per in-vitro workbook
+    :param animals: Animals per in-vivo study
+    :param compounds: Number of distinct compounds
+    :param strains: Number of distinct bacterial strains
+    :param result_sheets: ExperimentResults sheets per in-vivo workbook
+    :param seed: Seed of the random generator, the same seed gives the same data
+    :return: Paths of the written workbooks
+    """
+    os.makedirs(exp_dir, exist_ok=True)
+    generator = TemplateGenerator(compounds=compounds, strains=strains, seed=seed)
+    paths = []
+
+    for study in range(1, invivo_workbooks + 1):
+        path = f"{exp_dir}/invivo_synthetic_{study:05d}.xlsx"
+        generator.write_invivo(
+            path, study, animals=animals, rows=rows, result_sheets=result_sheets
+        )
+        paths.append(path)
+
+    for study in range(1, invitro_workbooks + 1):
+        path = f"{exp_dir}/invitro_synthetic_{study:05d}.xlsx"
+        generator.write_invitro(path, study, rows=rows)
+        paths.append(path)
+
+    logger.warning(f"Wrote {len(paths)} synthetic workbooks to {exp_dir}")
+
+    return paths
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Write synthetic lab data templates for load testing."
+    )
+    parser.add_argument("exp_dir", help="Experiment directory to write to")
+    parser.add_argument("--invivo-workbooks", type=int, default=1)
+    parser.add_argument("--invitro-workbooks", type=int, default=1)
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=1000,
+        help="Rows per in-vivo result sheet and per in-vitro workbook",
+    )
+    parser.add_argument("--animals", type=int, default=50, help="Animals per study")
+    parser.add_argument("--compounds", type=int, default=100)
+    parser.add_argument("--strains", type=int, default=20)
+    parser.add_argument("--result-sheets", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+    generate_experiment(
+        exp_dir=args.exp_dir,
+        invivo_workbooks=args.invivo_workbooks,
+        invitro_workbooks=args.invitro_workbooks,
+        rows=args.rows,
+        animals=args.animals,
+        compounds=args.compounds,
+        strains=args.strains,
+        result_sheets=args.result_sheets,
+        seed=args.seed,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
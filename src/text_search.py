@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""Keyword search over the free-text properties of the graph with a local inverted index."""
+
+import argparse
+import bisect
+import json
+import logging
+import re
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+import pandas as pd
+
+from collector import build_graph, get_node_keys
+from nodes import _format_text
+from constants import TEXT_INDEX_FILE, TEXT_SEARCH_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+TOKEN_PATTERN = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text) -> List[str]:
+    """Method to split a text into normalized terms.
+
+    Texts are folded like the node properties, e.g. "μg" becomes "ug", then
+    lower cased and stripped of the remaining accents.
+    :param text: Property value or query
+    :return: Terms in their order of appearance
+    """
+    # _format_text drops line breaks and wide spaces, which would join words
+    text = _format_text(re.sub(r"\s+", " ", str(text))).lower()
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return TOKEN_PATTERN.findall(text)
+
+
+class TextIndex:
+    """Inverted index from the terms of the free-text properties to nodes and relations.
+
+    Every indexed property value is a document, identified by its position in
+    ``documents``. Node documents hold the label and natural key of their node,
+    relation documents the type and the endpoints of their relation.
+    """
+
+    def __init__(self, documents: List[dict], terms: Dict[str, List[int]]):
+        self.documents = documents
+        self.terms = terms
+        self._sorted_terms = sorted(terms)
+
+    @classmethod
+    def from_graph(cls, node_dict: dict, relationships: list) -> "TextIndex":
+        """Build the index from the output of add_nodes and add_relations.
+        :param node_dict: Node dictionary produced by add_nodes
+        :param relationships: Relations produced by add_relations
+        """
+        documents = []
+        terms: Dict[str, Set[int]] = {}
+
+        def _add(document: dict) -> None:
+            for term in set(tokenize(document["text"])):
+                terms.setdefault(term, set()).add(len(documents))
+            documents.append(document)
+
+        for label, key, is_relation in TEXT_SEARCH_PROPERTIES:
+            if is_relation:
+                continue
+            for node_key, node in node_dict.get(label, {}).items():
+                if node.get(key):
+                    _add({"node": [label, node_key], "property": key, "text": node[key]})
+
+        relation_fields = {}
+        for rel_type, key, is_relation in TEXT_SEARCH_PROPERTIES:
+            if is_relation:
+                relation_fields.setdefault(rel_type, []).append(key)
+
+        node_keys = get_node_keys(node_dict)
+        for rel in relationships:
+            rel_type = type(rel).__name__
+            for key in relation_fields.get(rel_type, []):
+                if rel.get(key):
+                    _add(
+                        {
+                            "relation": rel_type,
+                            "start": list(node_keys[id(rel.start_node)]),
+                            "end": list(node_keys[id(rel.end_node)]),
+                            "property": key,
+                            "text": rel[key],
+                        }
+                    )
+
+        return cls(documents, {term: sorted(ids) for term, ids in terms.items()})
+
+    @classmethod
+    def load(cls, path: str) -> "TextIndex":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["documents"], data["terms"])
+
+    def save(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"documents": self.documents, "terms": self.terms},
+                f,
+                ensure_ascii=False,
+                default=str,
+            )
+
+    def _postings(self, term: str, prefix: bool = False) -> Set[int]:
+        if not prefix:
+            return set(self.terms.get(term, ()))
+
+        postings = set()
+        start = bisect.bisect_left(self._sorted_terms, term)
+        for candidate in self._sorted_terms[start:]:
+            if not candidate.startswith(term):
+                break
+            postings.update(self.terms[candidate])
+        return postings
+
+    def search(
+        self, query: str, label: Optional[str] = None, limit: Optional[int] = 100
+    ) -> List[dict]:
+        """Method to find the documents containing all terms of a query.
+
+        A term ending with "*" matches every term starting with it, e.g. "pharmaco*".
+        :param query: Keywords
+        :param label: Only return documents of nodes with this label or relations of this type
+        :param limit: Maximum number of documents, all if None
+        :return: Matching documents with their id, in index order
+        """
+        matches = None
+        for word in query.split():
+            terms = tokenize(word)
+            for position, term in enumerate(terms):
+                prefix = word.endswith("*") and position == len(terms) - 1
+                postings = self._postings(term, prefix=prefix)
+                matches = postings if matches is None else matches & postings
+                if not matches:
+                    return []
+
+        if matches is None:
+            return []
+
+        results = []
+        for doc_id in sorted(matches):
+            document = self.documents[doc_id]
+            if label is not None and label not in (
+                document.get("relation"),
+                document.get("node", [None])[0],
+            ):
+                continue
+
+            results.append({"id": doc_id, **document})
+            if limit is not None and len(results) >= limit:
+                break
+
+        return results
+
+
+def write_text_index(
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    exp_dir: str,
+    measurements: bool = False,
+) -> TextIndex:
+    """Main function to build the text index of the graph of the processed data.
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param exp_dir: Experiment directory the index is written to
+    :param measurements: Model every result row as a measurement node, like the loaded graph
+    :return: Text index
+    """
+    node_dict, collector = build_graph(
+        invivo_df=invivo_df, invitro_df=invitro_df, measurements=measurements
+    )
+    index = TextIndex.from_graph(node_dict, collector.relationships)
+    index.save(f"{exp_dir}/{TEXT_INDEX_FILE}")
+
+    logger.warning(
+        f"Indexed {len(index.terms)} terms of {len(index.documents)} texts in "
+        f"{exp_dir}/{TEXT_INDEX_FILE}"
+    )
+    return index
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Build or search the text index of the comments, protocols and provenance."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build the text index of an experiment")
+    build.add_argument("exp_dir", help="Experiment directory with processed data")
+    build.add_argument(
+        "--measurements", action="store_true", help="Model results as measurement nodes"
+    )
+
+    search = subparsers.add_parser("search", help="Search the text index of an experiment")
+    search.add_argument("exp_dir", help="Experiment directory with a text index")
+    search.add_argument("query", nargs="+", help="Keywords, a trailing * matches prefixes")
+    search.add_argument("--label", help="Only return this node label or relation type")
+    search.add_argument("--limit", type=int, default=20)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    if args.command == "build":
+        from main import read_processed_data
+
+        invivo_df, invitro_df = read_processed_data(exp_dir=args.exp_dir)
+        write_text_index(invivo_df, invitro_df, args.exp_dir, measurements=args.measurements)
+        return 0
+
+    index = TextIndex.load(f"{args.exp_dir}/{TEXT_INDEX_FILE}")
+    results = index.search(" ".join(args.query), label=args.label, limit=args.limit)
+    print(json.dumps(results, indent=2, ensure_ascii=False, default=str))
+    return int(not results)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
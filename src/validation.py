@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+
+"""Pre-flight validation of the lab data templates of an experiment before ingest."""
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from data_preprocessing import get_ontology_mapper
+from constants import ANNOTATION_COLS, INVITRO_REQUIRED_COLS, INVIVO_REQUIRED_COLS
+
+logger = logging.getLogger("__name__")
+
+NOT_APPLICABLE = "#NA (not applicable)"
+MAX_SAMPLES = 5
+
+# Row of the column names in each sheet, as parsed by get_invivo_data and get_invitro_data
+HEADER_ROWS = {"StudyDetails": 6, "Treatment": 7, "ExperimentResults": 6}
+INVITRO_HEADER_ROW = 6
+
+# Keys joining the result sheets to the sheets they are merged with
+STUDY_KEYS = ["STUDYID", "EXPID"]
+GROUP_KEYS = ["GROUP_DESCRIPTION", "ANIMAL"]
+
+
+class Issue(NamedTuple):
+    """Problem found in a template."""
+
+    severity: str  # "error" stops the ingest, "warning" only does in strict mode
+    file: str
+    sheet: str
+    column: str
+    message: str
+    count: int = 0  # number of rows or values concerned
+    samples: tuple = ()  # some of the offending values
+
+
+class TemplateValidationError(ValueError):
+    """Raised before any parsing or graph write when the templates have errors."""
+
+    def __init__(self, issues: List[Issue]):
+        self.issues = issues
+        super().__init__(f"{len(issues)} template issues\n{format_issues(issues)}")
+
+
+def format_issues(issues: Iterable[Issue]) -> str:
+    """Method to render issues as one line each."""
+    lines = []
+
+    for issue in issues:
+        location = ":".join(part for part in (issue.file, issue.sheet) if part)
+        parts = (f"{issue.severity:<8}", location, issue.column, issue.message)
+        line = " ".join(part for part in parts if part)
+        if issue.count:
+            line += f" ({issue.count})"
+        if issue.samples:
+            line += f": {', '.join(map(str, issue.samples))}"
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def read_columns(ws, header_row: int, columns: Iterable[str]) -> Tuple[List[str], pd.DataFrame]:
+    """Read the header of a sheet and the values of some of its columns only.
+
+    Values are compared as stripped strings and empty rows are dropped, like
+    the rows dropped when parsing the sheet.
+    :param ws: Worksheet opened in read-only mode
+    :param header_row: Row number of the column names
+    :param columns: Columns to read, missing ones are ignored
+    :return: All column names of the sheet and the values of the requested columns
+    """
+    rows = ws.iter_rows(min_row=header_row, values_only=True)
+    header = [
+        str(name).strip() if name is not None else "" for name in next(rows, ())
+    ]
+
+    positions = {}
+    for position, name in enumerate(header):
+        if name in columns and name not in positions:
+            positions[name] = position
+
+    values = {name: [] for name in positions}
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        for name, position in positions.items():
+            values[name].append(row[position] if position < len(row) else None)
+
+    df = pd.DataFrame(
+        {
+            name: pd.Series(column, dtype=object).astype("string").str.strip()
+            for name, column in values.items()
+        }
+    )
+    return header, df.replace("", pd.NA)
+
+
+def _samples(values) -> tuple:
+    return tuple(sorted(map(str, values))[:MAX_SAMPLES])
+
+
+def check_required_columns(
+    columns: Iterable[str], required: List[str], file: str, sheet: str = ""
+) -> List[Issue]:
+    """Method to report the required columns missing from a template."""
+    missing = pd.Index(required).difference(pd.Index(list(columns)), sort=False)
+    return [
+        Issue("error", file, sheet, column, "required column is missing")
+        for column in missing
+    ]
+
+
+def check_references(
+    df: pd.DataFrame,
+    reference: pd.DataFrame,
+    keys: List[str],
+    file: str,
+    sheet: str,
+    reference_sheet: str,
+) -> List[Issue]:
+    """Method to report the key values of a sheet that are not in the sheet it is merged with.
+    :param df: Key columns of the sheet
+    :param reference: Key columns of the referenced sheet
+    :param keys: Key columns, only the ones present in both sheets are compared
+    """
+    keys = [key for key in keys if key in df.columns and key in reference.columns]
+    if not keys:
+        return []
+
+    values = pd.MultiIndex.from_frame(df[keys].dropna(how="any"))
+    known = pd.MultiIndex.from_frame(reference[keys].dropna(how="any"))
+    unknown = values.unique().difference(known)
+
+    if unknown.empty:
+        return []
+
+    rows = int(values.isin(unknown).sum())
+    return [
+        Issue(
+            "warning",
+            file,
+            sheet,
+            "/".join(keys),
+            f"values not found in {reference_sheet}, {rows} rows would not be merged",
+            count=len(unknown),
+            samples=_samples("/".join(value) for value in unknown),
+        )
+    ]
+
+
+def check_vocabulary(
+    df: pd.DataFrame, vocabulary: Dict[str, pd.Index], file: str, sheet: str
+) -> List[Issue]:
+    """Method to report the controlled-vocabulary values without an ontology mapping."""
+    issues = []
+
+    for column in df.columns.intersection(list(vocabulary)):
+        values = pd.Index(df[column].dropna().unique())
+        unmapped = values.difference(vocabulary[column]).drop(
+            NOT_APPLICABLE, errors="ignore"
+        )
+        if unmapped.empty:
+            continue
+
+        issues.append(
+            Issue(
+                "warning",
+                file,
+                sheet,
+                column,
+                "values without ontology mapping",
+                count=len(unmapped),
+                samples=_samples(unmapped),
+            )
+        )
+
+    return issues
+
+
+def get_vocabulary() -> Dict[str, pd.Index]:
+    """Method to get the known template terms of every controlled-vocabulary column."""
+    return {
+        column: pd.Index([str(term).strip() for term in terms])
+        for column, terms in get_ontology_mapper().items()
+    }
+
+
+def validate_invivo(wb, file: str, vocabulary: Dict[str, pd.Index]) -> List[Issue]:
+    """Method to validate the sheets of an in-vivo workbook.
+    :param wb: Workbook opened in read-only mode
+    :param file: Name of the workbook in the report
+    :param vocabulary: Known terms per controlled-vocabulary column
+    """
+    issues = []
+    key_columns = set(STUDY_KEYS + GROUP_KEYS + ANNOTATION_COLS)
+    sheets = {}
+
+    for sheet in wb.sheetnames:
+        prefix = next((prefix for prefix in HEADER_ROWS if sheet.startswith(prefix)), None)
+        if prefix is not None:
+            sheets[sheet] = read_columns(wb[sheet], HEADER_ROWS[prefix], key_columns)
+
+    for sheet in ("StudyDetails", "Treatment"):
+        if sheet not in sheets:
+            issues.append(Issue("error", file, sheet, "", "required sheet is missing"))
+
+    results = {}
+    for sheet, (header, df) in sheets.items():
+        if not sheet.startswith("ExperimentResults"):
+            continue
+
+        if df.empty:
+            continue
+
+        # Sheets with missing groups are skipped when parsing
+        if "GROUP_DESCRIPTION" in df.columns:
+            missing = int(df["GROUP_DESCRIPTION"].isna().sum())
+            if missing:
+                issues.append(
+                    Issue(
+                        "warning",
+                        file,
+                        sheet,
+                        "GROUP_DESCRIPTION",
+                        "rows without group, the sheet will be skipped",
+                        count=missing,
+                    )
+                )
+                continue
+
+        results[sheet] = (header, df)
+
+    if not results:
+        issues.append(
+            Issue("error", file, "ExperimentResults", "", "no experiment results to load")
+        )
+
+    columns = set()
+    for header, _ in sheets.values():
+        columns.update(header)
+    issues.extend(check_required_columns(columns, INVIVO_REQUIRED_COLS, file))
+
+    # The merges below need both sheets
+    if "StudyDetails" not in sheets or "Treatment" not in sheets:
+        return issues
+
+    _, study_df = sheets["StudyDetails"]
+    _, treatment_df = sheets["Treatment"]
+
+    for key in STUDY_KEYS:
+        if key in study_df.columns and study_df[key].isna().any():
+            issues.append(
+                Issue(
+                    "warning",
+                    file,
+                    "StudyDetails",
+                    key,
+                    "rows without value",
+                    count=int(study_df[key].isna().sum()),
+                )
+            )
+
+    keys = [key for key in GROUP_KEYS if key in treatment_df.columns]
+    duplicates = (
+        int(treatment_df.dropna(subset=keys).duplicated(subset=keys).sum()) if keys else 0
+    )
+    if duplicates:
+        issues.append(
+            Issue(
+                "warning",
+                file,
+                "Treatment",
+                "/".join(keys),
+                "duplicated rows, the results matching them will be repeated",
+                count=duplicates,
+            )
+        )
+
+    for sheet, (_, df) in results.items():
+        issues.extend(
+            check_references(df, study_df, STUDY_KEYS, file, sheet, "StudyDetails")
+        )
+        issues.extend(
+            check_references(df, treatment_df, GROUP_KEYS, file, sheet, "Treatment")
+        )
+
+    for sheet, (_, df) in sheets.items():
+        issues.extend(check_vocabulary(df, vocabulary, file, sheet))
+
+    return issues
+
+
+def validate_invitro(wb, file: str, vocabulary: Dict[str, pd.Index]) -> List[Issue]:
+    """Method to validate the first sheet of an in-vitro workbook.
+    :param wb: Workbook opened in read-only mode
+    :param file: Name of the workbook in the report
+    :param vocabulary: Known terms per controlled-vocabulary column
+    """
+    ws = wb.worksheets[0]
+    header, df = read_columns(ws, INVITRO_HEADER_ROW, STUDY_KEYS + ANNOTATION_COLS)
+
+    issues = check_required_columns(header, INVITRO_REQUIRED_COLS, file, ws.title)
+
+    if "EXPID" in df.columns and df["EXPID"].isna().any():
+        issues.append(
+            Issue(
+                "warning",
+                file,
+                ws.title,
+                "EXPID",
+                "rows without experiment",
+                count=int(df["EXPID"].isna().sum()),
+            )
+        )
+
+    issues.extend(check_vocabulary(df, vocabulary, file, ws.title))
+    return issues
+
+
+def validate_experiment(exp_dir: str) -> List[Issue]:
+    """Main function to validate all templates of an experiment directory.
+
+    Only the column names and the key and controlled-vocabulary columns are
+    read, so that the full report is available before any parsing.
+    :param exp_dir: Directory containing the experiments
+    :return: Errors and warnings of all workbooks
+    """
+    issues = []
+    vocabulary = get_vocabulary()
+
+    for path, dirs, files in os.walk(exp_dir, topdown=True):
+        for name in sorted(files):
+            if not name.endswith(".xlsx"):
+                continue
+
+            file = os.path.relpath(os.path.join(path, name), exp_dir)
+            wb = load_workbook(os.path.join(path, name), read_only=True, data_only=True)
+            try:
+                if len(wb.sheetnames) > 3:
+                    issues.extend(validate_invivo(wb, file, vocabulary))
+                else:
+                    issues.extend(validate_invitro(wb, file, vocabulary))
+            finally:
+                wb.close()
+
+    return issues
+
+
+def check_experiment(exp_dir: str, strict: bool = False) -> List[Issue]:
+    """Validate the templates of an experiment and stop on errors.
+    :param exp_dir: Directory containing the experiments
+    :param strict: Also stop on warnings, e.g. result rows not matching their study
+    :return: Warnings of the templates
+    :raises TemplateValidationError: If any template has errors
+    """
+    issues = validate_experiment(exp_dir)
+
+    if strict or any(issue.severity == "error" for issue in issues):
+        if issues:
+            raise TemplateValidationError(issues)
+
+    for issue in issues:
+        logger.warning(format_issues([issue]))
+
+    return issues
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Check the lab data templates of experiments before building graphs."
+    )
+    parser.add_argument("experiments", nargs="+", help="Experiment directories")
+    parser.add_argument("--json", action="store_true", help="Print the issues as JSON")
+    parser.add_argument(
+        "--strict", action="store_true", help="Also fail on warnings"
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    issues = {exp_dir: validate_experiment(exp_dir) for exp_dir in args.experiments}
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    exp_dir: [issue._asdict() for issue in exp_issues]
+                    for exp_dir, exp_issues in issues.items()
+                },
+                indent=2,
+            )
+        )
+    else:
+        for exp_dir, exp_issues in issues.items():
+            print(f"{exp_dir}: {len(exp_issues)} issues")
+            if exp_issues:
+                print(format_issues(exp_issues))
+
+    return int(
+        any(
+            args.strict or issue.severity == "error"
+            for exp_issues in issues.values()
+            for issue in exp_issues
+        )
+    )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
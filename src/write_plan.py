@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+"""Recording of the graph writes into a write plan, and replay of a plan on a server."""
+
+import argparse
+import gzip
+import json
+import logging
+import os
+import time
+from collections import Counter
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from py2neo import Graph, Node, Relationship
+
+from cli import DEFAULT_URI, DEFAULT_USER, add_password_argument
+from collector import get_node_dict
+from incremental import ensure_fulltext_indexes, ensure_key_indexes, ensure_range_indexes
+from main import read_processed_data
+from nodes import add_nodes
+from queries import invalidate_caches
+from relations import add_relations
+from writer_pool import (
+    BATCH_SIZE,
+    WriterPool,
+    split_edge_rows,
+    split_node_rows,
+    _write_edges,
+    _write_nodes,
+)
+from constants import NODE_KEY_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+
+def _encode_value(value):
+    """Encode the values JSON has no type for, tagging dates to keep their type."""
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+
+def _decode_value(obj: dict):
+    """Decode the tagged values written by _encode_value."""
+    if len(obj) == 1:
+        if "$date" in obj:
+            return date.fromisoformat(obj["$date"])
+        if "$datetime" in obj:
+            return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def dump_record(record: list) -> str:
+    """Method to serialize a plan record as a line of a plan file, see read_plan."""
+    return json.dumps(record, ensure_ascii=False, default=_encode_value) + "\n"
+
+
+class RecordingTransaction:
+    """Stand-in for a py2neo transaction that records every write into a plan.
+
+    Each node and relationship is appended to the plan as soon as it is created,
+    either into a JSON lines file (gzip compressed if the path ends with .gz) or
+    into memory when no path is given. Nodes get consecutive integer ids that
+    the relationship records refer to, unless a `node_key` function gives them
+    another id, e.g. a hash of their content.
+    """
+
+    def __init__(self, path: Optional[str] = None, node_key: Optional[Callable] = None):
+        self.path = path
+        self.node_key = node_key
+        self.records: List[list] = []
+        self.node_counts = Counter()
+        self.relationship_counts = Counter()
+        self._node_ids: Dict[int, int] = {}
+        self._nodes: List[Node] = []  # keeps the recorded nodes and their ids alive
+        self._file = None
+
+        if path is not None:
+            opener = gzip.open if path.endswith(".gz") else open
+            self._file = opener(path, "wt", encoding="utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _append(self, record: list) -> None:
+        if self._file is None:
+            self.records.append(record)
+        else:
+            self._file.write(dump_record(record))
+
+    def _node_id(self, node: Node) -> int:
+        """Id of a node in the plan, recording the node first if it is new."""
+        node_id = self._node_ids.get(id(node))
+        if node_id is not None:
+            return node_id
+
+        node_id = len(self._nodes) if self.node_key is None else self.node_key(node)
+        self._node_ids[id(node)] = node_id
+        self._nodes.append(node)
+
+        labels = sorted(node.labels)
+        self.node_counts.update(labels)
+        self._append(["n", node_id, labels, dict(node)])
+
+        return node_id
+
+    def create(self, subgraph):
+        """Record a node or relationship instead of sending it to the server.
+        :param subgraph: Node or relationship created by the pipeline
+        """
+        if isinstance(subgraph, Relationship):
+            start = self._node_id(subgraph.start_node)
+            end = self._node_id(subgraph.end_node)
+            rel_type = type(subgraph).__name__
+            self.relationship_counts[rel_type] += 1
+            self._append(["r", rel_type, start, end, dict(subgraph)])
+        else:
+            self._node_id(subgraph)
+
+    def summary(self) -> dict:
+        """Method to get the number of recorded nodes per label and relations per type."""
+        return {
+            "nodes": len(self._nodes),
+            "relationships": sum(self.relationship_counts.values()),
+            "labels": dict(self.node_counts),
+            "types": dict(self.relationship_counts),
+        }
+
+    def close(self) -> None:
+        """Flush the plan file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_plan(path: str) -> Iterator[list]:
+    """Method to stream the records of a plan file.
+    :param path: Path of a plan written by RecordingTransaction
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line, object_hook=_decode_value)
+
+
+def get_plan_batches(records: Iterable[list], batch_size: int = BATCH_SIZE) -> tuple:
+    """Method to group the records of a plan into node and relation batches.
+
+    Relations refer to their endpoints by natural key, so nodes of a label
+    without a key property cannot be linked and are reported.
+    :param records: Records of a plan
+    :param batch_size: Maximum number of rows per batch
+    :return: Node batches and relation batches, as used by the writer pool
+    """
+    node_keys = {}
+    node_rows: Dict[str, list] = {}
+    edge_rows: Dict[tuple, list] = {}
+
+    for record in records:
+        if record[0] == "n":
+            _, node_id, labels, properties = record
+            label = labels[0]
+            node_keys[node_id] = (label, properties.get(NODE_KEY_PROPERTIES.get(label)))
+            node_rows.setdefault(label, []).append(properties)
+        else:
+            _, rel_type, start, end, properties = record
+            start_label, start_key = node_keys[start]
+            end_label, end_key = node_keys[end]
+            edge_rows.setdefault((rel_type, start_label, end_label), []).append(
+                (start_key, properties, end_key)
+            )
+
+    unkeyed = {label for label in node_rows if label not in NODE_KEY_PROPERTIES}
+    if unkeyed:
+        logger.warning(f"Labels without a key property: {', '.join(sorted(unkeyed))}")
+
+    return split_node_rows(node_rows, batch_size), split_edge_rows(edge_rows, batch_size)
+
+
+def replay_plan(
+    graph: Graph,
+    plan: Union[str, Iterable[list]],
+    workers: int = 4,
+    batch_size: int = BATCH_SIZE,
+    clear: bool = True,
+) -> dict:
+    """Main function to write a recorded plan to a server as fast as possible.
+
+    The plan is grouped into batches before any write, so that the measured
+    time only covers the database ingest.
+    :param graph: Graph connection with a pool of at least `workers` connections
+    :param plan: Path of a plan file, or the records of a RecordingTransaction
+    :param workers: Number of concurrent transactions
+    :param batch_size: Maximum number of rows per transaction
+    :param clear: Delete the existing graph first
+    :return: Counts, durations and throughput of the replay
+    """
+    records = read_plan(plan) if isinstance(plan, str) else plan
+    node_batches, edge_batches = get_plan_batches(records, batch_size=batch_size)
+
+    if clear:
+        graph.delete_all()
+    ensure_key_indexes(graph)
+    ensure_range_indexes(graph)
+    ensure_fulltext_indexes(graph)
+
+    pool = WriterPool(graph=graph, workers=workers)
+    stats = {
+        "nodes": sum(len(batch.rows) for batch in node_batches),
+        "relationships": sum(len(batch.rows) for batch in edge_batches),
+    }
+
+    start = time.perf_counter()
+    pool.write(node_batches, _write_nodes)
+    stats["node_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pool.write(edge_batches, _write_edges)
+    stats["relationship_seconds"] = time.perf_counter() - start
+    invalidate_caches(graph.name)
+
+    stats["nodes_per_second"] = stats["nodes"] / stats["node_seconds"]
+    stats["relationships_per_second"] = (
+        stats["relationships"] / stats["relationship_seconds"]
+    )
+
+    logger.warning(
+        f"Replayed {stats['nodes']} nodes at {stats['nodes_per_second']:.0f}/s and "
+        f"{stats['relationships']} relations at "
+        f"{stats['relationships_per_second']:.0f}/s"
+    )
+
+    return stats
+
+
+def record_plan(exp_dir: str, path: str, activity: bool = False) -> dict:
+    """Method to record the write plan of the processed data of an experiment.
+    :param exp_dir: Experiment directory with processed data
+    :param path: Path of the plan file
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Summary of the recorded plan
+    """
+    invivo_df, invitro_df = read_processed_data(exp_dir=exp_dir)
+
+    with RecordingTransaction(path) as tx:
+        node_dict = get_node_dict()
+        for df in (invivo_df, invitro_df):
+            if not df.empty:
+                node_dict = add_nodes(tx=tx, df=df, node_dict=node_dict)
+
+        add_relations(
+            invivo_df=invivo_df,
+            invitro_df=invitro_df,
+            node_mapping_dict=node_dict,
+            tx=tx,
+            activity=activity,
+        )
+
+    summary = tx.summary()
+    logger.warning(
+        f"Recorded {summary['nodes']} nodes and {summary['relationships']} "
+        f"relations to {path}"
+    )
+    return summary
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Record the graph writes of an experiment, or replay them."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record = subparsers.add_parser("record", help="Record a write plan")
+    record.add_argument("exp_dir", help="Experiment directory with processed data")
+    record.add_argument("plan", help="Plan file, gzip compressed if it ends with .gz")
+    record.add_argument(
+        "--activity", action="store_true", help="Add the compound activity relations"
+    )
+
+    replay = subparsers.add_parser("replay", help="Replay a write plan")
+    replay.add_argument("plan", help="Plan file written by the record command")
+    replay.add_argument("--uri", default=os.environ.get("NEO4J_URI", DEFAULT_URI))
+    replay.add_argument("--user", default=os.environ.get("NEO4J_USER", DEFAULT_USER))
+    add_password_argument(replay)
+    replay.add_argument("--database", help="Neo4J database, the default one if omitted")
+    replay.add_argument("--workers", type=int, default=4)
+    replay.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = get_parser().parse_args(argv)
+
+    if args.command == "record":
+        print(json.dumps(record_plan(args.exp_dir, args.plan, activity=args.activity), indent=2))
+        return 0
+
+    graph = Graph(
+        args.uri,
+        auth=(args.user, args.password),
+        name=args.database,
+        max_size=max(args.workers, 1),
+    )
+    stats = replay_plan(
+        graph, args.plan, workers=args.workers, batch_size=args.batch_size
+    )
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
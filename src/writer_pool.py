@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""Concurrent loading of the graph through a pool of writer threads."""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, FrozenSet, List, NamedTuple, Optional
+
+import pandas as pd
+from py2neo import Graph
+from py2neo.bulk import create_nodes, create_relationships
+from py2neo.errors import ConnectionBroken, ConnectionUnavailable, TransientError
+
+from collector import build_graph, get_node_keys, hash_content
+from incremental import ensure_key_indexes
+from ledger import BatchLedger
+from constants import NODE_KEY_PROPERTIES
+
+logger = logging.getLogger("__name__")
+
+BATCH_SIZE = 1000
+RETRYABLE_ERRORS = (TransientError, ConnectionBroken, ConnectionUnavailable)
+
+
+class Batch(NamedTuple):
+    """Unit of work committed in its own transaction."""
+
+    kind: str  # node label or relation type
+    start_label: str
+    end_label: str
+    rows: list
+    locks: FrozenSet[tuple]  # (label, key) of the existing nodes touched
+    batch_id: int = 0  # position of the batch within its load stage
+
+
+def get_node_batches(node_dict: dict, batch_size: int = BATCH_SIZE) -> List[Batch]:
+    """Split the nodes into batches of a single label.
+
+    Creating nodes does not lock existing ones, so node batches never conflict.
+    :param node_dict: Node dictionary produced by add_nodes
+    :param batch_size: Maximum number of nodes per batch
+    """
+    node_rows = {
+        label: [dict(node) for node in nodes.values()]
+        for label, nodes in node_dict.items()
+    }
+    return split_node_rows(node_rows, batch_size=batch_size)
+
+
+def split_node_rows(
+    node_rows: Dict[str, list], batch_size: int = BATCH_SIZE
+) -> List[Batch]:
+    """Split the property rows of the nodes of every label into batches."""
+    batches = []
+
+    for label, rows in node_rows.items():
+        for start in range(0, len(rows), batch_size):
+            batches.append(
+                Batch(
+                    label,
+                    label,
+                    label,
+                    rows[start : start + batch_size],
+                    frozenset(),
+                    len(batches),
+                )
+            )
+
+    return batches
+
+
+def get_edge_batches(
+    node_dict: dict,
+    relationships: list,
+    batch_size: int = BATCH_SIZE,
+) -> List[Batch]:
+    """Split the relations into batches together with the nodes they lock.
+    :param node_dict: Node dictionary produced by add_nodes
+    :param relationships: Relations produced by add_relations
+    :param batch_size: Maximum number of relations per batch
+    """
+    node_keys = get_node_keys(node_dict)
+
+    groups: Dict[tuple, list] = {}
+    for rel in relationships:
+        start_label, start_key = node_keys[id(rel.start_node)]
+        end_label, end_key = node_keys[id(rel.end_node)]
+        groups.setdefault((type(rel).__name__, start_label, end_label), []).append(
+            (start_key, dict(rel), end_key)
+        )
+
+    return split_edge_rows(groups, batch_size=batch_size)
+
+
+def split_edge_rows(
+    edge_rows: Dict[tuple, list], batch_size: int = BATCH_SIZE
+) -> List[Batch]:
+    """Split (start key, properties, end key) rows into batches with their locks.
+
+    Relations are sorted by their endpoints, so that the edges of a highly
+    connected node end up in as few batches as possible and only those batches
+    have to wait for each other.
+    :param edge_rows: Rows per (relation type, start label, end label)
+    :param batch_size: Maximum number of relations per batch
+    """
+    batches = []
+    for (rel_type, start_label, end_label), rows in edge_rows.items():
+        rows.sort(key=lambda row: (str(row[2]), str(row[0])))
+
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start : start + batch_size]
+            locks = frozenset(
+                [(start_label, row[0]) for row in chunk]
+                + [(end_label, row[2]) for row in chunk]
+            )
+            batches.append(
+                Batch(rel_type, start_label, end_label, chunk, locks, len(batches))
+            )
+
+    return batches
+
+
+def _write_nodes(tx, batch: Batch) -> None:
+    create_nodes(tx, batch.rows, labels={batch.kind})
+
+
+def _write_edges(tx, batch: Batch) -> None:
+    create_relationships(
+        tx,
+        batch.rows,
+        batch.kind,
+        start_node_key=(batch.start_label, NODE_KEY_PROPERTIES[batch.start_label]),
+        end_node_key=(batch.end_label, NODE_KEY_PROPERTIES[batch.end_label]),
+    )
+
+
+class WriterPool:
+    """Pool of writer threads committing batches in concurrent transactions.
+
+    Batches that lock a common node are never in flight at the same time. The
+    number of concurrent transactions is halved whenever a commit is much slower
+    than the running average or fails with a transient error, and grows back by
+    one on every normal commit.
+    """
+
+    def __init__(
+        self,
+        graph: Graph,
+        workers: int = 4,
+        max_retries: int = 5,
+        slow_factor: float = 2.0,
+    ):
+        self.graph = graph
+        self.workers = workers
+        self.max_retries = max_retries
+        self.slow_factor = slow_factor
+
+        self._condition = threading.Condition()
+        self._limit = workers
+        self._in_flight = 0
+        self._locked = set()
+        self._latency = None
+
+    def write(
+        self,
+        batches: List[Batch],
+        write_batch: Callable,
+        on_commit: Optional[Callable] = None,
+    ) -> None:
+        """Commit all batches, blocking until every one of them is written.
+        :param batches: Batches to write
+        :param write_batch: Function writing one batch to a transaction
+        :param on_commit: Function called with every batch once it is committed
+        """
+        pending = list(batches)
+        futures = []
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while pending:
+                with self._condition:
+                    batch = self._next_batch(pending)
+                    while batch is None:
+                        self._condition.wait()
+                        batch = self._next_batch(pending)
+
+                    pending.remove(batch)
+                    self._locked.update(batch.locks)
+                    self._in_flight += 1
+
+                futures.append(
+                    executor.submit(self._run, batch, write_batch, on_commit)
+                )
+
+        for future in futures:
+            future.result()  # re-raise errors from the writer threads
+
+    def _next_batch(self, pending: List[Batch]):
+        """First pending batch that can start now, if any."""
+        if self._in_flight >= self._limit:
+            return None
+
+        for batch in pending:
+            if self._locked.isdisjoint(batch.locks):
+                return batch
+
+        return None
+
+    def _run(
+        self, batch: Batch, write_batch: Callable, on_commit: Optional[Callable]
+    ) -> None:
+        try:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                tx = None
+                try:
+                    tx = self.graph.begin()
+                    write_batch(tx, batch)
+                    self.graph.commit(tx)
+                except RETRYABLE_ERRORS as e:
+                    self._rollback(tx)
+                    self._throttle()
+                    if attempt == self.max_retries:
+                        raise
+
+                    logger.warning(f"Retrying {batch.kind} batch after error: {e}")
+                    time.sleep(0.1 * 2**attempt)
+                except BaseException:
+                    self._rollback(tx)
+                    raise
+                else:
+                    self._record_latency(time.perf_counter() - start)
+                    if on_commit is not None:
+                        on_commit(batch)
+                    return
+        finally:
+            with self._condition:
+                self._locked.difference_update(batch.locks)
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _rollback(self, tx) -> None:
+        """Roll back a failed transaction, if it was opened at all."""
+        if tx is None:
+            return
+        try:
+            self.graph.rollback(tx)
+        except Exception as e:
+            # Keep the error of the write, the transaction is gone anyway
+            logger.warning(f"Rollback failed: {e}")
+
+    def _record_latency(self, latency: float) -> None:
+        with self._condition:
+            if self._latency is not None and latency > self.slow_factor * self._latency:
+                self._limit = max(1, self._limit // 2)
+            else:
+                self._limit = min(self.workers, self._limit + 1)
+
+            if self._latency is None:
+                self._latency = latency
+            else:
+                self._latency = 0.8 * self._latency + 0.2 * latency
+
+    def _throttle(self) -> None:
+        with self._condition:
+            self._limit = max(1, self._limit // 2)
+
+
+def _write_stage(
+    pool: WriterPool,
+    stage: str,
+    batches: List[Batch],
+    write_batch: Callable,
+    ledger: Optional[BatchLedger],
+    hashes: Dict[int, str],
+) -> None:
+    """Write the batches of one stage, skipping those already in the ledger."""
+    if ledger is None:
+        logger.warning(f"Writing {len(batches)} {stage} batches")
+        pool.write(batches, write_batch)
+        return
+
+    pending = [
+        batch
+        for batch in batches
+        if not ledger.is_committed(stage, batch.batch_id, hashes[batch.batch_id])
+    ]
+
+    logger.warning(
+        f"Writing {len(pending)} {stage} batches, "
+        f"{len(batches) - len(pending)} already committed"
+    )
+    pool.write(
+        pending,
+        write_batch,
+        on_commit=lambda batch: ledger.record(
+            stage, batch.batch_id, hashes[batch.batch_id]
+        ),
+    )
+
+
+def load_graph(
+    graph: Graph,
+    invivo_df: pd.DataFrame,
+    invitro_df: pd.DataFrame,
+    workers: int = 4,
+    ledger: Optional[BatchLedger] = None,
+    measurements: bool = False,
+    activity: bool = False,
+) -> dict:
+    """Main function to populate the graph with concurrent writers.
+
+    The graph is cleared first, unless a ledger of an interrupted load of the
+    same inputs is given, in which case only the missing batches are written.
+    :param graph: Graph connection with a pool of at least `workers` connections
+    :param invivo_df: In-vivo data
+    :param invitro_df: In-vitro data
+    :param workers: Number of concurrent transactions
+    :param ledger: Ledger of the committed batches, to resume an interrupted load
+    :param measurements: Model every result row as a measurement node
+    :param activity: Add the Compound -> Bacteria activity relations
+    :return: Node dictionary of the written graph
+    """
+    node_dict, collector = build_graph(
+        invivo_df=invivo_df,
+        invitro_df=invitro_df,
+        measurements=measurements,
+        activity=activity,
+    )
+
+    node_batches = get_node_batches(node_dict)
+    edge_batches = get_edge_batches(node_dict, collector.relationships)
+
+    node_hashes, edge_hashes = {}, {}
+    if ledger is not None:
+        node_hashes = {b.batch_id: hash_content(b.rows) for b in node_batches}
+        edge_hashes = {b.batch_id: hash_content(b.rows) for b in edge_batches}
+
+    if ledger is not None and ledger.committed:
+        if ledger.is_consistent("nodes", node_hashes) and ledger.is_consistent(
+            "edges", edge_hashes
+        ):
+            logger.warning(f"Resuming load from {ledger.path}")
+        else:
+            logger.warning("Inputs changed since the interrupted load, starting over")
+            ledger.clear()
+            graph.delete_all()
+    else:
+        graph.delete_all()  # delete existing data
+
+    ensure_key_indexes(graph)
+
+    pool = WriterPool(graph=graph, workers=workers)
+
+    _write_stage(pool, "nodes", node_batches, _write_nodes, ledger, node_hashes)
+    _write_stage(pool, "edges", edge_batches, _write_edges, ledger, edge_hashes)
+
+    if ledger is not None:
+        ledger.clear()  # the load is complete
+
+    return node_dict